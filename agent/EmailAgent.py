@@ -2,11 +2,15 @@ import datetime
 from agents import Agent, Runner
 import os
 from dotenv import load_dotenv
+from typing import Optional
 from agent.context import UserInfo
-from agent.prompt import SYSTEM_INSTRUCTION
+from agent.invoice_fields import InvoiceFields
+from agent.prompt import SYSTEM_INSTRUCTION, EMAIL_CONTEXT
 from agent.tools import set_reminder_tool, send_urgent_message_tool, store_tool, dont_reply_tool
 from agent.reasoning_display import ReasoningDisplay
 from logger import setup_logger
+from constants import LOG_TOKEN_USAGE, RUN_LOG_ENABLED, REASONING_SAMPLE_RATE
+import random
 import asyncio
 
 load_dotenv()
@@ -20,25 +24,72 @@ MOCK_USERID = "mock_userid"
 #     body: str = Field(..., description="The body of the email reply.")
 
 
-async def invoke_email_agent(input_text: str, user_name: str, current_date: str, show_reasoning: bool = False):
-    """Invoke the EmailAgent with the provided input and user information."""
-    INSTRUCTIONS = SYSTEM_INSTRUCTION.format(user_name=user_name, current_date=current_date)
+# Built once: the instructions and tool schemas are identical for every email,
+# which keeps the request prefix stable for provider-side prompt caching.
+email_agent = Agent(
+    name="EmailAgent",
+    instructions=SYSTEM_INSTRUCTION,
+    tools=[set_reminder_tool, send_urgent_message_tool, store_tool, dont_reply_tool],
+    model="gpt-4.1-mini",
+)
 
-    context = UserInfo(user_id=MOCK_USERID, user_email=os.getenv("EMAIL_USER"), original_input=input_text)
 
-    email_agent = Agent(
-        name="EmailAgent",
-        instructions=INSTRUCTIONS,
-        tools=[set_reminder_tool, send_urgent_message_tool, store_tool, dont_reply_tool],
-        model="gpt-4.1-mini",
+def log_token_usage(result) -> dict:
+    """Log and return the token usage of a run, including how much of the input was served from cache."""
+    usage = result.context_wrapper.usage
+    cached = usage.input_tokens_details.cached_tokens or 0
+    stats = {
+        "requests": usage.requests,
+        "input_tokens": usage.input_tokens,
+        "cached_tokens": cached,
+        "output_tokens": usage.output_tokens,
+    }
+    logger.info(
+        "Token usage: %d requests, %d input (%d cached, %.0f%%), %d output",
+        usage.requests,
+        usage.input_tokens,
+        cached,
+        100 * cached / usage.input_tokens if usage.input_tokens else 0,
+        usage.output_tokens,
     )
+    return stats
+
+
+async def invoke_email_agent(
+    input_text: str,
+    user_name: str,
+    current_date: str,
+    show_reasoning: bool = False,
+    record_usage: bool = LOG_TOKEN_USAGE,
+    save_log: bool = RUN_LOG_ENABLED,
+    invoice_fields: Optional[InvoiceFields] = None,
+    account_user: Optional[str] = None,
+):
+    """Invoke the EmailAgent with the provided input and user information."""
+    context = UserInfo(
+        user_id=MOCK_USERID,
+        user_email=account_user or os.getenv("EMAIL_USER"),
+        original_input=input_text,
+        sender=user_name,
+        invoice_fields=invoice_fields,
+    )
+
+    hints = invoice_fields.as_hints() if invoice_fields is not None else ""
+    agent_input = input_text + hints + EMAIL_CONTEXT.format(user_name=user_name, current_date=current_date)
+    result =  await Runner.run(email_agent, input=agent_input, context=context)
+
+    if record_usage and result:
+        log_token_usage(result)
 
-    result =  await Runner.run(email_agent, input=input_text, context=context)
+    if save_log and result:
+        try:
+            await asyncio.to_thread(ReasoningDisplay.save_reasoning_log, result)
+        except Exception as e:
+            logger.error("Failed to save the reasoning log: %s", e)
 
-    if show_reasoning and result:
-        print("\n" + "🎯 AGENT REASONING" + "\n")
-        ReasoningDisplay.print_step_by_step_reasoning(result, show_details=True)
-        print("\n" + "="*60)
+    # Only a sample of runs, and through the log queue: the full trace is in the run log anyway
+    if show_reasoning and result and random.random() < REASONING_SAMPLE_RATE:
+        logger.info("🎯 AGENT REASONING\n%s", ReasoningDisplay.render_step_by_step_reasoning(result, show_details=True))
 
     if context.abort_response:
         logger.info("Response aborted - no reply will be sent as requested.")
@@ -0,0 +1,287 @@
+"""
+Fast local pre-classification of incoming emails, so clearly non-financial
+or no-reply mail is resolved without an LLM call.
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import CLASSIFIER_ENABLED, CLASSIFIER_SKIP_THRESHOLD, CLASSIFIER_LOG, CLASSIFIER_HISTORY_DB
+from utils.run_log import run_log
+
+
+logger = setup_logger()
+
+DONT_REPLY = re.compile(
+    r"\b(?:don'?t|do not|please don'?t) (?:reply|respond)\b"
+    r"|\bno (?:reply|response) (?:needed|necessary|required)\b"
+    r"|\bsvara inte\b|\binget svar (?:behövs|krävs)\b",
+    re.IGNORECASE,
+)
+
+# keyword -> weight; matches in the subject count double
+FINANCIAL_KEYWORDS = {
+    re.compile(r"\b(?:invoice|faktura|fakturanummer)\b", re.I): 3,
+    re.compile(r"\b(?:receipt|kvitto|orderbekräftelse)\b", re.I): 3,
+    re.compile(r"\b(?:statement|kontoutdrag|bill|räkning|avi)\b", re.I): 2,
+    re.compile(r"\b(?:due date|förfallodatum|förfaller|att betala|amount due|balance due)\b", re.I): 3,
+    re.compile(r"\b(?:bankgiro|plusgiro|ocr|iban|bic|swift)\b", re.I): 2,
+    re.compile(r"\b(?:payment|betalning|subscription|prenumeration|renewal|förnyelse)\b", re.I): 1,
+    re.compile(r"\b(?:total|summa|moms|vat|tax)\b", re.I): 1,
+    re.compile(r"(?:\b(?:sek|kr|eur|usd|gbp)\b|[€$£])", re.I): 1,
+}
+
+NEWSLETTER_MARKERS = re.compile(
+    r"\b(?:unsubscribe|avregistrera|avsluta prenumeration|newsletter|nyhetsbrev|view (?:it )?in (?:your )?browser"
+    r"|webinar|manage (?:your )?preferences)\b",
+    re.IGNORECASE,
+)
+
+FINANCIAL_ATTACHMENT_EXTENSIONS = {".pdf", ".xlsx", ".xls", ".csv", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+@dataclass
+class Classification:
+    label: str  # "financial", "non_financial", "no_reply" or "uncertain"
+    confidence: float
+    skip_agent: bool
+    reasons: List[str] = field(default_factory=list)
+
+
+class SenderHistory:
+    """
+    How often each sender's mail was classified as financial, kept as
+    per-sender counts in SQLite and shared by every worker process. A new
+    database is seeded once from the decision log.
+    """
+
+    def __init__(self, path: str = CLASSIFIER_HISTORY_DB, log_path: str = CLASSIFIER_LOG):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with self._transaction():
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sender_history (
+                    sender TEXT PRIMARY KEY,
+                    financial INTEGER NOT NULL,
+                    total INTEGER NOT NULL
+                )
+                """
+            )
+            # user_version marks the one-time import, so only one process does it
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+                self._import_log(log_path)
+                self._conn.execute("PRAGMA user_version = 1")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _import_log(self, log_path: str):
+        if not os.path.exists(log_path):
+            return
+        counts = defaultdict(lambda: [0, 0])  # sender -> [financial, total]
+        with open(log_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("label") in ("financial", "non_financial"):
+                    sender_counts = counts[entry.get("sender", "")]
+                    sender_counts[0] += entry["label"] == "financial"
+                    sender_counts[1] += 1
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sender_history (sender, financial, total) VALUES (?, ?, ?)",
+            [(sender, financial, total) for sender, (financial, total) in counts.items()],
+        )
+        logger.info("Imported the history of %d senders from %s", len(counts), log_path)
+
+    def record(self, sender: str, label: str):
+        if label not in ("financial", "non_financial"):
+            return
+        with self._transaction():
+            self._conn.execute(
+                """
+                INSERT INTO sender_history (sender, financial, total) VALUES (?, ?, 1)
+                ON CONFLICT (sender) DO UPDATE SET financial = financial + excluded.financial, total = total + 1
+                """,
+                (sender, int(label == "financial")),
+            )
+
+    def financial_ratio(self, sender: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT financial, total FROM sender_history WHERE sender = ?", (sender,)
+            ).fetchone()
+        financial, total = row or (0, 0)
+        return financial / total if total >= 3 else None
+
+
+def _financial_score(subject: str, body: str, reasons: List[str]) -> int:
+    score = 0
+    for pattern, weight in FINANCIAL_KEYWORDS.items():
+        if match := pattern.search(subject):
+            score += weight * 2
+            reasons.append(f"subject mentions {match.group(0)!r}")
+        elif match := pattern.search(body):
+            score += weight
+            reasons.append(f"body mentions {match.group(0)!r}")
+    return score
+
+
+def classify_email(
+    subject: str,
+    body: str,
+    attachment_names: List[str],
+    sender: str = "",
+    history: Optional[SenderHistory] = None,
+    skip_threshold: float = CLASSIFIER_SKIP_THRESHOLD,
+) -> Classification:
+    """
+    Classify an email using keywords, attachment types, sender history and
+    explicit "don't reply" phrases. Only non_financial and no_reply results
+    at or above `skip_threshold` confidence set skip_agent; financial mail
+    that asks for no reply still goes to the agent so it gets stored.
+    """
+    subject = subject or ""
+    body = body or ""
+    reasons: List[str] = []
+
+    score = _financial_score(subject, body, reasons)
+    financial_attachments = [
+        name for name in attachment_names if os.path.splitext(name)[1].lower() in FINANCIAL_ATTACHMENT_EXTENSIONS
+    ]
+    if financial_attachments:
+        score += 2
+        reasons.append(f"document attachments: {financial_attachments}")
+
+    ratio = history.financial_ratio(sender) if history is not None else None
+    if ratio is not None and ratio >= 0.8:
+        score += 2
+        reasons.append(f"sender history {ratio:.0%} financial")
+
+    dont_reply = DONT_REPLY.search(f"{subject}\n{body}")
+    newsletter_hits = len(NEWSLETTER_MARKERS.findall(body))
+    if newsletter_hits:
+        reasons.append(f"{newsletter_hits} newsletter markers")
+
+    if score >= 4:
+        label, confidence = "financial", min(1.0, 0.5 + 0.1 * score)
+    elif dont_reply and score == 0:
+        reasons.append(f"explicit no-reply phrase {dont_reply.group(0)!r}")
+        label, confidence = "no_reply", 0.95
+    elif score == 0 and not attachment_names:
+        label = "non_financial"
+        confidence = min(1.0, 0.7 + 0.1 * newsletter_hits)
+        if ratio is not None and ratio > 0.5:
+            confidence -= 0.2
+    elif score <= 1 and newsletter_hits >= 2 and not financial_attachments:
+        label, confidence = "non_financial", 0.8
+    else:
+        label, confidence = "uncertain", 0.5
+
+    skip_agent = label in ("non_financial", "no_reply") and confidence >= skip_threshold
+    return Classification(label, round(confidence, 2), skip_agent, reasons)
+
+
+class EmailClassifier:
+    """classify_email plus sender history and an append-only decision log for tuning."""
+
+    def __init__(
+        self,
+        log_path: str = CLASSIFIER_LOG,
+        enabled: bool = CLASSIFIER_ENABLED,
+        history_path: str = CLASSIFIER_HISTORY_DB,
+    ):
+        self.log_path = log_path
+        self.enabled = enabled
+        self.history = SenderHistory(history_path, log_path)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+
+    def classify(self, subject: str, body: str, attachment_names: List[str], sender: str) -> Classification:
+        result = classify_email(subject, body, attachment_names, sender, self.history)
+        if not self.enabled:
+            result.skip_agent = False
+
+        self.history.record(sender, result.label)
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "sender": sender,
+            "subject": subject,
+            "attachments": attachment_names,
+            **asdict(result),
+        }
+        with self._lock, open(self.log_path, "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return result
+
+
+def _split_agent_input(text: str) -> tuple[str, str, List[str]]:
+    """Recover subject, body and attachment names from an agent input as built by main.py."""
+    subject = re.search(r"^Subject: (.*)$", text, re.MULTILINE)
+    body = text.split("Email Body:\n", 1)[-1]
+    attachments = re.findall(r"^--- Attachment: (.*) ---$", text, re.MULTILINE)
+    return subject.group(1) if subject else "", body, attachments
+
+
+def _logged_runs(log_glob: Optional[str]):
+    """(name, run) of every run in the run log, or of the old JSON files matching `log_glob`."""
+    if not log_glob:
+        for data in run_log:
+            yield data.get("run_id", "?"), data
+        return
+    for path in sorted(glob.glob(log_glob)):
+        with open(path, "r") as f:
+            yield path, json.load(f)
+
+
+def evaluate(log_glob: Optional[str] = None, skip_threshold: float = CLASSIFIER_SKIP_THRESHOLD):
+    """
+    Replay the classifier over past reasoning logs (the run log, or old
+    JSON files matching `log_glob`) and compare it with what the agent did.
+    A run counts as skippable when the agent only called dont_reply_tool.
+    """
+    counts = defaultdict(int)
+    for path, data in _logged_runs(log_glob):
+        tools = {tool["tool_name"] for tool in data.get("reasoning_summary", {}).get("tools_used", [])}
+        agent_skipped = tools == {"dont_reply_tool"}
+        subject, body, attachments = _split_agent_input(data.get("input", ""))
+        result = classify_email(subject, body, attachments, skip_threshold=skip_threshold)
+        counts[(result.skip_agent, agent_skipped)] += 1
+        if result.skip_agent and not agent_skipped:
+            print(f"❌ Would wrongly skip {path}: {result.reasons}")
+
+    total = sum(counts.values())
+    print(f"\n📊 Classifier vs agent over {total} runs (threshold {skip_threshold}):")
+    print(f"   Skipped, agent agreed:      {counts[(True, True)]}")
+    print(f"   Skipped, agent acted:       {counts[(True, False)]}")
+    print(f"   Sent to agent, needed:      {counts[(False, False)]}")
+    print(f"   Sent to agent, unnecessary: {counts[(False, True)]}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m agent.classifier [log glob, "" for the run log] [threshold]
+    evaluate(*sys.argv[1:2], *(float(v) for v in sys.argv[2:3]))
@@ -1,8 +1,13 @@
 from dataclasses import dataclass
+from typing import Optional
+
+from agent.invoice_fields import InvoiceFields
 
 @dataclass
 class UserInfo:
     user_id: str
     user_email: str
     original_input: str
-    abort_response: bool = False
\ No newline at end of file
+    sender: str = ""
+    abort_response: bool = False
+    invoice_fields: Optional[InvoiceFields] = None
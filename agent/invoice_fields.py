@@ -0,0 +1,242 @@
+"""
+Rule-based extraction of invoice fields (amount, currency, due date, payment
+references, invoice number) from parsed email and attachment text, so the
+agent gets the same figures on every run instead of re-deriving them.
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+from constants import INVOICE_FIELDS_TRUST_THRESHOLD
+
+
+MONTHS = {
+    "jan": 1, "januari": 1, "january": 1,
+    "feb": 2, "februari": 2, "february": 2,
+    "mar": 3, "mars": 3, "march": 3,
+    "apr": 4, "april": 4,
+    "maj": 5, "may": 5,
+    "jun": 6, "juni": 6, "june": 6,
+    "jul": 7, "juli": 7, "july": 7,
+    "aug": 8, "augusti": 8, "august": 8,
+    "sep": 9, "sept": 9, "september": 9,
+    "okt": 10, "oct": 10, "oktober": 10, "october": 10,
+    "nov": 11, "november": 11,
+    "dec": 12, "december": 12,
+}
+
+# Between a label and its value: colons, table cell borders, spaces and at most one line break
+_GAP = r"[ \t:|*#.\-]*\n?[ \t:|*#]*"
+
+# Labels in order of preference; the first one that yields a value wins
+AMOUNT_LABELS = [
+    (r"(?:summa |totalt? |belopp )?att betala|amount due|balance due|total due|to pay", 0.95),
+    (r"totalbelopp|total amount|totalsumma|summa|total|belopp|amount", 0.85),
+]
+DUE_DATE_LABELS = [
+    (r"förfallodatum|förfallodag|förfaller|betalas senast|betala senast|sista betalningsdag"
+     r"|due date|payment due|pay by|due", 0.95),
+]
+INVOICE_NUMBER_LABELS = [
+    (r"fakturanummer|fakturanr\.?|faktura ?nr\.?|invoice (?:number|no\.?|#)|invoice ?#", 0.9),
+]
+
+_CURRENCY = r"(?:SEK|kr\.?|kronor|EUR|€|USD|\$|GBP|£|NOK|DKK)"
+_NUMBER = r"\d{1,3}(?:[  .,']\d{3})*(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+AMOUNT = re.compile(
+    rf"(?P<pre>{_CURRENCY})?\s?(?P<number>{_NUMBER})(?:\s?(?P<post>{_CURRENCY}))?(?!\d)(?![/.-]\d)",
+    re.IGNORECASE,
+)
+DATE_PATTERNS = [
+    re.compile(r"(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})"),
+    re.compile(r"(?P<y>\d{4})(?P<m>\d{2})(?P<d>\d{2})\b"),
+    re.compile(r"(?P<d>\d{1,2})[./](?P<m>\d{1,2})[./](?P<y>\d{4})"),
+    re.compile(r"(?P<d>\d{1,2})\.? (?P<mon>[a-zåäö]{3,9})\.? (?P<y>\d{4})", re.IGNORECASE),
+    re.compile(r"(?P<mon>[a-z]{3,9})\.? (?P<d>\d{1,2})(?:st|nd|rd|th)?,? (?P<y>\d{4})", re.IGNORECASE),
+]
+OCR = re.compile(r"\bOCR(?:[- ]?(?:nummer|nr\.?|number|referens|reference))?" + _GAP + r"(?P<value>\d[\d ]{1,28}\d)\b", re.I)
+BANKGIRO = re.compile(r"\b(?:bankgiro|bg)(?:[- ]?nr\.?|nummer)?" + _GAP + r"(?P<value>\d{3,4}-\d{4})\b", re.I)
+PLUSGIRO = re.compile(r"\b(?:plusgiro|pg)(?:[- ]?nr\.?|nummer)?" + _GAP + r"(?P<value>\d{1,7}-\d)\b", re.I)
+IBAN = re.compile(r"\b(?P<value>[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,4})?)\b")
+
+
+@dataclass
+class ExtractedField:
+    value: str
+    confidence: float
+    source: str  # the text the value was read from, for logging
+
+
+@dataclass
+class InvoiceFields:
+    fields: Dict[str, ExtractedField] = field(default_factory=dict)
+
+    def get(self, name: str) -> Optional[str]:
+        found = self.fields.get(name)
+        return found.value if found else None
+
+    def trusted(self, name: str, threshold: float = INVOICE_FIELDS_TRUST_THRESHOLD) -> Optional[str]:
+        """The value of a field if its confidence is high enough to use without the agent's reading."""
+        found = self.fields.get(name)
+        return found.value if found and found.confidence >= threshold else None
+
+    def as_hints(self, threshold: float = INVOICE_FIELDS_TRUST_THRESHOLD) -> str:
+        """Format the fields as an input block for the agent; empty when nothing was found."""
+        if not self.fields:
+            return ""
+        lines = [
+            f"{name}: {found.value} ({'verified' if found.confidence >= threshold else 'unverified'})"
+            for name, found in self.fields.items()
+        ]
+        return "\n\n<EXTRACTED FIELDS>\n" + "\n".join(lines)
+
+
+def luhn_valid(digits: str) -> bool:
+    """Mod 10 check used by Swedish OCR references and bankgiro numbers."""
+    digits = re.sub(r"\D", "", digits)
+    if len(digits) < 2:
+        return False
+    total = 0
+    for i, c in enumerate(reversed(digits)):
+        n = int(c) * (2 if i % 2 else 1)
+        total += n - 9 if n > 9 else n
+    return total % 10 == 0
+
+
+def iban_valid(iban: str) -> bool:
+    iban = iban.replace(" ", "")
+    if not 15 <= len(iban) <= 34:
+        return False
+    rearranged = iban[4:] + iban[:4]
+    return int("".join(str(int(c, 36)) for c in rearranged)) % 97 == 1
+
+
+def parse_amount(number: str) -> Optional[float]:
+    """Parse "1 234,50", "1.234,50", "1,234.50" and "1234" style amounts."""
+    number = re.sub(r"[  ']", "", number)
+    # A separator followed by one or two digits at the end is the decimal point
+    match = re.fullmatch(r"(.*?)(?:[.,](\d{1,2}))?", number)
+    whole, decimals = re.sub(r"[.,]", "", match.group(1)), match.group(2) or "0"
+    if not whole.isdigit():
+        return None
+    return float(f"{whole}.{decimals}")
+
+
+def normalize_currency(symbol: Optional[str]) -> Optional[str]:
+    if not symbol:
+        return None
+    symbol = symbol.lower().rstrip(".")
+    return {"kr": "SEK", "kronor": "SEK", "€": "EUR", "$": "USD", "£": "GBP"}.get(symbol, symbol.upper())
+
+
+def parse_date(text: str) -> Optional[date]:
+    for pattern in DATE_PATTERNS:
+        match = pattern.match(text)
+        if not match:
+            continue
+        parts = match.groupdict()
+        month = MONTHS.get(parts["mon"].lower()) if parts.get("mon") else int(parts["m"])
+        try:
+            return date(int(parts["y"]), month, int(parts["d"])) if month else None
+        except ValueError:
+            return None
+    return None
+
+
+def _labelled(text: str, labels, value_parser: Callable[[str], Optional[tuple]]) -> Optional[ExtractedField]:
+    """Find the first value that follows one of the labels, trying stronger labels first."""
+    for label, confidence in labels:
+        values = []
+        for match in re.finditer(rf"\b(?:{label})\b" + _GAP, text, re.IGNORECASE):
+            parsed = value_parser(text[match.end():match.end() + 60])
+            if parsed is not None:
+                values.append((parsed, " ".join(text[match.start():match.end() + 20].split())))
+        if values:
+            distinct = {value[0] for value, _ in values}
+            # Different values under the same label (e.g. per-line totals) make the pick less certain
+            if len(distinct) > 1:
+                confidence -= 0.15
+            value, source = values[-1]
+            return ExtractedField(value=value, confidence=confidence, source=source)
+    return None
+
+
+def _amount_value(snippet: str) -> Optional[tuple]:
+    match = AMOUNT.match(snippet)
+    if not match:
+        return None
+    amount = parse_amount(match.group("number"))
+    if amount is None:
+        return None
+    return (f"{amount:.2f}", normalize_currency(match.group("pre") or match.group("post")))
+
+
+def _date_value(snippet: str) -> Optional[tuple]:
+    parsed = parse_date(snippet)
+    return (parsed.isoformat(), None) if parsed else None
+
+
+def _invoice_number_value(snippet: str) -> Optional[tuple]:
+    match = re.match(r"([A-Z0-9][A-Z0-9\-/]{2,24})\b", snippet, re.IGNORECASE)
+    return (match.group(1), None) if match and re.search(r"\d", match.group(1)) else None
+
+
+def _reference(pattern: re.Pattern, text: str, validator: Callable[[str], bool]) -> Optional[ExtractedField]:
+    for match in pattern.finditer(text):
+        value = match.group("value").strip()
+        if validator(value):
+            return ExtractedField(value=value, confidence=0.98, source=match.group(0))
+    match = pattern.search(text)
+    if match:
+        return ExtractedField(value=match.group("value").strip(), confidence=0.6, source=match.group(0))
+    return None
+
+
+def extract_invoice_fields(texts: List[str]) -> InvoiceFields:
+    """
+    Extract invoice fields from the email body and attachment pages.
+
+    Every field gets a confidence: labelled values score high, and payment
+    references whose check digits validate score highest. Values that
+    only appear without a label are not guessed at.
+    """
+    text = "\n\n".join(t for t in texts if t)
+    result = InvoiceFields()
+
+    amount = _labelled(text, AMOUNT_LABELS, _amount_value)
+    if amount is not None:
+        value, currency = amount.value
+        result.fields["amount"] = ExtractedField(value, amount.confidence, amount.source)
+        if currency is None:
+            # Fall back to the currency the document mentions most
+            mentions = [normalize_currency(m) for m in re.findall(rf"(?<![A-Za-z]){_CURRENCY}(?![A-Za-z])", text, re.I)]
+            if mentions:
+                currency = max(set(mentions), key=mentions.count)
+        if currency:
+            result.fields["currency"] = ExtractedField(currency, amount.confidence, amount.source)
+
+    for name, labels, parser in (
+        ("due_date", DUE_DATE_LABELS, _date_value),
+        ("invoice_number", INVOICE_NUMBER_LABELS, _invoice_number_value),
+    ):
+        found = _labelled(text, labels, parser)
+        if found is not None:
+            result.fields[name] = ExtractedField(found.value[0], found.confidence, found.source)
+
+    for name, pattern, validator in (
+        ("ocr", OCR, luhn_valid),
+        ("bankgiro", BANKGIRO, luhn_valid),
+        ("plusgiro", PLUSGIRO, luhn_valid),
+        ("iban", IBAN, iban_valid),
+    ):
+        found = _reference(pattern, text, validator)
+        if found is not None:
+            if name == "ocr":
+                found.value = found.value.replace(" ", "")
+            if name == "iban" and found.confidence < 0.9:
+                continue  # unvalidated IBAN-looking strings are usually something else
+            result.fields[name] = found
+
+    return result
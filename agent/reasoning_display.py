@@ -8,6 +8,13 @@ from typing import List, Dict, Any
 from agents.result import RunResult
 from agents.items import ToolCallItem, ToolCallOutputItem, MessageOutputItem
 
+from logger import setup_logger
+from utils.run_log import RunLog, run_log
+from utils.run_index import RunIndex, run_index
+
+
+logger = setup_logger()
+
 
 class ReasoningDisplay:
     """Utility class to display agent reasoning in a structured way."""
@@ -21,20 +28,26 @@ class ReasoningDisplay:
             result: The RunResult from the agent execution
             show_details: Whether to show detailed information like tool arguments
         """
-        print("\n" + "="*60)
-        print("🧠 AGENT REASONING BREAKDOWN")
-        print("="*60)
+        print(ReasoningDisplay.render_step_by_step_reasoning(result, show_details))
+
+    @staticmethod
+    def render_step_by_step_reasoning(result: RunResult, show_details: bool = True) -> str:
+        """The breakdown printed by print_step_by_step_reasoning, as a string (e.g. to log it)."""
+        lines = []
+        lines.append("\n" + "="*60)
+        lines.append("🧠 AGENT REASONING BREAKDOWN")
+        lines.append("="*60)
         
-        print(f"📋 Agent: {result.last_agent.name}")
-        print(f"⚡ Model: {result.last_agent.model}")
-        print(f"🕐 Execution Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        lines.append(f"📋 Agent: {result.last_agent.name}")
+        lines.append(f"⚡ Model: {result.last_agent.model}")
+        lines.append(f"🕐 Execution Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
         # Show input analysis
-        print(f"\n📥 INPUT ANALYSIS:")
-        print(f"   {result.input[:100]}..." if len(result.input) > 100 else f"   {result.input}")
+        lines.append(f"\n📥 INPUT ANALYSIS:")
+        lines.append(f"   {result.input[:100]}..." if len(result.input) > 100 else f"   {result.input}")
         
         # Process the conversation flow
-        print(f"\n🔄 REASONING FLOW:")
+        lines.append(f"\n🔄 REASONING FLOW:")
         
         step_number = 1
         tool_calls = []
@@ -52,47 +65,48 @@ class ReasoningDisplay:
         
         # Show reasoning for each tool call
         for i, tool_call in enumerate(tool_calls):
-            print(f"\n   Step {step_number}: 🔧 DECISION TO USE TOOL")
-            print(f"   └─ Tool: {tool_call.raw_item.name}")
+            lines.append(f"\n   Step {step_number}: 🔧 DECISION TO USE TOOL")
+            lines.append(f"   └─ Tool: {tool_call.raw_item.name}")
             
             if show_details:
                 # Parse and display arguments in a readable way
                 try:
                     args = json.loads(tool_call.raw_item.arguments)
-                    print(f"   └─ Reasoning: {args.get('reason', 'No reason provided')}")
+                    lines.append(f"   └─ Reasoning: {args.get('reason', 'No reason provided')}")
                     
                     # Show other arguments (excluding reason)
                     other_args = {k: v for k, v in args.items() if k != 'reason'}
                     if other_args:
-                        print(f"   └─ Parameters:")
+                        lines.append(f"   └─ Parameters:")
                         for key, value in other_args.items():
                             if isinstance(value, dict):
-                                print(f"      • {key}:")
+                                lines.append(f"      • {key}:")
                                 for sub_key, sub_value in value.items():
-                                    print(f"        - {sub_key}: {sub_value}")
+                                    lines.append(f"        - {sub_key}: {sub_value}")
                             else:
-                                print(f"      • {key}: {value}")
+                                lines.append(f"      • {key}: {value}")
                 except json.JSONDecodeError:
-                    print(f"   └─ Arguments: {tool_call.raw_item.arguments}")
+                    lines.append(f"   └─ Arguments: {tool_call.raw_item.arguments}")
             
             step_number += 1
         
         # Show tool execution results
         for i, output in enumerate(tool_outputs):
-            print(f"\n   Step {step_number}: ✅ TOOL EXECUTION RESULT")
-            print(f"   └─ Output: {output.output}")
+            lines.append(f"\n   Step {step_number}: ✅ TOOL EXECUTION RESULT")
+            lines.append(f"   └─ Output: {output.output}")
             step_number += 1
         
         # Show final reasoning and response
         if final_message:
-            print(f"\n   Step {step_number}: 💭 FINAL RESPONSE GENERATION")
+            lines.append(f"\n   Step {step_number}: 💭 FINAL RESPONSE GENERATION")
             content = final_message.raw_item.content[0].text if final_message.raw_item.content else "No content"
-            print(f"   └─ Generated Response: {content[:150]}..." if len(content) > 150 else f"   └─ Generated Response: {content}")
+            lines.append(f"   └─ Generated Response: {content[:150]}..." if len(content) > 150 else f"   └─ Generated Response: {content}")
         
-        print(f"\n📤 FINAL OUTPUT:")
-        print(f"{result.final_output}")
+        lines.append(f"\n📤 FINAL OUTPUT:")
+        lines.append(f"{result.final_output}")
         
-        print("\n" + "="*60)
+        lines.append("\n" + "="*60)
+        return "\n".join(lines)
 
     @staticmethod
     def get_reasoning_summary(result: RunResult) -> Dict[str, Any]:
@@ -156,12 +170,8 @@ class ReasoningDisplay:
                     print(f"  {i+1}. 🤖 Assistant: {content[0]['text'][:50]}...")
 
     @staticmethod
-    def save_reasoning_log(result: RunResult, filename: str = None) -> str:
-        """Save detailed reasoning log to a file."""
-        if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"reasoning_log_{timestamp}.json"
-        
+    def save_reasoning_log(result: RunResult, store: RunLog = None, index: RunIndex = None) -> str:
+        """Append a detailed reasoning log to the run log, index it for search and return its run id."""
         log_data = {
             "timestamp": datetime.now().isoformat(),
             "agent_name": result.last_agent.name,
@@ -172,8 +182,7 @@ class ReasoningDisplay:
             "full_trace": result.to_input_list()
         }
 
-        with open(f"logs/{filename}", 'w') as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
-        
-        print(f"💾 Reasoning log saved to: {filename}")
-        return filename
+        run_id = (store or run_log).append(log_data)
+        (index or run_index).add(log_data)
+        logger.info("Reasoning log saved as run %s", run_id)
+        return run_id
@@ -1,8 +1,13 @@
+from datetime import datetime, time as day_time
+from typing import Optional
+
 from agents import RunContextWrapper, function_tool
 from pydantic import BaseModel, Field
 
 from agent.context import UserInfo
+from agent.invoice_fields import parse_date
 from logger import setup_logger 
+from utils.reminders import reminder_scheduler
 
 logger = setup_logger()
 
@@ -11,6 +16,18 @@ class ReminderRequest(BaseModel):
     reminder: str = Field(..., description="The reminder message to be set.")
     time: str = Field(..., description="The time when the reminder should trigger.")
 
+def parse_reminder_time(text: str) -> Optional[datetime]:
+    """Parse an ISO date/time; a bare date (in any format the invoice parser knows) means 09:00 that day."""
+    text = text.strip()
+    if ":" in text:
+        try:
+            return datetime.fromisoformat(text)
+        except ValueError:
+            pass
+    day = parse_date(text)
+    return datetime.combine(day, day_time(9, 0)) if day else None
+
+
 @function_tool
 def set_reminder_tool(wrapper: RunContextWrapper[UserInfo], reminder: ReminderRequest, reason: str) -> str:
     """
@@ -21,4 +38,9 @@ def set_reminder_tool(wrapper: RunContextWrapper[UserInfo], reminder: ReminderRe
     user_email = wrapper.context.user_email
     logger.info(f"Setting reminder for user {user_email}: {reminder.reminder} at {reminder.time}")
 
-    return f"Reminder set for user {user_email}: '{reminder.reminder}' at {reminder.time}."
\ No newline at end of file
+    when = parse_reminder_time(reminder.time)
+    if when is None:
+        return f"Could not understand the reminder time '{reminder.time}'; use YYYY-MM-DD or YYYY-MM-DD HH:MM."
+    scheduled = reminder_scheduler.add(user_email or "", reminder.reminder, when.timestamp())
+
+    return f"Reminder {scheduled.reminder_id} set for user {user_email}: '{reminder.reminder}' at {when:%Y-%m-%d %H:%M}."
\ No newline at end of file
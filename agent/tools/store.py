@@ -1,5 +1,7 @@
 from agents import RunContextWrapper, function_tool
 from agent.context import UserInfo
+from agent.invoice_fields import normalize_currency, parse_amount, parse_date, AMOUNT
+from utils.records import record_store
 from pydantic import BaseModel, Field
 from logger import setup_logger
 
@@ -16,8 +18,39 @@ def store_tool(wrapper: RunContextWrapper[UserInfo], extracted_content: Extracte
     """Stores information in a database."""
     user_email = wrapper.context.user_email
 
+    # Locally extracted fields that passed validation win over the model's reading
+    fields = wrapper.context.invoice_fields
+    if fields is not None:
+        if (due_date := fields.trusted("due_date")) and due_date != extracted_content.due_date:
+            logger.info(f"Using extracted due date {due_date} instead of {extracted_content.due_date}")
+            extracted_content.due_date = due_date
+        if amount := fields.trusted("amount"):
+            currency = fields.trusted("currency")
+            amount = f"{amount} {currency}" if currency else amount
+            if amount != extracted_content.amount:
+                logger.info(f"Using extracted amount {amount} instead of {extracted_content.amount}")
+                extracted_content.amount = amount
+
     logger.info(f"Storing information for user {user_email} for reason: {reason}")
     logger.info(f"Storing information for user {user_email}: {str(extracted_content)}")
 
+    # Keep the agent's strings, plus normalized values for the indexed queries
+    amount_match = AMOUNT.search(extracted_content.amount)
+    amount = parse_amount(amount_match.group("number")) if amount_match else None
+    currency = normalize_currency(amount_match.group("pre") or amount_match.group("post")) if amount_match else None
+    if currency is None and fields is not None:
+        currency = fields.get("currency")
+    due_date = parse_date(extracted_content.due_date.strip())
+
+    record_id = record_store.add(
+        user=user_email or "",
+        sender=wrapper.context.sender,
+        due_date=due_date.isoformat() if due_date else None,
+        amount=amount,
+        currency=currency,
+        amount_text=extracted_content.amount,
+        description=extracted_content.description,
+        category=extracted_content.category,
+    )
 
-    return f"Information stored for user {user_email} for reason: '{reason}'."
+    return f"Information stored as record {record_id} for user {user_email} for reason: '{reason}'."
@@ -3,6 +3,7 @@ from pydantic import BaseModel, Field
 
 from agent.context import UserInfo
 from logger import setup_logger 
+from utils.alerts import alert_dispatcher
 
 logger = setup_logger()
 
@@ -16,7 +17,7 @@ def send_urgent_message_tool(wrapper: RunContextWrapper[UserInfo], urgent_reques
     logger.info("Using send_urgent_message_tool to send an urgent message for the reason: " + reason)
     user_email = wrapper.context.user_email
 
-    # Here you would implement the logic to set the reminder, e.g., save to a database or schedule a task.
-    # For demonstration, we will just return a confirmation message.
+    # Only queued here; the dispatcher sends it in the background
+    alert_id = alert_dispatcher.enqueue(user_email or "", urgent_request.message, reason)
 
-    return f"Urgent sms sent for user {user_email}: '{urgent_request.message}'."
\ No newline at end of file
+    return f"Urgent sms {alert_id} queued for user {user_email}: '{urgent_request.message}'."
\ No newline at end of file
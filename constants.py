@@ -7,3 +7,140 @@ MAILBOX = "INBOX"
 HOST = "imap.gmail.com"
 USER = os.getenv("EMAIL_USER")
 ONLY_ANSWER_TO_EMAIL = os.getenv("EMAIL_USER")
+
+# Number of emails processed concurrently and how many may wait in the queue
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "4"))
+WORK_QUEUE_SIZE = int(os.getenv("WORK_QUEUE_SIZE", "100"))
+
+# Attempts at an email that fails (with backoff from EMAIL_RETRY_SECONDS); after that it waits for a restart
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "3"))
+EMAIL_RETRY_SECONDS = float(os.getenv("EMAIL_RETRY_SECONDS", "10"))
+
+# Run the agent and reply for one sender's emails in arrival order; downloads and extraction are never ordered
+SENDER_ORDERING = os.getenv("SENDER_ORDERING", "true").lower() == "true"
+
+# Durable UID checkpoint so restarts and reconnects resume where they left off
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "state/checkpoint.db")
+CATCHUP_BATCH_SIZE = int(os.getenv("CATCHUP_BATCH_SIZE", "50"))
+
+# On-disk cache of parsed attachments, keyed by file content
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "cache/parse")
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "500"))
+PARSE_CACHE_MAX_AGE_DAYS = int(os.getenv("PARSE_CACHE_MAX_AGE_DAYS", "30"))
+
+# Attachment extraction: files parsed at once across all emails, and per-file timeout
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "4"))
+EXTRACT_TIMEOUT_SECONDS = float(os.getenv("EXTRACT_TIMEOUT_SECONDS", "120"))
+
+# Use a PDF's own text layer when it is good enough, only OCR the remaining pages
+LOCAL_TEXT_LAYER = os.getenv("LOCAL_TEXT_LAYER", "true").lower() == "true"
+LOCAL_TEXT_MIN_CHARS = int(os.getenv("LOCAL_TEXT_MIN_CHARS", "50"))
+
+# Attachments are streamed to disk part by part; oversized or skip-listed parts are ignored
+ATTACHMENT_MAX_MB = float(os.getenv("ATTACHMENT_MAX_MB", "25"))
+ATTACHMENT_CHUNK_BYTES = int(os.getenv("ATTACHMENT_CHUNK_BYTES", str(1024 * 1024)))
+ATTACHMENT_SKIP_TYPES = [
+    t.strip().lower()
+    for t in os.getenv("ATTACHMENT_SKIP_TYPES", "application/pkcs7-signature,application/x-pkcs7-signature,.p7s").split(",")
+    if t.strip()
+]
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "tmp/attachments")
+ATTACHMENT_REFS_DB = os.getenv("ATTACHMENT_REFS_DB", "state/attachment_refs.db")
+ATTACHMENT_RETENTION_HOURS = float(os.getenv("ATTACHMENT_RETENTION_HOURS", "24"))
+ATTACHMENT_SWEEP_SECONDS = float(os.getenv("ATTACHMENT_SWEEP_SECONDS", "3600"))  # how often leftovers are swept
+
+# Outgoing mail; the connection is kept open between replies
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_AUTH = os.getenv("SMTP_AUTH", "xoauth2").lower()  # "xoauth2" or "none" for a local test server
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "240"))
+SMTP_NOOP_AFTER = float(os.getenv("SMTP_NOOP_AFTER", "30"))
+
+# OAuth token shared by IMAP and SMTP, refreshed this many seconds before expiry
+TOKEN_FILE = os.getenv("TOKEN_FILE", "token.pickle")
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+# Local pre-classifier that resolves clearly non-financial/no-reply mail without the LLM
+CLASSIFIER_ENABLED = os.getenv("CLASSIFIER_ENABLED", "true").lower() == "true"
+CLASSIFIER_SKIP_THRESHOLD = float(os.getenv("CLASSIFIER_SKIP_THRESHOLD", "0.8"))
+CLASSIFIER_LOG = os.getenv("CLASSIFIER_LOG", "logs/classifier_decisions.jsonl")
+# Per-sender financial/total counts, so the decision log isn't replayed on every start
+CLASSIFIER_HISTORY_DB = os.getenv("CLASSIFIER_HISTORY_DB", "state/sender_history.db")
+
+# Log input/cached/output token counts of every agent run
+LOG_TOKEN_USAGE = os.getenv("LOG_TOKEN_USAGE", "true").lower() == "true"
+
+# Upper bound on the tokens of email + attachment text sent to the agent
+AGENT_INPUT_TOKEN_BUDGET = int(os.getenv("AGENT_INPUT_TOKEN_BUDGET", "12000"))
+
+# Locally extracted invoice fields at or above this confidence override the agent's reading
+INVOICE_FIELDS_TRUST_THRESHOLD = float(os.getenv("INVOICE_FIELDS_TRUST_THRESHOLD", "0.9"))
+
+# Message-ID idempotency store, with this many entries cached in memory
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "state/processed.db")
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# A claim on a message is taken over once it is this old, or as soon as its process is gone
+IDEMPOTENCY_CLAIM_SECONDS = float(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "1800"))
+
+# Financial records written by store_tool, committed in batches by a background thread
+RECORDS_DB = os.getenv("RECORDS_DB", "state/records.db")
+RECORDS_BATCH_SIZE = int(os.getenv("RECORDS_BATCH_SIZE", "500"))
+RECORDS_FLUSH_INTERVAL = float(os.getenv("RECORDS_FLUSH_INTERVAL", "0.5"))
+
+# Reminders set by the agent; those for one user due within the window are sent together
+REMINDER_DB = os.getenv("REMINDER_DB", "state/reminders.db")
+REMINDER_COALESCE_SECONDS = float(os.getenv("REMINDER_COALESCE_SECONDS", "300"))
+
+# Durable outbox for urgent alerts and other outgoing messages
+OUTBOX_DB = os.getenv("OUTBOX_DB", "state/outbox.db")
+OUTBOX_RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "7"))  # sent items are deleted after this
+
+# Urgent alerts: alerts for one user within the window are merged; each user gets
+# at most ALERT_BURST alerts at once, refilled at ALERT_RATE_PER_HOUR
+ALERT_COALESCE_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS", "30"))
+ALERT_BURST = int(os.getenv("ALERT_BURST", "3"))
+ALERT_RATE_PER_HOUR = float(os.getenv("ALERT_RATE_PER_HOUR", "6"))
+ALERT_MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "8"))
+
+# Replies that still fail after this many attempts are kept as dead in the outbox
+REPLY_MAX_ATTEMPTS = int(os.getenv("REPLY_MAX_ATTEMPTS", "10"))
+
+# Accounts and folders to watch (JSON list); without the file only EMAIL_USER's MAILBOX is watched
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE", "accounts.json")
+
+# Backoff between reconnect attempts of a mailbox connection
+RECONNECT_MIN_SECONDS = float(os.getenv("RECONNECT_MIN_SECONDS", "5"))
+RECONNECT_MAX_SECONDS = float(os.getenv("RECONNECT_MAX_SECONDS", "300"))
+
+# Worker processes consuming the durable job queue; 0 processes emails inside the watcher process
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "state/jobs.db")
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_STATS_INTERVAL = float(os.getenv("JOB_STATS_INTERVAL", "60"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))  # done jobs are deleted after this
+
+# How often the alert, reply and reminder loops look for work queued by worker processes
+STORE_POLL_SECONDS = float(os.getenv("STORE_POLL_SECONDS", "5"))
+
+# Agent run logs: append-only JSONL segments with an offset index, rotated by size and kept by age/total size
+RUN_LOG_ENABLED = os.getenv("RUN_LOG_ENABLED", "true").lower() == "true"
+RUN_LOG_DIR = os.getenv("RUN_LOG_DIR", "logs/runs")
+RUN_LOG_COMPRESS = os.getenv("RUN_LOG_COMPRESS", "true").lower() == "true"
+RUN_LOG_SEGMENT_MB = float(os.getenv("RUN_LOG_SEGMENT_MB", "64"))
+RUN_LOG_RETENTION_DAYS = float(os.getenv("RUN_LOG_RETENTION_DAYS", "180"))
+RUN_LOG_MAX_MB = float(os.getenv("RUN_LOG_MAX_MB", "2048"))
+
+# Logging: "color" or "json" lines; with LOG_QUEUE a background thread writes them so callers never wait
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Longer string log arguments are cut to this many characters, followed by their length (and SHA-256 if enabled)
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+LOG_HASH_FIELDS = os.getenv("LOG_HASH_FIELDS", "false").lower() == "true"
+
+# Share of agent runs whose step-by-step reasoning is logged; every run is still saved to the run log
+REASONING_SAMPLE_RATE = float(os.getenv("REASONING_SAMPLE_RATE", "0.1"))
@@ -5,16 +5,17 @@ Interactive reasoning debugger for EmailAgent
 
 import json
 import sys
-from pathlib import Path
+
+from view_reasoning import load_reasoning_log
+from utils.run_log import run_log
 
 
 class InteractiveReasoningDebugger:
     """Interactive tool to debug agent reasoning step by step."""
     
-    def __init__(self, log_file: str):
-        """Initialize with a reasoning log file."""
-        with open(log_file, 'r') as f:
-            self.data = json.load(f)
+    def __init__(self, data: dict):
+        """Initialize with a reasoning log."""
+        self.data = data
         
         self.current_step = 0
         self.trace = self.data.get('full_trace', [])
@@ -198,26 +199,25 @@ class InteractiveReasoningDebugger:
 def main():
     """Main function to start the debugger."""
     if len(sys.argv) < 2:
-        # Find the most recent log file
-        logs = list(Path('.').glob('reasoning_log_*.json'))
-        if not logs:
-            print("❌ No reasoning log files found.")
+        # Use the most recent run
+        entries = run_log.entries(limit=1)
+        if not entries:
+            print("❌ No reasoning logs found.")
             print("💡 Run your EmailAgent first to generate logs.")
             return
         
-        latest_log = max(logs, key=lambda x: x.stat().st_mtime)
-        print(f"🔍 Using latest log: {latest_log}")
-        log_file = str(latest_log)
+        print(f"🔍 Using latest run: {entries[0].run_id}")
+        run = entries[0].run_id
     else:
-        log_file = sys.argv[1]
+        run = sys.argv[1]
     
     try:
-        debugger = InteractiveReasoningDebugger(log_file)
+        debugger = InteractiveReasoningDebugger(load_reasoning_log(run))
         debugger.start_debugging()
     except FileNotFoundError:
-        print(f"❌ File not found: {log_file}")
+        print(f"❌ Run or file not found: {run}")
     except json.JSONDecodeError:
-        print(f"❌ Invalid JSON in file: {log_file}")
+        print(f"❌ Invalid JSON in file: {run}")
     except Exception as e:
         print(f"❌ Error: {e}")
 
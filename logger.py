@@ -1,5 +1,14 @@
+import copy
+import json
+import queue
+import atexit
+import hashlib
 import colorlog
 import logging
+import logging.handlers
+from datetime import datetime
+
+from constants import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE, LOG_QUEUE_SIZE, LOG_MAX_FIELD_CHARS, LOG_HASH_FIELDS
 
 
 class ClientLogFilter(logging.Filter):
@@ -9,30 +18,143 @@ class ClientLogFilter(logging.Filter):
         return not record.filename.endswith("_client.py")
 
 
+class TruncateFilter(logging.Filter):
+    """
+    Cut long string arguments (and long messages) before they are
+    formatted, noting their length, and with `with_hash` their SHA-256 so
+    the same body can be recognized across log lines.
+    """
+
+    def __init__(self, max_chars: int, with_hash: bool = False):
+        super().__init__()
+        self.max_chars = max_chars
+        self.with_hash = with_hash
+
+    def truncate(self, value):
+        if isinstance(value, bytes) and len(value) > self.max_chars:
+            value = value.decode("utf-8", "replace")
+        if isinstance(value, str) and len(value) > self.max_chars:
+            if not self.with_hash:
+                return f"{value[:self.max_chars]}… [{len(value)} chars]"
+            digest = hashlib.sha256(value.encode("utf-8", "replace")).hexdigest()[:12]
+            return f"{value[:self.max_chars]}… [{len(value)} chars, sha256 {digest}]"
+        return value
+
+    def filter(self, record):
+        if isinstance(record.args, dict):
+            record.args = {key: self.truncate(value) for key, value in record.args.items()}
+        elif record.args:
+            record.args = tuple(self.truncate(value) for value in record.args)
+        elif isinstance(record.msg, str):
+            record.msg = self.truncate(record.msg)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full, and says how many it dropped."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        Merge the arguments into the message and render the traceback, but
+        leave formatting to the output handler (QueueHandler.prepare would
+        format the whole line here, traceback included, which loses the
+        JSON "exception" field).
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Rendered now: the traceback's frames may have changed by the time the listener gets to it
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            notice = logging.LogRecord(
+                record.name, logging.WARNING, record.pathname, record.lineno,
+                f"Dropped {self.dropped} log records while the log queue was full", None, None,
+            )
+            try:
+                self.queue.put_nowait(notice)
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+
+def _output_handler() -> logging.Handler:
+    handler = colorlog.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+        return handler
+    handler.setFormatter(
+        colorlog.ColoredFormatter(
+            fmt="%(log_color)s%(asctime)s [%(levelname)8s] %(blue)s%(filename)s%(reset)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+            log_colors={
+                "DEBUG": "cyan",
+                "INFO": "green",
+                "WARNING": "yellow",
+                "ERROR": "red",
+                "CRITICAL": "red,bg_white",
+            },
+            secondary_log_colors={},
+            style="%",
+        )
+    )
+    return handler
+
+
 def setup_logger():
-    """Configure logger with colors, timestamps, and better formatting"""
+    """
+    Configure logger with colors (or JSON lines), timestamps, and better formatting.
+
+    With LOG_QUEUE, callers only put records on a bounded queue and a
+    background thread writes them out, so logging never waits on the
+    terminal; long arguments are truncated before they are queued.
+    """
     logger = colorlog.getLogger()
     if not logger.handlers:
-        handler = colorlog.StreamHandler()
-        handler.setFormatter(
-            colorlog.ColoredFormatter(
-                fmt="%(log_color)s%(asctime)s [%(levelname)8s] %(blue)s%(filename)s%(reset)s: %(message)s",
-                datefmt="%Y-%m-%d %H:%M:%S",
-                log_colors={
-                    "DEBUG": "cyan",
-                    "INFO": "green",
-                    "WARNING": "yellow",
-                    "ERROR": "red",
-                    "CRITICAL": "red,bg_white",
-                },
-                secondary_log_colors={},
-                style="%",
-            )
-        )
+        handler = _output_handler()
+        if LOG_QUEUE:
+            listener = logging.handlers.QueueListener(queue.Queue(LOG_QUEUE_SIZE), handler)
+            listener.start()
+            atexit.register(listener.stop)  # writes out what is still queued
+            handler = DroppingQueueHandler(listener.queue)
         # Add filter to exclude logs from _client.py
-        client_filter = ClientLogFilter()
-        handler.addFilter(client_filter)
+        handler.addFilter(ClientLogFilter())
+        handler.addFilter(TruncateFilter(LOG_MAX_FIELD_CHARS, LOG_HASH_FIELDS))
 
         logger.addHandler(handler)
-        logger.setLevel(logging.INFO)
+        logger.setLevel(LOG_LEVEL)
     return logger
@@ -1,150 +1,727 @@
+import os
+import sys
 import socket
-import time
 import re
+import time
+import asyncio
+import multiprocessing
+from dataclasses import asdict, dataclass, field
 from email.utils import parsedate_to_datetime
+from typing import Optional
 
 from agent.EmailAgent import invoke_email_agent
+from agent.invoice_fields import ExtractedField, InvoiceFields, extract_invoice_fields
+from agent.classifier import EmailClassifier
 from logger import setup_logger
-from utils.email import process_message, get_imap_client, send_email
+from utils.email import AsyncIMAPClient, envelope_sender, fetch_message
 
 from imapclient import IMAPClient
-from email import policy
-from email.parser import BytesParser
 
-from constants import MAILBOX, ONLY_ANSWER_TO_EMAIL
-from utils.parse import extract_from_file
+from constants import (
+    WORKER_COUNT,
+    WORK_QUEUE_SIZE,
+    SENDER_ORDERING,
+    EMAIL_MAX_ATTEMPTS,
+    EMAIL_RETRY_SECONDS,
+    CATCHUP_BATCH_SIZE,
+    AGENT_INPUT_TOKEN_BUDGET,
+    RECONNECT_MIN_SECONDS,
+    RECONNECT_MAX_SECONDS,
+    WORKER_PROCESSES,
+    JOB_STATS_INTERVAL,
+    JOB_RETENTION_HOURS,
+    ATTACHMENT_SWEEP_SECONDS,
+)
+from utils.accounts import Account, account_for, accounts
+from utils.attachments import attachment_store
+from utils.checkpoint import CheckpointStore, UidWatermark
+from utils.idempotency import (
+    AGENT_DONE,
+    REPLY_QUEUED,
+    MessageBusy,
+    SKIPPED,
+    ProcessedMessage,
+    message_id_key,
+    message_key,
+    normalize_message_id,
+    processed_store,
+)
+from utils.job_queue import Job, JobQueue
+from utils.agent_input import build_agent_input, html_to_text
+from utils.parse import extract_all
+from utils.reminders import reminder_scheduler
+from utils.alerts import alert_dispatcher
+from utils.replies import reply_sender
 
 
 logger = setup_logger()
 
+classifier = EmailClassifier()
 
-import asyncio
 
-async def idle_loop():
-    client = get_imap_client()
+@dataclass
+class MailboxSource:
+    """One watched folder of one account, and the state shared by its watcher and workers."""
 
-    info = client.select_folder(MAILBOX, readonly=True)
-    last_uid = info[b"UIDNEXT"] - 1
-    logger.info("Initial UIDNEXT=%s → starting last_uid=%s", info[b"UIDNEXT"], last_uid)
+    account: Account
+    folder: str
+    fetcher: "AccountFetcher"
+    watermark: Optional[UidWatermark] = None
+    uidvalidity: Optional[int] = None
 
-    logger.info("Entering IDLE loop…")
-    while True:
+    @property
+    def key(self) -> str:
+        return self.account.checkpoint_key(self.folder)
+
+
+@dataclass
+class EmailJob:
+    source: MailboxSource
+    uid: int
+    sender: str
+    bodystructure: tuple
+    message_id: Optional[bytes] = None
+    uidvalidity: Optional[int] = None  # of the folder when queued; the fetch refuses a changed one
+    generation: int = 0  # watermark generation the UID was started in
+    previous: Optional[asyncio.Event] = None  # set when the sender's previous email is done
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class AccountFetcher:
+    """
+    One download connection per account, shared by the workers of all its
+    folders so the account stays within the server's connection limit.
+    """
+
+    def __init__(self, account: Account):
+        self.account = account
+        self._client: Optional[AsyncIMAPClient] = None
+        self._uidvalidity: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    async def _fetch(self, folder: str, uid: int, bodystructure, email_id: str, uidvalidity: Optional[int]):
+        if self._client is None:
+            self._client = await AsyncIMAPClient.connect(self.account, folder)
+            self._uidvalidity = None
+        if self._client.folder != folder or self._uidvalidity is None:
+            info = await self._client.select_folder(folder, readonly=True)
+            self._uidvalidity = info[b"UIDVALIDITY"]
+        if uidvalidity is not None and uidvalidity != self._uidvalidity:
+            logger.warning("%s UIDVALIDITY changed since UID %s was queued; skipping it", folder, uid)
+            return None
+        if bodystructure is None:
+            data = await self._client.fetch(uid, ["BODYSTRUCTURE"])
+            if uid not in data:
+                logger.warning("UID %s is no longer in %s", uid, folder)
+                return None
+            bodystructure = data[uid][b"BODYSTRUCTURE"]
+        return await fetch_message(self._client, uid, bodystructure, email_id)
+
+    async def fetch(
+        self, folder: str, uid: int, bodystructure, email_id: str, uidvalidity: Optional[int] = None
+    ) -> Optional[tuple]:
+        """
+        Download a message. Without a bodystructure it is fetched first; with
+        a uidvalidity, None is returned if the folder no longer matches it.
+        """
+        # Selecting a folder and streaming its parts must not interleave with another folder
+        async with self._lock:
+            try:
+                return await self._fetch(folder, uid, bodystructure, email_id, uidvalidity)
+            except (socket.error, IMAPClient.Error) as e:
+                logger.warning("Fetch connection dropped (%s); reconnecting and retrying UID %s", e, uid)
+                if self._client is not None:
+                    await self._client.reconnect()
+                    self._uidvalidity = None
+                return await self._fetch(folder, uid, bodystructure, email_id, uidvalidity)
+
+
+class EmailWorkQueue:
+    """
+    Bounded queue of emails processed by a pool of worker tasks, fed by
+    every watched mailbox.
+
+    Every email is downloaded and extracted as soon as a worker is free.
+    With SENDER_ORDERING the agent runs and replies of one sender's emails
+    are chained so they happen in arrival order; emails from different
+    senders run fully concurrently.
+    """
+
+    def __init__(self, workers: int = WORKER_COUNT, maxsize: int = WORK_QUEUE_SIZE):
+        self._queue: asyncio.Queue[EmailJob] = asyncio.Queue(maxsize=maxsize)
+        self._tails: dict[str, asyncio.Event] = {}
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(workers)]
+
+    async def put(self, source: MailboxSource, uid: int, sender: str, bodystructure, message_id: Optional[bytes] = None):
+        job = EmailJob(
+            source=source,
+            uid=uid,
+            sender=sender,
+            bodystructure=bodystructure,
+            message_id=message_id,
+            uidvalidity=source.uidvalidity,
+            generation=source.watermark.start(uid),
+            previous=self._tails.get(sender) if SENDER_ORDERING else None,
+        )
+        if SENDER_ORDERING:
+            self._tails[sender] = job.done
+        await self._queue.put(job)
+        # put() only suspends when the queue is full; yield so workers start on a long catch-up scan
+        await asyncio.sleep(0)
+
+    async def _handle(self, worker_id: int, job: EmailJob):
+        logger.info("Worker %d processing UID %s of %s", worker_id, job.uid, job.source.key)
+        prepared = await prepare_email(job.source, job.uid, job.bodystructure, job.message_id, job.uidvalidity)
+        if prepared is None:
+            return
+        if job.previous is not None and not job.previous.is_set():
+            logger.info("UID %s waits for the previous email from %s", job.uid, job.sender)
+            await job.previous.wait()
+        await answer_email(prepared)
+
+    async def _process(self, worker_id: int, job: EmailJob) -> bool:
+        """Handle a job, retrying with backoff; returns whether it succeeded."""
+        for attempt in range(1, EMAIL_MAX_ATTEMPTS + 1):
+            try:
+                await self._handle(worker_id, job)
+                return True
+            except Exception as e:
+                logger.error("Failed to process UID %s (attempt %d): %s", job.uid, attempt, e, exc_info=True)
+                if attempt < EMAIL_MAX_ATTEMPTS:
+                    await asyncio.sleep(EMAIL_RETRY_SECONDS * 2 ** (attempt - 1))
+        return False
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if await self._process(worker_id, job):
+                    job.source.watermark.finish(job.uid, job.generation)
+                else:
+                    # Left in flight: the checkpoint stays below it, so it is retried after a restart
+                    logger.error("Giving up on UID %s of %s until the next restart", job.uid, job.source.key)
+            finally:
+                # The next email of the sender must not overtake one still answering before this one
+                if job.previous is not None:
+                    await job.previous.wait()
+                job.done.set()
+                if self._tails.get(job.sender) is job.done:
+                    del self._tails[job.sender]
+                self._queue.task_done()
+
+
+class DurableWorkQueue:
+    """
+    Hands emails to worker processes through the durable job queue instead
+    of processing them here. Once a job is queued the UID counts as done
+    for the checkpoint; the job queue takes over from there.
+    """
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+
+    async def put(self, source: MailboxSource, uid: int, sender: str, bodystructure, message_id: Optional[bytes] = None):
+        payload = {
+            "account": source.account.user,
+            "folder": source.folder,
+            "uid": uid,
+            "uidvalidity": source.uidvalidity,
+            "message_id": normalize_message_id(message_id),
+        }
+        generation = source.watermark.generation
+        # Downloading and extraction are not ordered; the answer step is requeued in the sender's order
+        await asyncio.to_thread(self.queue.put, sender, payload, False)
+        source.watermark.skip(uid, generation)
+
+
+class JobWorker:
+    """
+    Leases jobs from the durable queue and processes them, `concurrency` at
+    a time. A job is handled in two steps: the email is prepared, then,
+    with SENDER_ORDERING, the job is requeued and answered in its sender's
+    order.
+    """
+
+    def __init__(self, name: str, queue: JobQueue):
+        self.name = name
+        self.queue = queue
+        self._fetchers: dict[str, AccountFetcher] = {}
+
+    def _source(self, user: str, folder: str) -> MailboxSource:
+        account = account_for(user)
+        if account.user not in self._fetchers:
+            self._fetchers[account.user] = AccountFetcher(account)
+        return MailboxSource(account, folder, self._fetchers[account.user])
+
+    async def _keep_leased(self, job: Job, worker: str):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not await asyncio.to_thread(self.queue.extend, job.job_id, worker):
+                logger.warning("Lost the lease on job %s", job.job_id)
+                return
+
+    async def _handle(self, job: Job, worker: str):
+        payload = job.payload
+        if "prepared" in payload:
+            await answer_email(PreparedEmail.from_payload(payload["prepared"]))
+            await asyncio.to_thread(self.queue.complete, job.job_id, worker)
+            return
+        prepared = await prepare_email(
+            self._source(payload["account"], payload["folder"]),
+            payload["uid"],
+            None,
+            payload["message_id"],
+            payload["uidvalidity"],
+        )
+        if prepared is not None and SENDER_ORDERING:
+            payload = {**payload, "prepared": prepared.to_payload()}
+            await asyncio.to_thread(self.queue.requeue_ordered, job, worker, payload)
+            return
+        if prepared is not None:
+            await answer_email(prepared)
+        await asyncio.to_thread(self.queue.complete, job.job_id, worker)
+
+    async def _run_one(self, job: Job, worker: str):
+        payload = job.payload
+        logger.info("%s processing job %s (%s UID %s of %s/%s, attempt %d)",
+                    worker, job.job_id, "answering" if "prepared" in payload else "preparing",
+                    payload["uid"], payload["account"], payload["folder"], job.attempts)
+        keep_leased = asyncio.create_task(self._keep_leased(job, worker))
         try:
-            logger.info(">> IDLE start")
-            client.idle()
-            notifications = client.idle_check(timeout=29 * 60)
-            client.idle_done()
-            logger.info("<< IDLE returned: %r", notifications)
+            await self._handle(job, worker)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.job_id, e, exc_info=True)
+            await asyncio.to_thread(self.queue.fail, job, worker, str(e))
+        finally:
+            keep_leased.cancel()
 
-            if any(n[1] == b"EXISTS" for n in notifications):
-                logger.info("EXISTS detected; searching for UIDs > %s", last_uid)
-                new_uids = client.search(["UID", f"{last_uid+1}:*"])
-                logger.info("Search result: %s", new_uids)
-
-                for uid in new_uids:
-                    logger.info("Fetching UID %s…", uid)
-                    data = client.fetch(uid, ["RFC822"])
-                    raw = data[uid][b"RFC822"]
-                    msg = BytesParser(policy=policy.default).parsebytes(raw)
-                    (
-                        from_email,
-                        to_email,
-                        subject,
-                        date,
-                        plain,
-                        html,
-                        file_urls,
-                    ) = process_message(msg)
-                    print("\n ===== New email detected =====\n")
-                    logger.info("From: %s", from_email)
-                    logger.info("To: %s", to_email)
-                    logger.info("Subject: %s", subject)
-                    logger.info("Date: %s", date)
-                    logger.info("File URLs: %s", file_urls)
-                    logger.info("Plain: %s", plain)
-                    logger.info("html: %s", html)
-                    print("============================\n")
-                    
-                    # Convert date header to datetime object
-                    try:
-                        parsed_date = parsedate_to_datetime(str(date))
-                    except Exception as e:
-                        logger.warning("Failed to parse date '%s': %s", date, e)
-                        # Fallback to current date
-                        import datetime
-                        parsed_date = datetime.datetime.now()
-                    
-                    exact_from_email = from_email.split()[-1].replace("<", "").replace(">", "").strip() # Extract the email address from the "From" header
-                    if exact_from_email == ONLY_ANSWER_TO_EMAIL:
-                        # Combine email metadata with content
-                        email_input = f"""From: {from_email}
+    async def _loop(self, index: int):
+        worker = f"{self.name}-{index}"
+        idle = 0.2
+        while True:
+            job = await asyncio.to_thread(self.queue.lease, worker)
+            if job is None:
+                await asyncio.sleep(idle)
+                idle = min(idle * 2, 2)
+                continue
+            idle = 0.2
+            await self._run_one(job, worker)
+
+    async def run(self, concurrency: int = WORKER_COUNT):
+        await asyncio.gather(*(self._loop(i) for i in range(concurrency)))
+
+
+def run_worker_process(name: str):
+    """Entry point of a worker process."""
+    asyncio.run(JobWorker(name, JobQueue()).run())
+
+
+async def supervise_workers(queue: JobQueue, processes: int = WORKER_PROCESSES):
+    """Keep `processes` worker processes running, report queue depth and lag, and purge old done jobs."""
+    context = multiprocessing.get_context("spawn")
+    workers: dict[int, multiprocessing.Process] = {}
+    last_report = 0.0
+    while True:
+        for index in range(processes):
+            process = workers.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logger.warning("Worker process %d exited with %s; restarting", index, process.exitcode)
+                process = context.Process(
+                    target=run_worker_process, args=(f"worker{index}",), name=f"worker{index}", daemon=True
+                )
+                process.start()
+                workers[index] = process
+
+        if time.monotonic() - last_report >= JOB_STATS_INTERVAL:
+            last_report = time.monotonic()
+            stats = await asyncio.to_thread(queue.stats)
+            logger.info(
+                "Job queue: %d pending (oldest waiting %s), %d in progress, %d failed, %d done in the last hour",
+                stats.pending,
+                f"{stats.oldest_pending_age:.0f}s" if stats.oldest_pending_age is not None else "-",
+                stats.leased,
+                stats.failed,
+                stats.done_last_hour,
+            )
+            purged = await asyncio.to_thread(queue.purge, time.time() - JOB_RETENTION_HOURS * 3600)
+            if purged:
+                logger.info("Purged %d done jobs", purged)
+        await asyncio.sleep(5)
+
+
+@dataclass
+class PreparedEmail:
+    """An email that passed triage, with everything its agent run and reply need."""
+
+    key: str
+    account_user: str
+    sender: str  # bare address of the From header
+    input_text: str
+    current_date: str
+    invoice_fields: InvoiceFields = field(default_factory=InvoiceFields)
+
+    def to_payload(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "PreparedEmail":
+        fields = {name: ExtractedField(**found) for name, found in payload["invoice_fields"]["fields"].items()}
+        return cls(**{**payload, "invoice_fields": InvoiceFields(fields)})
+
+
+async def prepare_email(
+    source: MailboxSource,
+    uid: int,
+    bodystructure,
+    message_id: Optional[bytes],
+    uidvalidity: Optional[int] = None,
+) -> Optional[PreparedEmail]:
+    """Download, triage and extract one email; None if it needs no agent run."""
+    email_id = f"{source.key}:{uid}"
+    try:
+        message = await source.fetcher.fetch(source.folder, uid, bodystructure, email_id, uidvalidity)
+        if message is None:
+            return None
+        key = message_key(message_id, message)
+        if await asyncio.to_thread(processed_store.is_finished, key):
+            logger.info("UID %s (%s) was already processed; skipping", uid, key)
+            return None
+        processed = await asyncio.to_thread(processed_store.get, key)
+        if processed is not None and processed.state == AGENT_DONE and processed.reply_body is not None:
+            # The agent already ran; answer_email only has to queue the stored reply
+            return PreparedEmail(key, source.account.user, sender_address(message[0]), "", "")
+        return await prepare_message(message, key, source.account)
+    finally:
+        # The agent works on the extracted text only
+        await asyncio.to_thread(attachment_store.release, email_id)
+
+
+async def prepare_message(message: tuple, key: str, account: Account) -> Optional[PreparedEmail]:
+    (
+        from_email,
+        to_email,
+        subject,
+        date,
+        plain,
+        html,
+        attachments,
+    ) = message
+
+    # Through the logger rather than print, so it stays in order with the queued log lines
+    logger.info("===== New email detected =====")
+    logger.info("From: %s", from_email)
+    logger.info("To: %s", to_email)
+    logger.info("Subject: %s", subject)
+    logger.info("Date: %s", date)
+    logger.info("Attachments: %s", [attachment.filename for attachment in attachments])
+    # Long bodies are cut to LOG_MAX_FIELD_CHARS by the logger; the HTML duplicates the text, so only at DEBUG
+    logger.info("Plain: %s", plain)
+    logger.debug("html: %s", html)
+
+    # Convert date header to datetime object
+    try:
+        parsed_date = parsedate_to_datetime(str(date))
+    except Exception as e:
+        logger.warning("Failed to parse date '%s': %s", date, e)
+        # Fallback to current date
+        import datetime
+        parsed_date = datetime.datetime.now()
+
+    exact_from_email = sender_address(from_email)
+
+    # Appends to the decision log, so off the event loop
+    classification = await asyncio.to_thread(
+        classifier.classify,
+        str(subject or ""),
+        plain or html or "",
+        [attachment.filename for attachment in attachments],
+        exact_from_email,
+    )
+    logger.info(
+        "Pre-classified as %s (confidence %.2f): %s",
+        classification.label,
+        classification.confidence,
+        classification.reasons,
+    )
+    if classification.skip_agent:
+        logger.info("Skipping agent - no reply will be sent")
+        await asyncio.to_thread(processed_store.mark, key, SKIPPED)
+        return None
+
+    # Combine email metadata with content
+    header = f"""From: {from_email}
 To: {to_email}
 Subject: {subject}
-Date: {parsed_date.strftime("%Y-%m-%d %H:%M:%S")}
-
-Email Body:
-{plain or html or "No email body content"}"""
-
-                        if file_urls:
-                            logger.info("Extracting text from files: %s", file_urls)
-                            extracted_texts = []
-                            for file_url in file_urls:
-                                logger.info("Processing file: %s", file_url)
-                                extracted_text = extract_from_file(file_url)
-                                logger.info("Extracted text: %s", extracted_text[:100])
-                                extracted_texts.append(f"--- Attachment: {file_url} ---\n{extracted_text}")
-                                # Save for debugging
-                                with open("tmp/extracted_text.txt", "w") as f:
-                                    f.write(extracted_text)
-                            
-                            # Combine email content with all extracted file contents
-                            text = email_input + "\n\nAttachments:\n" + "\n\n".join(extracted_texts)
-                        else:
-                            text = email_input
-                            logger.info("No files; using email content only")
-
-                        logger.info("Combined input length: %d characters", len(text))
-                        logger.info("Combined input preview: %s", text[:200] + "..." if len(text) > 200 else text)
-                        logger.info("Answering to %s", to_email)
-                        result = await invoke_email_agent(
-                            input_text=text,
-                            user_name=exact_from_email,
-                            current_date=parsed_date.strftime("%Y-%m-%d"),
-                            show_reasoning=True,
-                        )
-                        
-                        if result is not None:
-                            # Parse the agent response to extract subject and body
-                            subject, body = parse_agent_response(result.final_output)
-                            logger.info("Parsed subject: %s", subject)
-                            logger.info("Parsed body: %s", body[:100] + "..." if len(body) > 100 else body)
-                            
-                            send_email(
-                                to_addrs=ONLY_ANSWER_TO_EMAIL,
-                                subject=subject,
-                                body=body,
-                            )
-                        else:
-                            logger.info("No response from agent - email processing aborted")
-                    else:
-                        logger.info("Not answering to %s", to_email)
-                if new_uids:
-                    last_uid = max(new_uids)
-                    logger.info("Updated last_uid → %s", last_uid)
-
-        except (socket.error, IMAPClient.Error) as e:
-            logger.error("Connection dropped: %s", e, exc_info=True)
+Date: {parsed_date.strftime("%Y-%m-%d %H:%M:%S")}"""
+
+    extracted = []
+    if attachments:
+        file_urls = [attachment.path for attachment in attachments]
+        logger.info("Extracting text from files: %s", file_urls)
+        for attachment, pages in zip(attachments, await extract_all(file_urls)):
+            logger.info("Extracted %s pages from %s", len(pages) if pages is not None else "no", attachment.filename)
+            extracted.append((attachment.filename, pages))
+    else:
+        logger.info("No files; using email content only")
+
+    invoice_fields = extract_invoice_fields(
+        [str(subject or ""), plain or (html_to_text(html) if html else "")]
+        + [page for _, pages in extracted for page in pages or []]
+    )
+    logger.info("Extracted invoice fields: %s", {name: (f.value, f.confidence) for name, f in invoice_fields.fields.items()})
+
+    agent_input = build_agent_input(header, plain, html, extracted)
+    text = agent_input.text
+    logger.info(
+        "Agent input compacted from %d to %d tokens (budget %d)",
+        agent_input.tokens_before,
+        agent_input.tokens_after,
+        AGENT_INPUT_TOKEN_BUDGET,
+    )
+    logger.info("Combined input length: %d characters", len(text))
+    logger.info("Combined input preview: %s", text[:200] + "..." if len(text) > 200 else text)
+    logger.info("Answering to %s", to_email)
+    return PreparedEmail(
+        key=key,
+        account_user=account.user,
+        sender=exact_from_email,
+        input_text=text,
+        current_date=parsed_date.strftime("%Y-%m-%d"),
+        invoice_fields=invoice_fields,
+    )
+
+
+async def answer_email(prepared: PreparedEmail):
+    """Run the agent on a prepared email and queue its reply, unless the message was handled meanwhile."""
+    processed = await asyncio.to_thread(processed_store.claim, prepared.key)
+    if processed is None:
+        if await asyncio.to_thread(processed_store.is_finished, prepared.key):
+            logger.info("%s was already processed; skipping", prepared.key)
+            return
+        # Not done yet: retried, so the email isn't counted as handled while the other worker may still fail
+        raise MessageBusy(f"{prepared.key} is being processed by another worker")
+    try:
+        await answer_message(prepared, processed)
+    finally:
+        await asyncio.to_thread(processed_store.release, prepared.key)
+
+
+async def answer_message(prepared: PreparedEmail, processed: ProcessedMessage):
+    if processed.state == AGENT_DONE and processed.reply_body is not None:
+        # The agent already ran and its tools were called; only the reply is missing
+        if not await asyncio.to_thread(reply_sender.is_queued, processed.key):
+            logger.info("Queueing the stored reply for %s", processed.key)
+            await asyncio.to_thread(
+                reply_sender.enqueue,
+                processed.key,
+                prepared.sender,
+                processed.reply_subject,
+                processed.reply_body,
+                prepared.account_user,
+            )
+        await asyncio.to_thread(processed_store.mark, processed.key, REPLY_QUEUED)
+        return
+
+    result = await invoke_email_agent(
+        input_text=prepared.input_text,
+        user_name=prepared.sender,
+        current_date=prepared.current_date,
+        show_reasoning=True,
+        invoice_fields=prepared.invoice_fields,
+        account_user=prepared.account_user,
+    )
+
+    if result is not None:
+        # Parse the agent response to extract subject and body
+        subject, body = parse_agent_response(result.final_output)
+        logger.info("Parsed subject: %s", subject)
+        logger.info("Parsed body: %s", body[:100] + "..." if len(body) > 100 else body)
+        await asyncio.to_thread(
+            processed_store.mark, processed.key, AGENT_DONE, reply_subject=subject, reply_body=body
+        )
+
+        # Sent in the background so SMTP never holds up the next email
+        await asyncio.to_thread(reply_sender.enqueue, processed.key, prepared.sender, subject, body, prepared.account_user)
+        await asyncio.to_thread(processed_store.mark, processed.key, REPLY_QUEUED)
+    else:
+        logger.info("No response from agent - email processing aborted")
+        await asyncio.to_thread(processed_store.mark, processed.key, SKIPPED)
+
+
+def sender_address(from_email: str) -> str:
+    """Extract the email address from the "From" header."""
+    if not from_email:
+        return ""
+    return from_email.split()[-1].replace("<", "").replace(">", "").strip()
+
+
+async def select_mailbox(client: AsyncIMAPClient, store: CheckpointStore, source: MailboxSource) -> UidWatermark:
+    """
+    Select the source's folder and return the watermark to continue from.
+
+    An in-memory watermark is kept across reconnects while UIDVALIDITY is
+    unchanged; on startup the stored checkpoint is used. Without a usable
+    checkpoint we start at UIDNEXT.
+    """
+    info = await client.select_folder(source.folder, readonly=True)
+    uidvalidity = info[b"UIDVALIDITY"]
+    source.uidvalidity = uidvalidity
+    checkpoint = store.load(source.key)
+    watermark = source.watermark
+
+    if checkpoint is not None and checkpoint.uidvalidity == uidvalidity:
+        if watermark is None:
+            watermark = UidWatermark(checkpoint.last_uid, store, source.key, completed=checkpoint.completed)
+        logger.info("%s: resuming from last_uid=%s (UIDNEXT=%s)", source.key, watermark.last_uid, info[b"UIDNEXT"])
+        return watermark
+
+    if checkpoint is not None:
+        logger.warning(
+            "%s: UIDVALIDITY changed %s → %s; starting from UIDNEXT", source.key, checkpoint.uidvalidity, uidvalidity
+        )
+    last_uid = info[b"UIDNEXT"] - 1
+    store.reset(source.key, uidvalidity, last_uid)
+    if watermark is None:
+        watermark = UidWatermark(last_uid, store, source.key)
+    else:
+        watermark.reset(last_uid)
+    logger.info("%s: no checkpoint; starting last_uid=%s", source.key, last_uid)
+    return watermark
+
+
+async def queue_new_mail(client: AsyncIMAPClient, source: MailboxSource, work_queue):
+    """Find every UID past what is already queued and feed it to the workers in batches."""
+    watermark = source.watermark
+    # Search past everything already queued, not just past last_uid,
+    # so emails still being processed are not picked up twice.
+    logger.info("%s: searching for UIDs > %s", source.key, watermark.highest_seen)
+    new_uids = await client.search(["UID", f"{watermark.highest_seen+1}:*"])
+    new_uids = sorted(uid for uid in new_uids if uid > watermark.highest_seen)
+    logger.info("Search result: %s", new_uids)
+
+    for i in range(0, len(new_uids), CATCHUP_BATCH_SIZE):
+        batch = []
+        for uid in new_uids[i:i + CATCHUP_BATCH_SIZE]:
+            if uid in watermark.completed:
+                watermark.skip(uid)  # finished before a restart
+            else:
+                batch.append(uid)
+        if not batch:
+            continue
+
+        # Triage on headers alone so bodies and attachments are
+        # only downloaded for senders we actually answer.
+        # BODYSTRUCTURE lets workers download only the parts they need.
+        headers = await client.fetch(batch, ["ENVELOPE", "BODYSTRUCTURE"])
+        for uid in batch:
+            envelope = headers.get(uid, {}).get(b"ENVELOPE")
+            sender = envelope_sender(envelope)
+            message_id = envelope.message_id if envelope is not None else None
+            key = message_id_key(message_id)
+            if key and await asyncio.to_thread(processed_store.is_finished, key):
+                # Same message delivered again, replayed or seen in another folder; don't even download it
+                logger.info("UID %s is a duplicate of already processed %s", uid, key)
+                watermark.skip(uid)
+            elif source.account.allows(sender):
+                await work_queue.put(source, uid, sender, headers[uid][b"BODYSTRUCTURE"], message_id)
+            else:
+                logger.info("Not answering to UID %s from %s", uid, sender)
+                watermark.skip(uid)
+
+
+class MailboxWatcher:
+    """
+    Keeps an IDLE connection open on one folder of one account and queues
+    new mail. Each watcher reconnects on its own with exponential backoff,
+    so one failing mailbox doesn't affect the others.
+    """
+
+    def __init__(self, source: MailboxSource, store: CheckpointStore, work_queue):
+        self.source = source
+        self.store = store
+        self.work_queue = work_queue
+
+    async def _watch(self, client: AsyncIMAPClient):
+        self.source.watermark = await select_mailbox(client, self.store, self.source)
+        # Catches up on everything that arrived while we were away
+        await queue_new_mail(client, self.source, self.work_queue)
+
+        logger.info("Entering IDLE loop for %s…", self.source.key)
+        while True:
+            logger.info(">> IDLE start (%s)", self.source.key)
+            notifications = await client.idle_wait(timeout=29 * 60)
+            logger.info("<< IDLE returned: %r", notifications)
+
+            if any(n[1] == b"EXISTS" for n in notifications):
+                logger.info("EXISTS detected")
+                await queue_new_mail(client, self.source, self.work_queue)
+
+            await asyncio.sleep(1)
+
+    async def run(self):
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            client = None
+            started = time.monotonic()
             try:
-                client.logout()
-            except:
-                pass
-            time.sleep(5)
-            client = get_imap_client()
-            info = client.select_folder(MAILBOX, readonly=True)
-            last_uid = info[b"UIDNEXT"] - 1
-            logger.info("Reconnected; reset last_uid=%s", last_uid)
-
-        time.sleep(1)
+                client = await AsyncIMAPClient.connect(self.source.account, self.source.folder)
+                await self._watch(client)
+            except Exception as e:
+                logger.error("Connection to %s dropped: %s", self.source.key, e, exc_info=True)
+            finally:
+                if client is not None:
+                    try:
+                        await client.logout()
+                    except Exception:
+                        pass
+            # Back off while the connection keeps failing, start over once it held for a while
+            if time.monotonic() - started > RECONNECT_MAX_SECONDS:
+                delay = RECONNECT_MIN_SECONDS
+            logger.info("Reconnecting to %s in %.0fs", self.source.key, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+
+async def sweep_attachments():
+    """Remove attachments left behind by emails that never finished, every ATTACHMENT_SWEEP_SECONDS."""
+    while True:
+        try:
+            await asyncio.to_thread(attachment_store.sweep)
+        except Exception as e:
+            logger.error("Attachment sweep failed: %s", e, exc_info=True)
+        await asyncio.sleep(ATTACHMENT_SWEEP_SECONDS)
+
+
+async def idle_loop():
+    await reminder_scheduler.start()
+    await alert_dispatcher.start()
+    await reply_sender.start()
+    store = CheckpointStore()
+    tasks = [asyncio.create_task(sweep_attachments())]
+    if WORKER_PROCESSES > 0:
+        job_queue = JobQueue()
+        work_queue = DurableWorkQueue(job_queue)
+        tasks.append(asyncio.create_task(supervise_workers(job_queue)))
+    else:
+        work_queue = EmailWorkQueue()
+
+    watchers = []
+    for account in accounts:
+        fetcher = AccountFetcher(account)
+        for folder in account.folders:
+            watchers.append(MailboxWatcher(MailboxSource(account, folder, fetcher), store, work_queue))
+    logger.info("Watching %d mailboxes: %s", len(watchers), [watcher.source.key for watcher in watchers])
+    tasks.extend(asyncio.create_task(watcher.run()) for watcher in watchers)
+    try:
+        # A supervisor that crashes ends the loop instead of failing unnoticed
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def parse_agent_response(response_text: str) -> tuple[str, str]:
     """
     Parse the agent response to extract subject and body from XML-like tags.
@@ -167,4 +744,8 @@ def parse_agent_response(response_text: str) -> tuple[str, str]:
     return subject, body
 
 if __name__ == "__main__":
-    asyncio.run(idle_loop())
+    # `python main.py worker` adds a worker process to a watcher running with WORKER_PROCESSES > 0
+    if sys.argv[1:2] == ["worker"]:
+        run_worker_process(f"worker-{os.getpid()}")
+    else:
+        asyncio.run(idle_loop())
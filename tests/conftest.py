@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The stores create their databases relative to the working directory on import
+os.environ.setdefault("LLAMAPARSE_API_KEY", "test")
+os.environ["LOG_QUEUE"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="emailagent-tests-"))
@@ -0,0 +1,75 @@
+import asyncio
+
+import main
+from utils.accounts import Account
+from utils.checkpoint import CheckpointStore, UidWatermark
+
+
+def run_queue(tmp_path, monkeypatch, prepare_email):
+    monkeypatch.setattr(main, "prepare_email", prepare_email)
+    monkeypatch.setattr(main, "EMAIL_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(main, "EMAIL_RETRY_SECONDS", 0)
+    source = main.MailboxSource(Account("me@example.com"), "INBOX", fetcher=None)
+    store = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    store.reset(source.key, 1, 10)
+    source.watermark = UidWatermark(10, store, source.key)
+
+    async def run():
+        queue = main.EmailWorkQueue(workers=2)
+        for uid, sender in ((11, "a"), (12, "b"), (13, "c")):
+            await queue.put(source, uid, sender, None)
+        await queue._queue.join()
+
+    asyncio.run(run())
+    return store.load(source.key), source.watermark
+
+
+def test_checkpoint_advances_when_all_succeed(tmp_path, monkeypatch):
+    async def prepare_email(source, uid, bodystructure, message_id, uidvalidity=None):
+        pass
+
+    checkpoint, watermark = run_queue(tmp_path, monkeypatch, prepare_email)
+    assert watermark.last_uid == 13
+    assert checkpoint.last_uid == 13
+
+
+def test_checkpoint_does_not_pass_a_failed_uid(tmp_path, monkeypatch):
+    attempts = []
+
+    async def prepare_email(source, uid, bodystructure, message_id, uidvalidity=None):
+        if uid == 12:
+            attempts.append(uid)
+            raise ConnectionError("fetch dropped")
+
+    checkpoint, watermark = run_queue(tmp_path, monkeypatch, prepare_email)
+    assert attempts == [12, 12]
+    assert watermark.last_uid == 11
+    assert checkpoint.last_uid == 11
+    # After a restart 12 is fetched again and 13 is skipped as already done
+    assert checkpoint.completed == {13}
+
+
+def test_retry_that_succeeds_advances_checkpoint(tmp_path, monkeypatch):
+    failures = {12: 1}
+
+    async def prepare_email(source, uid, bodystructure, message_id, uidvalidity=None):
+        if failures.get(uid):
+            failures[uid] -= 1
+            raise ConnectionError("fetch dropped")
+
+    checkpoint, watermark = run_queue(tmp_path, monkeypatch, prepare_email)
+    assert checkpoint.last_uid == 13
+
+
+def test_jobs_from_before_a_uidvalidity_change_are_ignored():
+    watermark = UidWatermark(10)
+    old = watermark.start(11)
+    watermark.reset(100)
+
+    watermark.finish(11, old)
+    watermark.skip(12, old)
+    assert watermark.completed == set()
+    assert watermark.last_uid == 100
+
+    watermark.finish(101, watermark.start(101))
+    assert watermark.last_uid == 101
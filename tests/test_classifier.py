@@ -0,0 +1,20 @@
+import json
+
+from agent.classifier import SenderHistory
+
+
+def test_sender_history_is_seeded_from_the_log_once(tmp_path):
+    log_path = tmp_path / "decisions.jsonl"
+    log_path.write_text(
+        "".join(json.dumps({"sender": "a@example.com", "label": "financial"}) + "\n" for _ in range(3))
+    )
+    db_path = str(tmp_path / "history.db")
+
+    history = SenderHistory(db_path, str(log_path))
+    assert history.financial_ratio("a@example.com") == 1.0
+    history.record("a@example.com", "non_financial")
+
+    # A restart keeps the recorded counts and doesn't import the log again
+    restarted = SenderHistory(db_path, str(log_path))
+    assert restarted.financial_ratio("a@example.com") == 0.75
+    assert restarted.financial_ratio("b@example.com") is None
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import pytest
+
+import main
+from utils.idempotency import REPLY_QUEUED, STARTED, MessageBusy, ProcessedStore
+
+
+def test_claim_is_exclusive_across_stores(tmp_path):
+    path = str(tmp_path / "processed.db")
+    first, second = ProcessedStore(path), ProcessedStore(path)
+    second.owner = "elsewhere:1"  # another host, so its liveness can't be checked
+
+    assert first.claim("mid:a").state == STARTED
+    assert second.claim("mid:a") is None
+    assert first.claim("mid:a") is None  # also held against other tasks of the same process
+
+    first.release("mid:a")
+    assert second.claim("mid:a").state == STARTED
+
+
+def test_finished_message_is_not_claimed(tmp_path):
+    store = ProcessedStore(str(tmp_path / "processed.db"))
+    store.claim("mid:a")
+    store.mark("mid:a", REPLY_QUEUED)
+    store.release("mid:a")
+    assert store.claim("mid:a") is None
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+    path = str(tmp_path / "processed.db")
+    crashed = ProcessedStore(path)
+    host = crashed.owner.split(":")[0]
+    crashed.owner = f"{host}:999999999:0"  # a pid that does not exist
+    crashed.claim("mid:dead")
+    restarted = ProcessedStore(path)
+    restarted.owner = f"{host}:{os.getpid()}:0"  # an earlier run that had the same pid
+    restarted.claim("mid:same-pid")
+    elsewhere = ProcessedStore(path)
+    elsewhere.owner = "elsewhere:1"
+    elsewhere.claim("mid:old")
+
+    store = ProcessedStore(path)
+    assert store.claim("mid:dead") is not None
+    assert store.claim("mid:same-pid") is not None
+    assert store.claim("mid:old") is None
+    assert ProcessedStore(path, claim_seconds=0).claim("mid:old") is not None
+
+
+def test_answer_is_retried_while_claimed_elsewhere(tmp_path, monkeypatch):
+    path = str(tmp_path / "processed.db")
+    elsewhere = ProcessedStore(path)
+    elsewhere.owner = "elsewhere:1"
+    elsewhere.claim("mid:a")
+    monkeypatch.setattr(main, "processed_store", ProcessedStore(path))
+    prepared = main.PreparedEmail("mid:a", "me@example.com", "a@example.com", "", "")
+
+    # Not finished yet, so the job must fail and be retried rather than count as handled
+    with pytest.raises(MessageBusy):
+        asyncio.run(main.answer_email(prepared))
@@ -0,0 +1,6 @@
+from agent.invoice_fields import extract_invoice_fields
+
+
+def test_amount_keeps_all_digits_before_the_decimals():
+    fields = extract_invoice_fields(["Att betala: 1685.00 SEK"])
+    assert fields.get("amount") == "1685.00"
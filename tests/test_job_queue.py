@@ -0,0 +1,30 @@
+from utils.job_queue import JobQueue
+
+
+def test_unordered_jobs_of_one_sender_are_leased_together(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    first = queue.put("me@example.com", {"uid": 1}, ordered=False)
+    second = queue.put("me@example.com", {"uid": 2}, ordered=False)
+    assert queue.lease("a").job_id == first
+    assert queue.lease("b").job_id == second
+
+
+def test_ordered_step_waits_for_earlier_jobs_of_the_sender(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    queue.put("me@example.com", {"uid": 1}, ordered=False)
+    queue.put("me@example.com", {"uid": 2}, ordered=False)
+    queue.put("other@example.com", {"uid": 3}, ordered=False)
+    first, second, other = queue.lease("a"), queue.lease("b"), queue.lease("c")
+
+    # The later email is prepared first; its answer must wait for the earlier one
+    queue.requeue_ordered(second, "b", {"uid": 2, "prepared": {}})
+    queue.requeue_ordered(other, "c", {"uid": 3, "prepared": {}})
+    assert queue.lease("c").payload["uid"] == 3
+    assert queue.lease("b") is None
+
+    queue.requeue_ordered(first, "a", {"uid": 1, "prepared": {}})
+    answer = queue.lease("a")
+    assert answer.payload["uid"] == 1 and answer.attempts == 1
+    assert queue.lease("b") is None
+    queue.complete(answer.job_id, "a")
+    assert queue.lease("b").payload["uid"] == 2
@@ -0,0 +1,21 @@
+import json
+import logging
+import queue
+
+from logger import DroppingQueueHandler, JsonFormatter
+
+
+def test_queued_json_records_keep_the_exception_separate():
+    log_queue = queue.Queue()
+    handler = DroppingQueueHandler(log_queue)
+    logger = logging.getLogger("test_queued_json")
+    logger.addHandler(handler)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.error("Failed on %s", "UID 7", exc_info=True)
+    logger.removeHandler(handler)
+
+    entry = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "Failed on UID 7"
+    assert "ZeroDivisionError" in entry["exception"]
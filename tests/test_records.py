@@ -0,0 +1,50 @@
+import sqlite3
+
+from utils.records import RecordStore
+
+
+class FlakyConnection:
+    """Connection whose next `failures` batch inserts fail as if the database were locked."""
+
+    def __init__(self, conn, failures: int):
+        self.conn = conn
+        self.failures = failures
+
+    def executemany(self, sql, rows):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self.conn.__exit__(*exc)
+
+
+def add(store: RecordStore, sender: str = "billing@vendor.se") -> str:
+    return store.add("me@example.com", sender, "2026-11-01", 1685.0, "SEK", "1 685,00 kr", "Electricity", "utilities")
+
+
+def test_failed_batch_is_retried_not_dropped(tmp_path):
+    store = RecordStore(str(tmp_path / "records.db"), flush_interval=0.01)
+    store._conn = FlakyConnection(store._conn, failures=2)
+    record_ids = [add(store) for _ in range(3)]
+
+    assert store.flush(timeout=10)
+    assert store._conn.failures == 0
+    assert all(store.get(record_id) is not None for record_id in record_ids)
+
+
+def test_rejected_record_does_not_block_the_batch(tmp_path):
+    store = RecordStore(str(tmp_path / "records.db"), flush_interval=0.01)
+    good = add(store)
+    bad = add(store, sender=None)  # violates NOT NULL
+
+    assert store.flush(timeout=10)
+    assert store.get(good) is not None
+    assert store.get(bad) is None
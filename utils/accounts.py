@@ -0,0 +1,70 @@
+import os
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import ACCOUNTS_FILE, HOST, USER, MAILBOX, ONLY_ANSWER_TO_EMAIL, TOKEN_FILE, SMTP_HOST, SMTP_PORT
+from utils.credentials import CredentialManager, credentials
+
+
+logger = setup_logger()
+
+_credentials = {TOKEN_FILE: credentials}
+
+
+@dataclass
+class Account:
+    """One mailbox account: where to connect, which folders to watch and whose mail to answer."""
+
+    user: str
+    host: str = HOST
+    folders: List[str] = field(default_factory=lambda: [MAILBOX])
+    allowed_senders: List[str] = field(default_factory=lambda: [ONLY_ANSWER_TO_EMAIL] if ONLY_ANSWER_TO_EMAIL else [])
+    token_file: str = TOKEN_FILE
+    smtp_host: str = SMTP_HOST
+    smtp_port: int = SMTP_PORT
+
+    @property
+    def credentials(self) -> CredentialManager:
+        if self.token_file not in _credentials:
+            _credentials[self.token_file] = CredentialManager(self.token_file)
+        return _credentials[self.token_file]
+
+    def allows(self, sender: str) -> bool:
+        """Whether mail from `sender` is answered; entries starting with "@" allow a whole domain."""
+        sender = sender.lower()
+        return any(
+            sender.endswith(allowed.lower()) if allowed.startswith("@") else sender == allowed.lower()
+            for allowed in self.allowed_senders
+        )
+
+    def checkpoint_key(self, folder: str) -> str:
+        # The account from the environment keeps the plain folder key used before multiple accounts
+        return folder if self.user == USER else f"{self.user}/{folder}"
+
+
+def load_accounts(path: str = ACCOUNTS_FILE) -> List[Account]:
+    """
+    Read the accounts from a JSON list such as
+    [{"user": "me@gmail.com", "folders": ["INBOX", "Bills"], "allowed_senders": ["me@gmail.com"],
+      "token_file": "token.pickle"}].
+    Without the file, the single account configured by EMAIL_USER is used.
+    """
+    if not os.path.exists(path):
+        return [Account(user=USER)]
+    with open(path, "r") as f:
+        accounts = [Account(**entry) for entry in json.load(f)]
+    logger.info("Loaded %d accounts from %s", len(accounts), path)
+    return accounts
+
+
+accounts = load_accounts()
+
+
+def account_for(user: Optional[str]) -> Account:
+    """The configured account for `user`, or the default account."""
+    for account in accounts:
+        if account.user == user:
+            return account
+    return accounts[0]
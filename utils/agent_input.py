@@ -0,0 +1,189 @@
+import re
+import html as html_lib
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import AGENT_INPUT_TOKEN_BUDGET
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; without it tokens are estimated from length
+    tiktoken = None
+
+
+logger = setup_logger()
+
+_encoding = None
+_encoding_loaded = False
+
+# Pages that mention these are the ones most likely to hold totals, due dates and payment references
+KEY_FIELDS = re.compile(
+    r"\b(?:total|summa|att betala|amount due|balance|belopp|due date|förfallodatum|förfaller|ocr"
+    r"|bankgiro|plusgiro|iban|bic|reference|referens|invoice (?:no|number)|fakturanummer|moms|vat)\b",
+    re.IGNORECASE,
+)
+
+
+def count_tokens(text: str) -> int:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is None:
+            logger.warning("tiktoken is not installed; estimating tokens from length, inputs may exceed the budget")
+        else:
+            try:
+                # Downloaded on first use into TIKTOKEN_CACHE_DIR (or the system temp dir)
+                _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4.1 tokenizer
+            except Exception as e:  # e.g. offline without a cached encoding file
+                logger.warning("tiktoken encoding unavailable (%s); estimating tokens from length, "
+                               "inputs may exceed the budget", e)
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # About 4 characters per token for English; numbers, tables and Swedish text take more tokens,
+    # so the real count can be higher than this estimate
+    return len(text) // 4
+
+
+def _normalize_line(line: str) -> str:
+    # "Page 2 of 5" and "Sida 3/5" should count as the same footer
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+
+def strip_repeated_lines(pages: List[str], edge: int = 3) -> List[str]:
+    """
+    Remove header/footer lines that repeat at the top or bottom of most
+    pages. The first page keeps them, so letterheads and invoice numbers
+    still appear once.
+    """
+    if len(pages) < 2:
+        return pages
+
+    counts = Counter()
+    for page in pages:
+        lines = [line for line in page.splitlines() if line.strip()]
+        if len(lines) <= 2 * edge:
+            continue  # too short to tell its header/footer from its content
+        counts.update({_normalize_line(line) for line in lines[:edge] + lines[-edge:]})
+    repeated = {line for line, n in counts.items() if n >= max(2, len(pages) // 2 + 1)}
+    if not repeated:
+        return pages
+
+    stripped = [pages[0]]
+    for page in pages[1:]:
+        lines = page.splitlines()
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        if len(non_empty) <= 2 * edge:
+            stripped.append(page)
+            continue
+        edges = set(non_empty[:edge] + non_empty[-edge:])
+        stripped.append("\n".join(
+            line for i, line in enumerate(lines) if not (i in edges and _normalize_line(line) in repeated)
+        ))
+    return stripped
+
+
+def collapse_whitespace(text: str) -> str:
+    """Squeeze markdown tables and runs of whitespace without touching the content."""
+    lines = []
+    for line in text.splitlines():
+        if line.lstrip().startswith("|"):
+            cells = [re.sub(r"\s+", " ", cell).strip() for cell in line.strip().strip("|").split("|")]
+            # Drop separator rows and rows without any content
+            if all(re.fullmatch(r":?-*:?", cell) for cell in cells):
+                continue
+            line = "| " + " | ".join(cells) + " |"
+        else:
+            line = re.sub(r"[ \t]{2,}", " ", line.rstrip())
+        lines.append(line)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def html_to_text(html: str) -> str:
+    html = re.sub(r"(?is)<(script|style|head)\b.*?</\1>", " ", html)
+    html = re.sub(r"(?i)<br\s*/?>|</p>|</div>|</tr>|</h\d>|</li>", "\n", html)
+    return html_lib.unescape(re.sub(r"<[^>]+>", " ", html))
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    if count_tokens(text) <= budget:
+        return text
+    # Characters per token varies; shrink proportionally until it fits
+    while count_tokens(text) > budget and text:
+        text = text[: int(len(text) * budget / count_tokens(text) * 0.95)]
+    return text + "\n[... truncated ...]"
+
+
+@dataclass
+class AgentInput:
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+def build_agent_input(
+    header: str,
+    plain: Optional[str],
+    html: Optional[str],
+    attachments: List[tuple[str, Optional[List[str]]]],
+    budget: int = AGENT_INPUT_TOKEN_BUDGET,
+) -> AgentInput:
+    """
+    Build the agent input from the email header block, body and the pages of
+    each attachment, keeping it within `budget` tokens.
+
+    Repeated page headers/footers are dropped and tables squeezed; if the
+    input is still too large, the body is capped and attachment pages are
+    kept in order of how likely they are to hold totals, due dates and
+    payment references, always keeping each attachment's first page.
+    """
+    raw_body = plain or html or "No email body content"
+    raw_text = f"{header}\n\nEmail Body:\n{raw_body}" + "".join(
+        f"\n\n--- Attachment: {name} ---\n" + "\n\n".join(pages or []) for name, pages in attachments
+    )
+    tokens_before = count_tokens(raw_text)
+
+    body = collapse_whitespace(plain if plain else html_to_text(html) if html else "No email body content")
+    head = f"{header}\n\nEmail Body:\n"
+    # Leave most of the budget for attachments, which is where the figures usually are
+    body_budget = budget // 4 if attachments else budget - count_tokens(head)
+    body = _truncate_to_tokens(body, body_budget)
+
+    documents = []  # (name, [page texts]) with pages cleaned
+    for name, pages in attachments:
+        if pages is None:
+            documents.append((name, ["[Text could not be extracted from this attachment]"]))
+        else:
+            documents.append((name, [collapse_whitespace(page) for page in strip_repeated_lines(pages)]))
+
+    remaining = budget - count_tokens(head + body)
+    candidates = []  # (priority, doc index, page index, tokens)
+    for d, (_, pages) in enumerate(documents):
+        for p, page in enumerate(pages):
+            hits = len(KEY_FIELDS.findall(page))
+            priority = (0 if p == 0 else 1, -hits, p)
+            candidates.append((priority, d, p, count_tokens(page)))
+
+    keep = set()
+    for priority, d, p, tokens in sorted(candidates):
+        if tokens > remaining and priority[0] == 0 and remaining > 200:
+            # A first page that doesn't fit is cut rather than dropped
+            documents[d][1][p] = _truncate_to_tokens(documents[d][1][p], remaining - 20)
+            tokens = count_tokens(documents[d][1][p])
+        if tokens <= remaining:
+            keep.add((d, p))
+            remaining -= tokens
+
+    sections = []
+    for d, (name, pages) in enumerate(documents):
+        kept = [page for p, page in enumerate(pages) if (d, p) in keep and page.strip()]
+        omitted = len(pages) - len([p for p in range(len(pages)) if (d, p) in keep])
+        if omitted:
+            kept.append(f"[... {omitted} of {len(pages)} pages omitted to fit the input budget ...]")
+        sections.append(f"--- Attachment: {name} ---\n" + "\n\n".join(kept))
+
+    text = head + body
+    if sections:
+        text += "\n\nAttachments:\n" + "\n\n".join(sections)
+    return AgentInput(text=text, tokens_before=tokens_before, tokens_after=count_tokens(text))
@@ -0,0 +1,139 @@
+import time
+import asyncio
+from collections import defaultdict
+from typing import List, Optional, Protocol
+
+from logger import setup_logger
+from constants import ALERT_COALESCE_SECONDS, ALERT_BURST, ALERT_RATE_PER_HOUR, ALERT_MAX_ATTEMPTS, STORE_POLL_SECONDS
+from utils.outbox import Outbox, OutboxItem, outbox as default_outbox
+
+
+logger = setup_logger()
+
+TOPIC = "urgent_alert"
+
+
+class AlertSink(Protocol):
+    async def send(self, user: str, message: str) -> None: ...
+
+
+class LogAlertSink:
+    """Stand-in for an SMS provider that only logs the alert."""
+
+    async def send(self, user: str, message: str):
+        logger.warning("📱 Urgent alert for %s: %s", user, message)
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, rate_per_second: float):
+        self.capacity = capacity
+        self.rate = rate_per_second
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class AlertDispatcher:
+    """
+    Delivers urgent alerts from the outbox in the background.
+
+    `enqueue` only writes the alert to the durable outbox, so the agent's
+    tool call never waits on the provider. Alerts become ready
+    `coalesce_window` seconds after they are queued, and everything queued
+    for the same user by then goes out as one message. Each user has a
+    token bucket; alerts over the limit wait for a token instead of
+    counting as failures. Failed sends are retried with backoff.
+    """
+
+    def __init__(
+        self,
+        store: Optional[Outbox] = None,
+        sink: Optional[AlertSink] = None,
+        coalesce_window: float = ALERT_COALESCE_SECONDS,
+        burst: int = ALERT_BURST,
+        rate_per_hour: float = ALERT_RATE_PER_HOUR,
+        max_attempts: int = ALERT_MAX_ATTEMPTS,
+    ):
+        self.outbox = store or default_outbox
+        self.sink = sink or LogAlertSink()
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self._buckets = defaultdict(lambda: TokenBucket(burst, rate_per_hour / 3600))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, user: str, message: str, reason: str = "") -> int:
+        """Queue an alert and return its id. Safe to call from any thread."""
+        item_id = self.outbox.put(TOPIC, user, {"message": message, "reason": reason}, delay=self.coalesce_window)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return item_id
+
+    async def _deliver(self, user: str, items: List[OutboxItem]):
+        bucket = self._buckets[user]
+        if not bucket.take():
+            wait = bucket.wait_time()
+            logger.info("Rate limited %d alerts for %s; next send in %.0fs", len(items), user, wait)
+            await asyncio.to_thread(self.outbox.defer, [item.item_id for item in items], time.time() + wait)
+            return
+
+        messages = list(dict.fromkeys(item.payload["message"] for item in items))  # drop exact repeats
+        text = messages[0] if len(messages) == 1 else "\n".join(f"• {message}" for message in messages)
+        try:
+            await self.sink.send(user, text)
+        except Exception as e:
+            dead = await asyncio.to_thread(self.outbox.fail, items, str(e), self.max_attempts)
+            logger.error("Failed to send alert to %s: %s (%d gave up)", user, e, len(dead))
+            return
+        await asyncio.to_thread(self.outbox.complete, [item.item_id for item in items])
+        logger.info("Sent alert to %s (%d merged)", user, len(items))
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                items = await asyncio.to_thread(self.outbox.lease, TOPIC, 120, 100, True)
+                by_user = defaultdict(list)
+                for item in items:
+                    by_user[item.key].append(item)
+                for user, user_items in by_user.items():
+                    await self._deliver(user, user_items)
+                if items:
+                    continue
+                await asyncio.to_thread(self.outbox.purge_expired, TOPIC)
+                next_at = await asyncio.to_thread(self.outbox.next_available, TOPIC)
+            except Exception as e:
+                logger.error("Alert dispatcher error: %s", e, exc_info=True)
+                next_at = time.time() + 5
+            # Worker processes queue items without waking this loop, so look again every so often
+            timeout = max(next_at - time.time(), 0.05) if next_at is not None else STORE_POLL_SECONDS
+            timeout = min(timeout, STORE_POLL_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+alert_dispatcher = AlertDispatcher()
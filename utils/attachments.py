@@ -0,0 +1,183 @@
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from dataclasses import dataclass
+
+from logger import setup_logger
+from constants import ATTACHMENT_DIR, ATTACHMENT_REFS_DB, ATTACHMENT_RETENTION_HOURS
+
+
+logger = setup_logger()
+
+
+@dataclass
+class StoredAttachment:
+    path: str
+    filename: str
+    sha256: str
+
+
+class AttachmentWriter:
+    """Streams one attachment to a temporary file while hashing it."""
+
+    def __init__(self, store: "AttachmentStore", email_id: str, filename: str):
+        self._store = store
+        self.email_id = email_id
+        self.filename = filename
+        self._digest = hashlib.sha256()
+        self._tmp_path = os.path.join(store.directory, f".incoming-{uuid.uuid4().hex}")
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, data: bytes):
+        self._digest.update(data)
+        self._file.write(data)
+
+    def commit(self) -> StoredAttachment:
+        self._file.close()
+        return self._store._commit(self, self._tmp_path, self._digest.hexdigest())
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class AttachmentStore:
+    """
+    Content-addressed attachment files shared by every email being processed.
+
+    Files are named by the SHA-256 of their content, so identical attachments
+    in different emails are stored once and concurrent emails never overwrite
+    each other. Each email holds a reference to the files it uses; a file is
+    deleted when the last email releases it, and anything still around after
+    the retention window is swept.
+
+    Adding a file and deciding to delete one both happen inside a write
+    transaction on the reference table, so worker processes sharing the
+    directory never delete a file another one just referenced.
+    """
+
+    def __init__(
+        self,
+        directory: str = ATTACHMENT_DIR,
+        refs_path: str = ATTACHMENT_REFS_DB,
+        retention: float = ATTACHMENT_RETENTION_HOURS * 3600,
+    ):
+        self.directory = directory
+        self.retention = retention
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(os.path.dirname(refs_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(refs_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attachment_ref (
+                sha256 TEXT NOT NULL,
+                email_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (sha256, email_id)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS attachment_ref_email ON attachment_ref (email_id)")
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def writer(self, email_id: str, filename: str) -> AttachmentWriter:
+        return AttachmentWriter(self, email_id, filename)
+
+    def _path(self, sha256: str, filename: str) -> str:
+        # Keep the extension, the parsers use it to detect the file type
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(self.directory, f"{sha256}{extension}")
+
+    def _commit(self, writer: AttachmentWriter, tmp_path: str, sha256: str) -> StoredAttachment:
+        path = self._path(sha256, writer.filename)
+
+        def commit():
+            self._conn.execute(
+                "INSERT OR IGNORE INTO attachment_ref (sha256, email_id, created) VALUES (?, ?, ?)",
+                (sha256, writer.email_id, time.time()),
+            )
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                logger.info("Attachment %s already stored as %s", writer.filename, path)
+            else:
+                os.replace(tmp_path, path)
+
+        self._transaction(commit)
+        return StoredAttachment(path=path, filename=writer.filename, sha256=sha256)
+
+    def _unreferenced(self, hashes) -> list[str]:
+        return [
+            sha256 for sha256 in hashes
+            if self._conn.execute("SELECT 1 FROM attachment_ref WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone() is None
+        ]
+
+    def _delete_files(self, hashes: set[str]):
+        if not hashes:
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name[:64] in hashes:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                logger.info("Removed attachment %s", entry.name)
+
+    def release(self, email_id: str):
+        """Drop an email's references and delete files no other email uses."""
+
+        def release():
+            hashes = [
+                sha256 for (sha256,) in self._conn.execute(
+                    "SELECT sha256 FROM attachment_ref WHERE email_id = ?", (email_id,)
+                )
+            ]
+            self._conn.execute("DELETE FROM attachment_ref WHERE email_id = ?", (email_id,))
+            self._delete_files(set(self._unreferenced(hashes)))
+
+        self._transaction(release)
+
+    def sweep(self):
+        """
+        Remove references older than the retention window (emails that never
+        finished, e.g. after a crash) and every file nothing refers to.
+        """
+        cutoff = time.time() - self.retention
+
+        def sweep():
+            expired = self._conn.execute("DELETE FROM attachment_ref WHERE created < ?", (cutoff,)).rowcount
+            if expired:
+                logger.warning("Expired %d attachment references past the retention window", expired)
+            referenced = {sha256 for (sha256,) in self._conn.execute("SELECT DISTINCT sha256 FROM attachment_ref")}
+
+            orphans = set()
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(".incoming-"):
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                elif entry.name[:64] not in referenced:
+                    orphans.add(entry.name[:64])
+            self._delete_files(orphans)
+
+        self._transaction(sweep)
+
+
+attachment_store = AttachmentStore()
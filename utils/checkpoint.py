@@ -0,0 +1,145 @@
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional
+
+from logger import setup_logger
+from constants import CHECKPOINT_DB
+
+
+logger = setup_logger()
+
+
+@dataclass
+class Checkpoint:
+    uidvalidity: int
+    last_uid: int
+    completed: set[int] = field(default_factory=set)
+
+
+class CheckpointStore:
+    """
+    Durable per-mailbox record of UIDVALIDITY, last_uid and the UIDs above
+    last_uid that already finished processing, backed by SQLite.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS mailbox_state (
+                mailbox TEXT PRIMARY KEY,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS completed_uid (
+                mailbox TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                PRIMARY KEY (mailbox, uid)
+            );
+            """
+        )
+
+    def load(self, mailbox: str) -> Optional[Checkpoint]:
+        row = self._conn.execute(
+            "SELECT uidvalidity, last_uid FROM mailbox_state WHERE mailbox = ?", (mailbox,)
+        ).fetchone()
+        if row is None:
+            return None
+        completed = {
+            uid for (uid,) in self._conn.execute(
+                "SELECT uid FROM completed_uid WHERE mailbox = ? AND uid > ?", (mailbox, row[1])
+            )
+        }
+        return Checkpoint(uidvalidity=row[0], last_uid=row[1], completed=completed)
+
+    def reset(self, mailbox: str, uidvalidity: int, last_uid: int):
+        """Start a fresh checkpoint, e.g. on first run or after UIDVALIDITY changed."""
+        with self._conn:
+            self._conn.execute("DELETE FROM completed_uid WHERE mailbox = ?", (mailbox,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mailbox_state (mailbox, uidvalidity, last_uid) VALUES (?, ?, ?)",
+                (mailbox, uidvalidity, last_uid),
+            )
+
+    def mark_completed(self, mailbox: str, uid: int):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO completed_uid (mailbox, uid) VALUES (?, ?)", (mailbox, uid)
+            )
+
+    def advance(self, mailbox: str, last_uid: int):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE mailbox_state SET last_uid = ? WHERE mailbox = ?", (last_uid, mailbox)
+            )
+            self._conn.execute(
+                "DELETE FROM completed_uid WHERE mailbox = ? AND uid <= ?", (mailbox, last_uid)
+            )
+
+
+class UidWatermark:
+    """
+    Tracks in-flight UIDs so that last_uid only advances once every lower UID
+    has finished processing, even when workers complete out of order.
+    Progress is written through to a CheckpointStore when one is given.
+
+    Every reset (a UIDVALIDITY change) starts a new generation; jobs tag
+    themselves with the generation returned by start(), and finishing a job
+    from an older generation is ignored.
+    """
+
+    def __init__(
+        self,
+        last_uid: int,
+        store: Optional[CheckpointStore] = None,
+        mailbox: Optional[str] = None,
+        completed: Optional[set[int]] = None,
+    ):
+        self.store = store
+        self.mailbox = mailbox
+        self.generation = 0
+        self.reset(last_uid, completed)
+
+    def reset(self, last_uid: int, completed: Optional[set[int]] = None):
+        self.generation += 1
+        self.last_uid = last_uid
+        self.highest_seen = last_uid
+        self.completed = set(completed or ())
+        self._in_flight: set[int] = set()
+
+    def start(self, uid: int) -> int:
+        """Mark a UID as in flight; returns the generation to finish it with."""
+        self._in_flight.add(uid)
+        self.highest_seen = max(self.highest_seen, uid)
+        return self.generation
+
+    def skip(self, uid: int, generation: Optional[int] = None):
+        """Mark a UID that needs no processing as done."""
+        if generation is not None and generation != self.generation:
+            return
+        self.finish(uid, self.start(uid))
+
+    def finish(self, uid: int, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            # Its UID belongs to the mailbox before a UIDVALIDITY change
+            logger.info("Ignoring UID %s from before the UIDVALIDITY change", uid)
+            return
+        self._in_flight.discard(uid)
+        self.completed.add(uid)
+        if self.store is not None:
+            self.store.mark_completed(self.mailbox, uid)
+
+        if self._in_flight:
+            new_last_uid = min(self._in_flight) - 1
+        else:
+            new_last_uid = self.highest_seen
+        if new_last_uid > self.last_uid:
+            self.last_uid = new_last_uid
+            self.completed = {u for u in self.completed if u > new_last_uid}
+            if self.store is not None:
+                self.store.advance(self.mailbox, new_last_uid)
+            logger.info("Updated last_uid → %s", self.last_uid)
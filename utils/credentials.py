@@ -0,0 +1,108 @@
+import os
+import copy
+import pickle
+import datetime
+import threading
+from typing import Optional
+
+from google.auth.transport.requests import Request
+
+from logger import setup_logger
+from constants import TOKEN_FILE, TOKEN_REFRESH_MARGIN
+
+
+logger = setup_logger()
+
+
+class CredentialManager:
+    """
+    Process-wide OAuth credentials shared by IMAP and SMTP.
+
+    token.pickle is read once; after that the credentials live in memory and
+    a background thread refreshes them `refresh_margin` seconds before they
+    expire and writes them back atomically, so callers never wait on a
+    refresh or on disk I/O. A refresh works on a copy and only swaps it in
+    under the lock, so readers aren't held up by the OAuth round-trip.
+    """
+
+    def __init__(self, token_file: str = TOKEN_FILE, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._creds = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # one refresh at a time; readers only need _lock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load(self):
+        logger.info("Loading %s…", self.token_file)
+        with open(self.token_file, "rb") as f:
+            self._creds = pickle.load(f)
+
+    def _persist(self, creds):
+        tmp_path = f"{self.token_file}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(creds, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.token_file)
+
+    def _refresh(self):
+        """Refresh the credentials if they are due, without holding _lock during the network call."""
+        with self._refresh_lock:
+            with self._lock:
+                if self._seconds_until_refresh() > 0:
+                    return  # another thread refreshed them while we waited
+                creds = copy.deepcopy(self._creds)
+            logger.info("Refreshing OAuth token…")
+            creds.refresh(Request())
+            with self._lock:
+                self._creds = creds
+            self._persist(creds)
+            logger.info("Refresh complete; new expiry=%s", creds.expiry)
+
+    def _seconds_until_refresh(self) -> float:
+        if self._creds.expiry is None:
+            return 3600
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (self._creds.expiry - now).total_seconds() - self.refresh_margin
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                delay = self._seconds_until_refresh()
+            if self._stop.wait(max(delay, 0)):
+                break
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error("Token refresh failed: %s; retrying in 30s", e)
+                self._stop.wait(30)
+
+    def start(self):
+        """Load the credentials and start the background refresher if it isn't running."""
+        with self._lock:
+            if self._creds is None:
+                self._load()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def token(self) -> str:
+        """Return a valid access token, normally straight from memory."""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            # Only happens if the background refresh kept failing
+            stale = self._creds.expired and self._creds.refresh_token
+        if stale:
+            self._refresh()
+        with self._lock:
+            return self._creds.token
+
+
+credentials = CredentialManager()
@@ -1,73 +1,324 @@
-import pickle
+import os
 import base64
+import time
+import quopri
+import asyncio
 import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email import policy
+from email.header import decode_header, make_header
 from email.message import EmailMessage
+from email.parser import BytesParser
+from email.utils import decode_rfc2231
+from typing import Iterator, Optional
+from urllib.parse import unquote
 
 from logger import setup_logger
 from imapclient import IMAPClient
-from google.auth.transport.requests import Request
-from constants import HOST, USER, MAILBOX
+from constants import (
+    USER,
+    MAILBOX,
+    ATTACHMENT_MAX_MB,
+    ATTACHMENT_CHUNK_BYTES,
+    ATTACHMENT_SKIP_TYPES,
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_STARTTLS,
+    SMTP_AUTH,
+    SMTP_IDLE_TIMEOUT,
+    SMTP_NOOP_AFTER,
+)
+from utils.attachments import StoredAttachment, attachment_store
+from utils.credentials import credentials
+from utils.accounts import Account, account_for
 
 
 logger = setup_logger()
 
 
-def process_message(msg) -> tuple[str, str, str, str, str, str, list[str]]:
+@dataclass
+class MessagePart:
+    section: str
+    content_type: str
+    params: dict
+    encoding: str
+    size: int
+    filename: Optional[str]
+    is_attachment: bool
 
-    from_email = msg["From"]
-    to_email = msg["To"]
-    subject = msg["Subject"]
-    date = msg["Date"]
 
-    # Extract text parts
-    plain, html = None, None
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_disposition() == "attachment":
-                continue
-            ctype = part.get_content_type()
-            if ctype == "text/plain" and plain is None:
-                plain = part.get_content()
-            elif ctype == "text/html" and html is None:
-                html = part.get_content()
+def _params(raw) -> dict:
+    """Turn a flat BODYSTRUCTURE parameter list into a lower-cased dict."""
+    if not raw:
+        return {}
+    items = [v.decode(errors="replace") if isinstance(v, bytes) else v for v in raw]
+    return {items[i].lower(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+
+def _decode_filename(params: dict) -> Optional[str]:
+    for key in ("filename", "name"):
+        if f"{key}*" in params:
+            charset, _, value = decode_rfc2231(params[f"{key}*"])
+            value = unquote(value, encoding=charset or "utf-8", errors="replace")
+        elif key in params:
+            value = str(make_header(decode_header(params[key])))
+        else:
+            continue
+        # Never trust a sender-supplied path
+        return os.path.basename(value.replace("\\", "/")) or None
+    return None
+
+
+def walk_bodystructure(body, section: str = "") -> Iterator[MessagePart]:
+    """Yield every leaf MIME part of a BODYSTRUCTURE with its IMAP section number."""
+    if body.is_multipart:
+        for i, child in enumerate(body[0], 1):
+            yield from walk_bodystructure(child, f"{section}.{i}" if section else str(i))
+        return
+
+    ctype = f"{body[0].decode()}/{body[1].decode()}".lower()
+    params = _params(body[2])
+    encoding = (body[5] or b"7BIT").decode().lower()
+    size = body[6] or 0
+
+    # Extension data follows the type-specific fields
+    if ctype == "message/rfc822":
+        disposition_index = 11
+    elif ctype.startswith("text/"):
+        disposition_index = 9
     else:
-        if msg.get_content_type() == "text/plain":
-            plain = msg.get_content()
-        elif msg.get_content_type() == "text/html":
-            html = msg.get_content()
-
-    # Save attachments and collect filenames
-    file_urls = []
-    for part in msg.iter_attachments():
-        filename = part.get_filename()
-        content = part.get_content()
-        with open(f"tmp/{filename}", "wb") as f:
-            f.write(content)
-        logger.info("Saved attachment: %s", filename)
-        file_urls.append(f"tmp/{filename}")
-
-    return from_email, to_email, subject, date, plain, html, file_urls
-
-
-def get_imap_client():
-    logger.info("Loading token.pickle…")
-    with open("token.pickle", "rb") as f:
-        creds = pickle.load(f)
-
-    if creds.expired and creds.refresh_token:
-        logger.info("Token expired; refreshing…")
-        creds.refresh(Request())
-        logger.info("Refresh complete; new expiry=%s", creds.expiry)
-
-    logger.info("Connecting to %s…", HOST)
-    client = IMAPClient(HOST, ssl=True)
-    logger.info("Authenticating via XOAUTH2 for %s", USER)
-    client.oauth2_login(USER, creds.token)
-    logger.info("Selecting folder %r…", MAILBOX)
-    client.select_folder(MAILBOX, readonly=True)
+        disposition_index = 8
+    disposition = body[disposition_index] if len(body) > disposition_index else None
+    disposition_type = ""
+    disposition_params = {}
+    if isinstance(disposition, tuple) and disposition:
+        disposition_type = disposition[0].decode().lower()
+        disposition_params = _params(disposition[1])
+
+    filename = _decode_filename({**params, **disposition_params})
+    is_attachment = (
+        disposition_type == "attachment"
+        or filename is not None
+        or ctype not in ("text/plain", "text/html")
+    )
+    yield MessagePart(section or "1", ctype, params, encoding, size, filename, is_attachment)
+
+
+class StreamDecoder:
+    """Incrementally decode a Content-Transfer-Encoding across chunk boundaries."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.encoding == "base64":
+            data = self._pending + b"".join(chunk.split())
+            usable = len(data) - len(data) % 4
+            self._pending = data[usable:]
+            return base64.b64decode(data[:usable])
+        if self.encoding == "quoted-printable":
+            # Only decode whole lines so soft line breaks are never split
+            data = self._pending + chunk
+            cut = data.rfind(b"\n") + 1
+            self._pending = data[cut:]
+            return quopri.decodestring(data[:cut])
+        return chunk
+
+    def flush(self) -> bytes:
+        data, self._pending = self._pending, b""
+        if self.encoding == "base64":
+            return base64.b64decode(data + b"=" * (-len(data) % 4)) if data else b""
+        if self.encoding == "quoted-printable":
+            return quopri.decodestring(data)
+        return data
+
+
+def _body_section(data: dict, section: str) -> bytes:
+    """Find a BODY[section] value in a fetch response, ignoring any <offset> suffix."""
+    prefix = f"BODY[{section}]".encode()
+    for key, value in data.items():
+        if isinstance(key, bytes) and key.startswith(prefix):
+            return value or b""
+    return b""
+
+
+def _should_skip(part: MessagePart) -> Optional[str]:
+    extension = os.path.splitext(part.filename or "")[1].lower()
+    if part.content_type in ATTACHMENT_SKIP_TYPES or (extension and extension in ATTACHMENT_SKIP_TYPES):
+        return "skip-listed type"
+    decoded_size = part.size * 3 // 4 if part.encoding == "base64" else part.size
+    if decoded_size > ATTACHMENT_MAX_MB * 1024 * 1024:
+        return f"too large ({decoded_size} bytes)"
+    return None
+
+
+async def _stream_part(client: "AsyncIMAPClient", uid: int, part: MessagePart, out):
+    """Fetch one MIME part in ATTACHMENT_CHUNK_BYTES pieces and decode it straight into `out`."""
+    decoder = StreamDecoder(part.encoding)
+    offset = 0
+    while True:
+        data = await client.fetch(uid, [f"BODY.PEEK[{part.section}]<{offset}.{ATTACHMENT_CHUNK_BYTES}>"])
+        chunk = _body_section(data.get(uid, {}), part.section)
+        out.write(decoder.feed(chunk))
+        offset += len(chunk)
+        if len(chunk) < ATTACHMENT_CHUNK_BYTES:
+            break
+    out.write(decoder.flush())
+
+
+async def fetch_message(
+    client: "AsyncIMAPClient", uid: int, bodystructure, email_id: str
+) -> tuple[str, str, str, str, str, str, list[StoredAttachment]]:
+    """
+    Fetch a message part by part instead of as one RFC822 blob: the header
+    and text bodies in one request, then each attachment streamed into the
+    attachment store under `email_id`, which must release it when done.
+    """
+    parts = list(walk_bodystructure(bodystructure))
+    text_parts = {}
+    for part in parts:
+        if not part.is_attachment and part.content_type not in text_parts:
+            text_parts[part.content_type] = part
+
+    sections = ["BODY.PEEK[HEADER]"] + [f"BODY.PEEK[{part.section}]" for part in text_parts.values()]
+    data = (await client.fetch(uid, sections)).get(uid, {})
+
+    headers = BytesParser(policy=policy.default).parsebytes(_body_section(data, "HEADER"), headersonly=True)
+    from_email = headers["From"]
+    to_email = headers["To"]
+    subject = headers["Subject"]
+    date = headers["Date"]
+
+    # Extract text parts
+    texts = {}
+    for ctype, part in text_parts.items():
+        decoder = StreamDecoder(part.encoding)
+        raw = decoder.feed(_body_section(data, part.section)) + decoder.flush()
+        charset = part.params.get("charset", "utf-8")
+        try:
+            texts[ctype] = raw.decode(charset, errors="replace")
+        except LookupError:
+            texts[ctype] = raw.decode("utf-8", errors="replace")
+    plain, html = texts.get("text/plain"), texts.get("text/html")
+
+    # Save attachments
+    attachments = []
+    for part in parts:
+        if not part.is_attachment:
+            continue
+        filename = part.filename or f"uid{uid}_part{part.section}"
+        reason = _should_skip(part)
+        if reason:
+            logger.info("Skipping attachment %s: %s", filename, reason)
+            continue
+        writer = await asyncio.to_thread(attachment_store.writer, email_id, filename)
+        try:
+            await _stream_part(client, uid, part, writer)
+        except BaseException:
+            writer.abort()
+            raise
+        # Moves the file into place and updates the refs database
+        attachment = await asyncio.to_thread(writer.commit)
+        logger.info("Saved attachment: %s → %s", filename, attachment.path)
+        attachments.append(attachment)
+
+    return from_email, to_email, subject, date, plain, html, attachments
+
+
+def envelope_sender(envelope) -> str:
+    """Return the bare sender address from an IMAP ENVELOPE, or "" if missing."""
+    if envelope is None or not envelope.from_:
+        return ""
+    address = envelope.from_[0]
+    if address.mailbox is None or address.host is None:
+        return ""
+    return f"{address.mailbox.decode()}@{address.host.decode()}"
+
+
+def get_imap_client(account: Optional[Account] = None, folder: str = MAILBOX):
+    account = account or account_for(USER)
+    logger.info("Connecting to %s…", account.host)
+    client = IMAPClient(account.host, ssl=True)
+    logger.info("Authenticating via XOAUTH2 for %s", account.user)
+    client.oauth2_login(account.user, account.credentials.token())
+    logger.info("Selecting folder %r…", folder)
+    client.select_folder(folder, readonly=True)
     return client
 
 
+class AsyncIMAPClient:
+    """
+    Runs a blocking IMAPClient on its own thread so IDLE waits and fetches
+    never stall the event loop. IMAPClient is not thread-safe, so every call
+    for one connection goes through the same single-thread executor.
+    """
+
+    def __init__(self, client: IMAPClient, executor: ThreadPoolExecutor, account: Optional[Account], folder: str):
+        self._client = client
+        self._executor = executor
+        self.account = account
+        self.folder = folder
+
+    @classmethod
+    async def connect(cls, account: Optional[Account] = None, folder: str = MAILBOX) -> "AsyncIMAPClient":
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap")
+        loop = asyncio.get_running_loop()
+        try:
+            client = await loop.run_in_executor(executor, get_imap_client, account, folder)
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+        return cls(client, executor, account, folder)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    async def select_folder(self, folder, readonly=False):
+        info = await self._run(self._client.select_folder, folder, readonly=readonly)
+        self.folder = folder
+        return info
+
+    async def search(self, criteria):
+        return await self._run(self._client.search, criteria)
+
+    async def fetch(self, messages, data):
+        return await self._run(self._client.fetch, messages, data)
+
+    async def idle_wait(self, timeout):
+        """Enter IDLE, wait up to `timeout` seconds for notifications and leave IDLE."""
+
+        def _idle():
+            self._client.idle()
+            try:
+                return self._client.idle_check(timeout=timeout)
+            finally:
+                self._client.idle_done()
+
+        return await self._run(_idle)
+
+    async def reconnect(self):
+        """Replace a dropped connection, keeping the same IMAP thread."""
+
+        def _reconnect():
+            try:
+                self._client.logout()
+            except Exception:
+                pass
+            self._client = get_imap_client(self.account, self.folder)
+
+        await self._run(_reconnect)
+
+    async def logout(self):
+        try:
+            await self._run(self._client.logout)
+        finally:
+            self._executor.shutdown(wait=False)
+
+
 def generate_oauth2_string(user, access_token):
     """
     Generate the base64-encoded OAuth2 authentication string for SMTP/XOAUTH2.
@@ -76,39 +327,149 @@ def generate_oauth2_string(user, access_token):
     return base64.b64encode(auth_string.encode()).decode()
 
 
-def send_email(*, to_addrs, subject, body, html=None):
+class SMTPSession:
     """
-    Send an email via Gmail SMTP using XOAUTH2.
-    to_addrs: recipient or list of recipients
-    subject: email subject
-    body: plain-text body
-    html: optional HTML body
+    A long-lived, authenticated SMTP connection reused across replies.
+
+    The connection is opened lazily, closed after `idle_timeout` seconds
+    without use, checked with NOOP when it has been quiet for a while, and
+    re-established transparently if the server dropped it.
     """
-    # refresh token if needed
-    with open("token.pickle", "rb") as f:
-        creds = pickle.load(f)
-    if creds.expired and creds.refresh_token:
-        logger.info("Refreshing SMTP token…")
-        creds.refresh(Request())
 
-    access_token = creds.token
-    auth_string = generate_oauth2_string(USER, access_token)
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        user: str = USER,
+        starttls: bool = SMTP_STARTTLS,
+        auth: str = SMTP_AUTH,
+        token_provider=credentials.token,
+        idle_timeout: float = SMTP_IDLE_TIMEOUT,
+        noop_after: float = SMTP_NOOP_AFTER,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.starttls = starttls
+        self.auth = auth
+        self.token_provider = token_provider
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        logger.info("Connecting to SMTP server %s:%s…", self.host, self.port)
+        smtp = smtplib.SMTP(self.host, self.port)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.auth == "xoauth2":
+                # authenticate with OAuth2
+                code, response = smtp.docmd("AUTH", "XOAUTH2 " + generate_oauth2_string(self.user, self.token_provider()))
+                if code != 235:
+                    raise smtplib.SMTPAuthenticationError(code, response)
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
 
+    def _drop(self):
+        """Forget the connection, closing our end of the socket even if the server already hung up."""
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except OSError:
+                pass
+            self._smtp = None
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._drop()
+
+    def _ensure_connected(self):
+        idle = time.monotonic() - self._last_used
+        if self._smtp is not None and idle > self.idle_timeout:
+            logger.info("SMTP connection idle for %.0fs; reconnecting", idle)
+            self._close()
+        elif self._smtp is not None and idle > self.noop_after:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self._close()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        if self._smtp is None:
+            self._connect()
+
+    def send_messages(self, messages: list[EmailMessage]):
+        """Send several messages back to back over the same session."""
+        with self._lock:
+            for msg in messages:
+                self._ensure_connected()
+                try:
+                    self._smtp.send_message(msg)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    logger.info("SMTP connection dropped; reconnecting")
+                    self._drop()
+                    self._connect()
+                    self._smtp.send_message(msg)
+                self._last_used = time.monotonic()
+
+    def send(self, msg: EmailMessage):
+        self.send_messages([msg])
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+smtp_session = SMTPSession()
+_smtp_sessions = {USER: smtp_session}
+
+
+def smtp_session_for(user: Optional[str]) -> SMTPSession:
+    """The shared SMTP session of an account, opened on first use."""
+    if user is None or user == USER:
+        return smtp_session
+    if user not in _smtp_sessions:
+        account = account_for(user)
+        _smtp_sessions[user] = SMTPSession(
+            host=account.smtp_host,
+            port=account.smtp_port,
+            user=account.user,
+            token_provider=account.credentials.token,
+        )
+    return _smtp_sessions[user]
+
+
+def build_email(*, to_addrs, subject, body, html=None, from_user=None) -> EmailMessage:
     # build the email message
     msg = EmailMessage()
     msg["Subject"] = subject
-    msg["From"] = USER
+    msg["From"] = from_user or USER
     msg["To"] = to_addrs
     msg.set_content(body)
     if html:
         msg.add_alternative(html, subtype="html")
+    return msg
+
 
-    logger.info("Connecting to SMTP server smtp.gmail.com:587…")
-    with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.ehlo()
-        # authenticate with OAuth2
-        smtp.docmd("AUTH", "XOAUTH2 " + auth_string)
-        smtp.send_message(msg)
+def send_email(*, to_addrs, subject, body, html=None, from_user=None):
+    """
+    Send an email via Gmail SMTP using XOAUTH2, over the shared SMTP session.
+    to_addrs: recipient or list of recipients
+    subject: email subject
+    body: plain-text body
+    html: optional HTML body
+    from_user: sending account, defaults to EMAIL_USER
+    """
+    msg = build_email(to_addrs=to_addrs, subject=subject, body=body, html=html, from_user=from_user)
+    smtp_session_for(from_user).send(msg)
     logger.info("Email sent to %s", to_addrs)
@@ -0,0 +1,231 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from logger import setup_logger
+from constants import IDEMPOTENCY_DB, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CLAIM_SECONDS
+
+
+logger = setup_logger()
+
+STARTED = "started"
+AGENT_DONE = "agent_done"
+REPLY_QUEUED = "reply_queued"  # handed to the reply outbox, which marks it replied once sent
+REPLIED = "replied"
+SKIPPED = "skipped"  # finished without a reply (pre-classified or the agent chose not to answer)
+
+FINISHED = {REPLY_QUEUED, REPLIED, SKIPPED}
+
+# Tells this run apart from an earlier one that had the same pid (e.g. pid 1 in a container)
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+class MessageBusy(Exception):
+    """The message is being processed by another task or process; try it again later."""
+
+
+@dataclass
+class ProcessedMessage:
+    key: str
+    state: str
+    reply_subject: Optional[str] = None
+    reply_body: Optional[str] = None
+
+
+def normalize_message_id(message_id) -> Optional[str]:
+    if isinstance(message_id, bytes):
+        message_id = message_id.decode("utf-8", errors="replace")
+    message_id = (message_id or "").strip().strip("<>").strip()
+    return message_id or None
+
+
+def message_id_key(message_id) -> Optional[str]:
+    message_id = normalize_message_id(message_id)
+    return f"mid:{message_id}" if message_id else None
+
+
+def message_key(message_id, message: tuple) -> str:
+    """
+    Identify a message by its Message-ID, or by a hash of its headers,
+    bodies and attachment contents when it has none.
+    """
+    key = message_id_key(message_id)
+    if key:
+        return key
+    from_email, to_email, subject, date, plain, html, attachments = message
+    digest = hashlib.sha256()
+    for value in (from_email, to_email, subject, date, plain, html, *(a.sha256 for a in attachments)):
+        digest.update(str(value or "").encode("utf-8", errors="replace"))
+        digest.update(b"\0")
+    return f"sha256:{digest.hexdigest()}"
+
+
+class ProcessedStore:
+    """
+    Durable record of which messages have been processed and how far each
+    got, so duplicate deliveries, reconnect races and replays are not run
+    through the agent or answered twice.
+
+    State lives in SQLite; the most recently used entries are also kept in
+    a bounded in-memory cache so repeat lookups don't touch the database.
+    Claims are taken in the database itself, so they hold across worker
+    processes.
+    """
+
+    def __init__(
+        self,
+        path: str = IDEMPOTENCY_DB,
+        cache_size: int = IDEMPOTENCY_CACHE_SIZE,
+        claim_seconds: float = IDEMPOTENCY_CLAIM_SECONDS,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.cache_size = cache_size
+        self.claim_seconds = claim_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{RUN_ID}"
+        self._cache: OrderedDict[str, ProcessedMessage] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_message (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                reply_subject TEXT,
+                reply_body TEXT,
+                updated REAL NOT NULL,
+                claimed_by TEXT,  -- host:pid:run of the process processing it
+                claimed_at REAL
+            )
+            """
+        )
+
+    def _remember(self, entry: ProcessedMessage):
+        self._cache[entry.key] = entry
+        self._cache.move_to_end(entry.key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, key: str) -> Optional[ProcessedMessage]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry
+            row = self._conn.execute(
+                "SELECT state, reply_subject, reply_body FROM processed_message WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = ProcessedMessage(key, *row)
+            self._remember(entry)
+            return entry
+
+    def is_finished(self, key: str) -> bool:
+        entry = self.get(key)
+        return entry is not None and entry.state in FINISHED
+
+    def _claim_is_stale(self, owner: Optional[str], claimed_at: Optional[float], now: float) -> bool:
+        if owner is None or claimed_at is None or claimed_at < now - self.claim_seconds:
+            return True
+        host, pid, run = (owner.split(":") + ["", ""])[:3]
+        if host != socket.gethostname():
+            return False
+        if pid == str(os.getpid()):
+            return run != RUN_ID  # an earlier run that had our pid, or another task of this one
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True  # the claiming process is gone
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def claim(self, key: str) -> Optional[ProcessedMessage]:
+        """
+        Start processing a message. Returns None if it is finished or
+        being processed by another task or process, otherwise its previous
+        entry (or a new "started" one) so the caller can resume from there.
+
+        A claim whose process died, or that is older than `claim_seconds`,
+        is taken over.
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                inserted = self._conn.execute(
+                    """
+                    INSERT INTO processed_message (key, state, updated, claimed_by, claimed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO NOTHING
+                    """,
+                    (key, STARTED, now, self.owner, now),
+                ).rowcount
+                if inserted:
+                    entry = ProcessedMessage(key, STARTED)
+                    self._remember(entry)
+                    return entry
+                state, reply_subject, reply_body, owner, claimed_at = self._conn.execute(
+                    "SELECT state, reply_subject, reply_body, claimed_by, claimed_at FROM processed_message WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                entry = ProcessedMessage(key, state, reply_subject, reply_body)
+                self._remember(entry)
+                if state in FINISHED or not self._claim_is_stale(owner, claimed_at, now):
+                    return None
+                # Compare-and-set on the previous claim, so only one process takes it over
+                taken = self._conn.execute(
+                    "UPDATE processed_message SET claimed_by = ?, claimed_at = ? "
+                    "WHERE key = ? AND claimed_by IS ? AND claimed_at IS ?",
+                    (self.owner, now, key, owner, claimed_at),
+                ).rowcount
+        if not taken:
+            return None
+        if entry.state == STARTED:
+            logger.warning("Message %s was started before but never finished; processing it again", key)
+        return entry
+
+    def mark(
+        self, key: str, state: str, reply_subject: Optional[str] = None, reply_body: Optional[str] = None
+    ) -> ProcessedMessage:
+        entry = ProcessedMessage(key, state, reply_subject, reply_body)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO processed_message (key, state, reply_subject, reply_body, updated)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state,
+                        reply_subject = COALESCE(excluded.reply_subject, reply_subject),
+                        reply_body = COALESCE(excluded.reply_body, reply_body),
+                        updated = excluded.updated
+                    """,
+                    (key, state, reply_subject, reply_body, time.time()),
+                )
+            if key in self._cache:
+                previous = self._cache[key]
+                entry.reply_subject = reply_subject or previous.reply_subject
+                entry.reply_body = reply_body or previous.reply_body
+            self._remember(entry)
+        return entry
+
+    def release(self, key: str):
+        """Mark processing of the message as over; unfinished messages can be claimed again."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE processed_message SET claimed_by = NULL, claimed_at = NULL WHERE key = ? AND claimed_by = ?",
+                    (key, self.owner),
+                )
+
+
+processed_store = ProcessedStore()
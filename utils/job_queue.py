@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from logger import setup_logger
+from constants import JOB_QUEUE_DB, JOB_VISIBILITY_TIMEOUT, JOB_MAX_ATTEMPTS
+from utils.outbox import backoff
+
+
+logger = setup_logger()
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    job_id: int
+    group_key: str
+    payload: dict
+    attempts: int
+    enqueued: float
+
+
+@dataclass
+class QueueStats:
+    pending: int
+    leased: int
+    failed: int
+    done_last_hour: int
+    oldest_pending_age: Optional[float]  # seconds the oldest ready job has been waiting
+
+
+class JobQueue:
+    """
+    Durable email job queue in SQLite, consumed by any number of worker
+    processes.
+
+    A worker leases a job for `visibility_timeout` seconds and must complete
+    it, or extend the lease, before then; a job whose lease runs out (e.g.
+    its worker crashed) is handed to the next worker. An ordered job is
+    only leased once no earlier job with the same group key (the sender)
+    is still open, so a group's ordered work runs one job at a time in the
+    order the jobs were queued; unordered jobs are leased right away.
+    """
+
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_DB,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS job (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                ordered INTEGER NOT NULL DEFAULT 1,
+                available_at REAL NOT NULL,
+                worker TEXT,
+                enqueued REAL NOT NULL,
+                finished REAL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS job_ready ON job (state, available_at);
+            CREATE INDEX IF NOT EXISTS job_group ON job (group_key, state, job_id);
+            CREATE INDEX IF NOT EXISTS job_finished ON job (state, finished);
+            """
+        )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def put(self, group_key: str, payload: dict, ordered: bool = True) -> int:
+        now = time.time()
+        return self._transaction(lambda: self._conn.execute(
+            "INSERT INTO job (group_key, payload, state, ordered, available_at, enqueued) VALUES (?, ?, ?, ?, ?, ?)",
+            (group_key, json.dumps(payload), PENDING, int(ordered), now, now),
+        ).lastrowid)
+
+    def lease(self, worker: str) -> Optional[Job]:
+        """Lease the oldest ready job that is unordered or whose group has nothing earlier still open, or return None."""
+
+        def lease():
+            now = time.time()
+            # Expired leases go back to pending; the attempt they used still counts
+            self._conn.execute(
+                f"UPDATE job SET state = '{PENDING}', worker = NULL WHERE state = '{LEASED}' AND available_at <= ?",
+                (now,),
+            )
+            self._conn.execute(
+                f"UPDATE job SET state = '{FAILED}', last_error = 'too many attempts', finished = ? "
+                f"WHERE state = '{PENDING}' AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = self._conn.execute(
+                f"""
+                SELECT job_id, group_key, payload, attempts, enqueued FROM job AS j
+                WHERE state = '{PENDING}' AND available_at <= ?
+                AND (ordered = 0 OR NOT EXISTS (
+                    SELECT 1 FROM job AS earlier
+                    WHERE earlier.group_key = j.group_key AND earlier.job_id < j.job_id
+                    AND earlier.state IN ('{PENDING}', '{LEASED}')
+                ))
+                ORDER BY job_id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                f"UPDATE job SET state = '{LEASED}', worker = ?, attempts = attempts + 1, available_at = ? "
+                f"WHERE job_id = ?",
+                (worker, now + self.visibility_timeout, row[0]),
+            )
+            return Job(row[0], row[1], json.loads(row[2]), row[3] + 1, row[4])
+
+        return self._transaction(lease)
+
+    def extend(self, job_id: int, worker: str) -> bool:
+        """Renew a lease; False if the job was meanwhile handed to another worker."""
+        return self._transaction(lambda: self._conn.execute(
+            f"UPDATE job SET available_at = ? WHERE job_id = ? AND worker = ? AND state = '{LEASED}'",
+            (time.time() + self.visibility_timeout, job_id, worker),
+        ).rowcount == 1)
+
+    def complete(self, job_id: int, worker: str):
+        self._transaction(lambda: self._conn.execute(
+            f"UPDATE job SET state = '{DONE}', finished = ? WHERE job_id = ? AND worker = ?",
+            (time.time(), job_id, worker),
+        ))
+
+    def requeue_ordered(self, job: Job, worker: str, payload: dict):
+        """
+        Finish the unordered step of a job and put it back with `payload`,
+        to be leased in its group's order. It keeps its place in the group
+        and gets a fresh set of attempts.
+        """
+        self._transaction(lambda: self._conn.execute(
+            f"UPDATE job SET state = '{PENDING}', ordered = 1, payload = ?, attempts = 0, available_at = ?, "
+            f"worker = NULL WHERE job_id = ? AND worker = ? AND state = '{LEASED}'",
+            (json.dumps(payload), time.time(), job.job_id, worker),
+        ))
+
+    def fail(self, job: Job, worker: str, error: str):
+        """Retry the job later with backoff, or mark it failed once it used up its attempts."""
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            state, available_at = FAILED, now
+        else:
+            state, available_at = PENDING, now + backoff(job.attempts)
+        self._transaction(lambda: self._conn.execute(
+            "UPDATE job SET state = ?, available_at = ?, worker = NULL, last_error = ?, finished = ? "
+            "WHERE job_id = ? AND worker = ?",
+            (state, available_at, error, now if state == FAILED else None, job.job_id, worker),
+        ))
+
+    def stats(self) -> QueueStats:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute(
+                f"SELECT state, COUNT(*) FROM job WHERE state != '{DONE}' GROUP BY state"
+            ).fetchall())
+            done = self._conn.execute(
+                f"SELECT COUNT(*) FROM job WHERE state = '{DONE}' AND finished >= ?", (now - 3600,)
+            ).fetchone()[0]
+            oldest = self._conn.execute(
+                f"SELECT MIN(enqueued) FROM job WHERE state = '{PENDING}' AND available_at <= ?", (now,)
+            ).fetchone()[0]
+        return QueueStats(
+            pending=counts.get(PENDING, 0),
+            leased=counts.get(LEASED, 0),
+            failed=counts.get(FAILED, 0),
+            done_last_hour=done,
+            oldest_pending_age=now - oldest if oldest is not None else None,
+        )
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than `older_than`; failed ones are kept for inspection. Returns how many."""
+        return self._transaction(lambda: self._conn.execute(
+            f"DELETE FROM job WHERE state = '{DONE}' AND finished < ?", (older_than,)
+        ).rowcount)
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.job_queue
+    stats = JobQueue().stats()
+    lag = f"{stats.oldest_pending_age:.0f}s" if stats.oldest_pending_age is not None else "-"
+    print(f"📊 Job queue: {stats.pending} pending (oldest waiting {lag}), {stats.leased} in progress, "
+          f"{stats.failed} failed, {stats.done_last_hour} done in the last hour")
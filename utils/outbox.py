@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import OUTBOX_DB, OUTBOX_RETENTION_DAYS
+
+
+logger = setup_logger()
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"
+
+
+@dataclass
+class OutboxItem:
+    item_id: int
+    topic: str
+    key: str
+    payload: dict
+    attempts: int
+    created: float
+
+
+def backoff(attempts: int, base: float = 5, maximum: float = 3600) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    delay = min(base * 2 ** (attempts - 1), maximum)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class Outbox:
+    """
+    Durable queue of outgoing work in SQLite, shared by every topic (alerts,
+    replies, …).
+
+    Items are leased rather than removed: a leased item that is neither
+    completed nor retried before its lease runs out (e.g. the process died)
+    becomes available again. Failed items are retried with backoff and
+    moved to the dead state after `max_attempts`. Done items are purged
+    once they are older than `retention` seconds.
+    """
+
+    def __init__(self, path: str = OUTBOX_DB, retention: float = OUTBOX_RETENTION_DAYS * 86400):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.retention = retention
+        self._last_purge: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox_item (
+                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                created REAL NOT NULL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS outbox_item_ready ON outbox_item (topic, state, available_at);
+            CREATE INDEX IF NOT EXISTS outbox_item_key ON outbox_item (topic, key, state);
+            """
+        )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def put(self, topic: str, key: str, payload: dict, delay: float = 0) -> int:
+        now = time.time()
+        return self._transaction(lambda: self._conn.execute(
+            "INSERT INTO outbox_item (topic, key, payload, state, available_at, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (topic, key, json.dumps(payload, ensure_ascii=False), PENDING, now + delay, now),
+        ).lastrowid)
+
+    def lease(self, topic: str, lease_seconds: float, limit: int = 100, whole_keys: bool = False) -> List[OutboxItem]:
+        """
+        Lease up to `limit` items that are ready. With `whole_keys`, every
+        pending item of a key that has a ready item is leased with it, even
+        those not yet available, so they can be handled together.
+        """
+        def lease():
+            now = time.time()
+            # A leased item's available_at is when its lease runs out
+            ready = f"topic = ? AND state IN ('{PENDING}', '{LEASED}') AND available_at <= ?"
+            if whole_keys:
+                where = f"""
+                    topic = ? AND (state = '{PENDING}' OR (state = '{LEASED}' AND available_at <= ?))
+                    AND key IN (SELECT DISTINCT key FROM outbox_item WHERE {ready} LIMIT ?)
+                """
+                params = (topic, now, topic, now, limit)
+            else:
+                where, params = f"{ready} ORDER BY item_id LIMIT ?", (topic, now, limit)
+            rows = self._conn.execute(
+                f"SELECT item_id, topic, key, payload, attempts, created FROM outbox_item WHERE {where}", params
+            ).fetchall()
+            self._conn.executemany(
+                f"UPDATE outbox_item SET state = '{LEASED}', available_at = ? WHERE item_id = ?",
+                [(now + lease_seconds, row[0]) for row in rows],
+            )
+            return [OutboxItem(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5]) for row in rows]
+
+        return self._transaction(lease)
+
+    def complete(self, item_ids: List[int]):
+        self._transaction(lambda: self._conn.executemany(
+            f"UPDATE outbox_item SET state = '{DONE}', last_error = NULL WHERE item_id = ?",
+            [(item_id,) for item_id in item_ids],
+        ))
+
+    def defer(self, item_ids: List[int], available_at: float):
+        """Put leased items back without counting an attempt, e.g. when rate limited."""
+        self._transaction(lambda: self._conn.executemany(
+            f"UPDATE outbox_item SET state = '{PENDING}', available_at = ? WHERE item_id = ?",
+            [(available_at, item_id) for item_id in item_ids],
+        ))
+
+    def fail(self, items: List[OutboxItem], error: str, max_attempts: int) -> List[OutboxItem]:
+        """Schedule a retry of failed items with backoff; returns those that ran out of attempts."""
+        dead = [item for item in items if item.attempts + 1 >= max_attempts]
+        now = time.time()
+
+        def fail():
+            for item in items:
+                state = DEAD if item in dead else PENDING
+                self._conn.execute(
+                    "UPDATE outbox_item SET state = ?, attempts = attempts + 1, available_at = ?, last_error = ? "
+                    "WHERE item_id = ?",
+                    (state, now + backoff(item.attempts + 1), error, item.item_id),
+                )
+
+        self._transaction(fail)
+        return dead
+
+    def next_available(self, topic: str) -> Optional[float]:
+        """When the next item of the topic becomes ready, None if there is nothing left to do."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT MIN(available_at) FROM outbox_item WHERE topic = ? AND state IN ('{PENDING}', '{LEASED}')",
+                (topic,),
+            ).fetchone()
+        return row[0]
+
+    def has_key(self, topic: str, key: str) -> bool:
+        """Whether anything was ever queued under `key`, in any state."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM outbox_item WHERE topic = ? AND key = ? LIMIT 1", (topic, key)
+            ).fetchone() is not None
+
+    def counts(self, topic: str) -> dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT state, COUNT(*) FROM outbox_item WHERE topic = ? GROUP BY state", (topic,)
+            ).fetchall())
+
+    def purge(self, topic: str, older_than: float) -> int:
+        """Delete the topic's done items created before `older_than`; dead ones are kept for inspection."""
+        return self._transaction(lambda: self._conn.execute(
+            f"DELETE FROM outbox_item WHERE topic = ? AND state = '{DONE}' AND created < ?", (topic, older_than)
+        ).rowcount)
+
+    def purge_expired(self, topic: str) -> int:
+        """Purge the topic's done items past the retention period, at most once an hour; returns how many."""
+        now = time.time()
+        if now - self._last_purge.get(topic, 0) < 3600:
+            return 0
+        self._last_purge[topic] = now
+        purged = self.purge(topic, now - self.retention)
+        if purged:
+            logger.info("Purged %d sent %s items from the outbox", purged, topic)
+        return purged
+
+
+outbox = Outbox()
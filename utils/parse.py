@@ -1,37 +1,195 @@
-
 import time
-from typing import List, Dict
+import asyncio
+from typing import List, Optional
 from llama_cloud_services import LlamaParse
 import os
 from dotenv import load_dotenv
 
+from logger import setup_logger
+from constants import EXTRACT_CONCURRENCY, EXTRACT_TIMEOUT_SECONDS, LOCAL_TEXT_LAYER, LOCAL_TEXT_MIN_CHARS
+from utils.parse_cache import ParseCache
+from utils import pdf_text
+
 load_dotenv()
 
+logger = setup_logger()
+
+# Anything that changes the parser output must be part of the cache key
+PARSER_SETTINGS = {
+    "parser": "llamaparse",
+    "language": "en",
+    "split_by_page": True,
+    "local_text_layer": LOCAL_TEXT_LAYER,
+    "local_text_min_chars": LOCAL_TEXT_MIN_CHARS,
+}
+
 parser = LlamaParse(
     api_key=os.getenv("LLAMAPARSE_API_KEY"),
     num_workers=4,       # if multiple files passed, split in `num_workers` API calls
     verbose=True,
-    language="en",       # optionally define a language, default=en
+    language=PARSER_SETTINGS["language"],       # optionally define a language, default=en
 )
 
+parse_cache = ParseCache()
+
+# Shared by every email so the total number of files in flight stays bounded
+extract_semaphore = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+
+
+def _cached_pages(file_path: str) -> tuple[str, Optional[List[str]]]:
+    key = ParseCache.key_for_file(file_path, PARSER_SETTINGS)
+    pages = parse_cache.get(key)
+    if pages is not None:
+        logger.info("Parse cache hit for %s (%s)", file_path, parse_cache.stats())
+    return key, pages
+
+
+def _markdown_pages(result) -> List[str]:
+    markdown_documents = result.get_markdown_documents(split_by_page=PARSER_SETTINGS["split_by_page"])
+    return [page.text for page in markdown_documents]
+
+
+def _local_pages(file_path: str) -> Optional[List[Optional[str]]]:
+    """Text-layer pages of the file, None for pages that still need LlamaParse."""
+    if not LOCAL_TEXT_LAYER:
+        return None
+    return pdf_text.text_layer_pages(file_path)
 
-def extract_from_file(file_path: str) -> List[Dict[str, str]]:
+
+def _remote_target(file_path: str, local: Optional[List[Optional[str]]]) -> Optional[str]:
     """
-    Submit a local file to LlamaParse and return extracted text sections
+    Return the file to send to LlamaParse: the original file, a PDF with only
+    the pages lacking a usable text layer, or None if every page was local.
     """
-    # Submit and poll
-    result = parser.parse(file_path)
-    markdown_documents = result.get_markdown_documents(split_by_page=True)
+    if local is None:
+        return file_path
+    missing = [i for i, page in enumerate(local) if page is None]
+    logger.info("Text layer usable for %d/%d pages of %s", len(local) - len(missing), len(local), file_path)
+    if not missing:
+        return None
+    if len(missing) == len(local):
+        return file_path
+    return pdf_text.write_page_subset(file_path, missing)
+
+
+def _merge_pages(local: Optional[List[Optional[str]]], remote: List[str]) -> List[str]:
+    """Fill the pages without a text layer with LlamaParse output, keeping page order."""
+    if local is None:
+        return remote
+    remote_pages = iter(remote)
+    return [page if page is not None else next(remote_pages, "") for page in local]
+
+
+def _store_pages(file_path: str, key: str, pages: List[str]) -> List[str]:
+    parse_cache.put(key, pages)
+    logger.info("Parse cache miss for %s (%s)", file_path, parse_cache.stats())
+    return pages
 
+
+def join_pages(pages: List[str]) -> str:
     full_text = ""
-    for page in markdown_documents:
-        full_text += page.text + "\n\n"
+    for page in pages:
+        full_text += page + "\n\n"
 
     return full_text
 
 
+def extract_pages(file_path: str) -> List[str]:
+    """
+    Return the markdown of each page of a local file, using the parse cache
+    and the PDF text layer where possible and only submitting the remaining
+    pages to LlamaParse
+    """
+    key, pages = _cached_pages(file_path)
+    if pages is not None:
+        return pages
+
+    local = _local_pages(file_path)
+    target = _remote_target(file_path, local)
+    remote = []
+    if target is not None:
+        try:
+            # Submit and poll
+            remote = _markdown_pages(parser.parse(target))
+        finally:
+            if target != file_path:
+                os.remove(target)
+    return _store_pages(file_path, key, _merge_pages(local, remote))
+
+
+def extract_from_file(file_path: str) -> str:
+    """
+    Extract the text of all pages of a local file
+    """
+    return join_pages(extract_pages(file_path))
+
+
+async def _to_thread(func, *args, discard=None):
+    """
+    asyncio.to_thread that, when cancelled (e.g. by the extraction timeout),
+    still waits for the thread before re-raising: the thread can't be
+    stopped, and the caller releases the file it reads once we return.
+    `discard` is called with a result the cancelled caller won't use.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        if future.exception() is None and discard is not None:
+            discard(future.result())
+        raise
+
+
+def _discard_target(file_path: str, target: Optional[str]):
+    if target is not None and target != file_path:
+        os.remove(target)
+
+
+async def aextract_pages(file_path: str) -> List[str]:
+    """Async version of extract_pages."""
+    key, pages = await _to_thread(_cached_pages, file_path)
+    if pages is not None:
+        return pages
+
+    local = await _to_thread(_local_pages, file_path)
+    target = await _to_thread(
+        _remote_target, file_path, local, discard=lambda target: _discard_target(file_path, target)
+    )
+    remote = []
+    if target is not None:
+        try:
+            remote = _markdown_pages(await parser.aparse(target))
+        finally:
+            _discard_target(file_path, target)
+    return await _to_thread(_store_pages, file_path, key, _merge_pages(local, remote))
+
+
+async def _extract_limited(file_path: str, timeout: float) -> Optional[List[str]]:
+    async with extract_semaphore:
+        try:
+            return await asyncio.wait_for(aextract_pages(file_path), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Extraction of %s timed out after %ss", file_path, timeout)
+        except Exception as e:
+            logger.error("Extraction of %s failed: %s", file_path, e, exc_info=True)
+    return None
+
+
+async def extract_all(file_paths: List[str], timeout: float = EXTRACT_TIMEOUT_SECONDS) -> List[Optional[List[str]]]:
+    """
+    Extract the pages of several files concurrently, limited by the global
+    extraction semaphore. Results are in the same order as `file_paths`;
+    files that fail or exceed `timeout` seconds give None. A timed-out file
+    is only given up once the thread reading it has finished, so the caller
+    may delete the files as soon as this returns.
+    """
+    return await asyncio.gather(*(_extract_limited(file_path, timeout) for file_path in file_paths))
+
+
 if __name__ == "__main__":
     # Example usage
     file_path = "Faktura_2071.pdf"  # Replace with your file path
     extracted_text = extract_from_file(file_path)
-    print(extracted_text)
\ No newline at end of file
+    print(extracted_text)
+    print(parse_cache.stats())
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Optional
+
+from logger import setup_logger
+from constants import PARSE_CACHE_DIR, PARSE_CACHE_MAX_MB, PARSE_CACHE_MAX_AGE_DAYS
+
+
+logger = setup_logger()
+
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache of parsed documents.
+
+    Entries are keyed by the SHA-256 of the file bytes plus the parser
+    settings and hold the per-page markdown. The cache is evicted
+    least-recently-used first once it exceeds `max_bytes`, and entries older
+    than `max_age` seconds are dropped regardless of use.
+
+    The directory is only scanned when the size tracked since the last scan
+    crosses `max_bytes`, or `evict_interval` seconds after the last scan so
+    expired entries and writes by other processes are picked up. A scan
+    trims the cache to 90% of `max_bytes` so the next few puts don't
+    trigger another one.
+    """
+
+    def __init__(
+        self,
+        directory: str = PARSE_CACHE_DIR,
+        max_bytes: int = PARSE_CACHE_MAX_MB * 1024 * 1024,
+        max_age: float = PARSE_CACHE_MAX_AGE_DAYS * 24 * 3600,
+        evict_interval: float = 3600,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._size: Optional[int] = None  # bytes as of the last scan plus puts since; None until scanned
+        self._last_evict = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key_for_file(file_path: str, settings: dict) -> str:
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[list[str]]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        if entry is not None and time.time() - entry["created"] > self.max_age:
+            self._remove(path)
+            entry = None
+
+        if entry is not None:
+            # Bump mtime so eviction treats this entry as recently used
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                entry = None  # evicted (possibly by another process) since we read it
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["pages"]
+
+    def put(self, key: str, pages: list[str]):
+        path = self._path(key)
+        # A unique temporary name, so concurrent writers in other threads or processes never share one
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"created": time.time(), "pages": pages}, f, ensure_ascii=False)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            due = (
+                self._size is None
+                or self._size > self.max_bytes
+                or time.time() - self._last_evict > self.evict_interval
+            )
+        if due:
+            self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # removed by another process meanwhile
+            if entry.name.endswith(".tmp") and now - stat.st_mtime > 3600:
+                self._remove(entry.path)  # left behind by a writer that crashed
+            if not entry.name.endswith(".json"):
+                continue
+            # mtime is the last access; ctime can't be trusted across platforms,
+            # so expiry by creation time is enforced in get()
+            if now - stat.st_mtime > self.max_age:
+                self._remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
+                self._remove(path)
+                total -= size
+        with self._lock:
+            self._size = total
+            self._last_evict = now
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import LOCAL_TEXT_MIN_CHARS
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # optional dependency; without it every page goes to LlamaParse
+    PdfReader = PdfWriter = None
+
+
+logger = setup_logger()
+
+
+def usable_text(text: Optional[str], min_chars: int = LOCAL_TEXT_MIN_CHARS) -> bool:
+    """
+    Decide whether a page's text layer is good enough to skip OCR: it must
+    have a reasonable amount of text, and that text must be mostly readable
+    characters rather than glyph garbage from a broken font mapping.
+    """
+    if not text:
+        return False
+    stripped = "".join(text.split())
+    if len(stripped) < min_chars:
+        return False
+    readable = sum(1 for c in stripped if c.isalnum() or c in ".,:;-–/()%€$£+*#'\"&@")
+    return readable / len(stripped) >= 0.8 and stripped.count("�") <= len(stripped) * 0.01
+
+
+def text_layer_pages(file_path: str) -> Optional[List[Optional[str]]]:
+    """
+    Return the text layer of each page of a PDF, with None for pages that
+    need OCR (scanned or image-only). Returns None when the file is not a
+    readable PDF or pypdf is not installed.
+    """
+    if PdfReader is None or not file_path.lower().endswith(".pdf"):
+        return None
+    try:
+        reader = PdfReader(file_path)
+        pages = []
+        for page in reader.pages:
+            text = page.extract_text()
+            pages.append(text if usable_text(text) else None)
+        return pages
+    except Exception as e:
+        logger.warning("Could not read text layer of %s: %s", file_path, e)
+        return None
+
+
+def write_page_subset(file_path: str, page_indexes: List[int]) -> str:
+    """Write the given pages of a PDF to a temporary file and return its path."""
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for index in page_indexes:
+        writer.add_page(reader.pages[index])
+
+    fd, subset_path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        writer.write(f)
+    return subset_path
@@ -0,0 +1,269 @@
+"""
+Durable store of the financial records extracted by store_tool.
+
+Writes are queued and committed in batches by a background thread, so the
+tool call returns as soon as the record has an id.
+"""
+
+import os
+import sys
+import time
+import atexit
+import uuid
+import sqlite3
+import threading
+from dataclasses import dataclass, astuple, fields
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from logger import setup_logger
+from constants import RECORDS_DB, RECORDS_BATCH_SIZE, RECORDS_FLUSH_INTERVAL
+from utils.outbox import backoff
+
+
+logger = setup_logger()
+
+
+@dataclass
+class FinancialRecord:
+    record_id: str
+    user: str
+    sender: str
+    due_date: Optional[str]  # ISO date, None if the document had none
+    amount: Optional[float]
+    currency: Optional[str]
+    amount_text: str  # the amount as the agent gave it
+    description: str
+    category: str
+    created: float
+
+
+_COLUMNS = [f.name for f in fields(FinancialRecord)]
+
+
+class RecordStore:
+    """
+    SQLite (WAL) store of financial records, indexed for the per-user
+    queries below. `add` only enqueues; a writer thread inserts queued
+    records in one transaction every `flush_interval` seconds or
+    `batch_size` records, whichever comes first. A batch that fails to
+    commit goes back to the front of the queue and is retried with backoff.
+    """
+
+    def __init__(
+        self,
+        path: str = RECORDS_DB,
+        batch_size: int = RECORDS_BATCH_SIZE,
+        flush_interval: float = RECORDS_FLUSH_INTERVAL,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[FinancialRecord] = []
+        self._changed = threading.Condition()
+        self._written = 0
+        self._enqueued = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-65536")  # 64 MB, keeps the index pages hot
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS financial_record (
+                record_id TEXT PRIMARY KEY,
+                user TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                due_date TEXT,
+                amount REAL,
+                currency TEXT,
+                amount_text TEXT NOT NULL,
+                description TEXT NOT NULL,
+                category TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS financial_record_user_due ON financial_record (user, due_date);
+            CREATE INDEX IF NOT EXISTS financial_record_user_category ON financial_record (user, category, due_date);
+            CREATE INDEX IF NOT EXISTS financial_record_sender ON financial_record (sender);
+            """
+        )
+        self._query_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="record-writer", daemon=True)
+        self._writer.start()
+
+    def add(
+        self,
+        user: str,
+        sender: str,
+        due_date: Optional[str],
+        amount: Optional[float],
+        currency: Optional[str],
+        amount_text: str,
+        description: str,
+        category: str,
+    ) -> str:
+        """Queue a record for writing and return its id right away."""
+        record = FinancialRecord(
+            # Time-ordered ids append to the primary key index instead of landing at random pages
+            record_id=f"{time.time_ns():016x}{uuid.uuid4().hex[:8]}",
+            user=user,
+            sender=sender,
+            due_date=due_date,
+            amount=amount,
+            currency=currency,
+            amount_text=amount_text,
+            description=description,
+            category=category.strip().lower(),
+            created=time.time(),
+        )
+        with self._changed:
+            self._pending.append(record)
+            self._enqueued += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._changed.notify_all()
+        return record.record_id
+
+    def _write_each(self, insert: str, batch: List[FinancialRecord]):
+        """Write records one at a time, so one the table rejects doesn't hold up the rest."""
+        for record in batch:
+            try:
+                with self._query_lock, self._conn:
+                    self._conn.execute(insert, astuple(record))
+            except sqlite3.IntegrityError as e:
+                # Retrying can't help; the full record is logged so it can be restored by hand
+                logger.error("Financial record rejected by the database (%s): %s", e, astuple(record))
+
+    def _write_loop(self):
+        insert = f"INSERT OR REPLACE INTO financial_record ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+        failures = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._pending)
+                # Give more records a chance to join the transaction
+                self._changed.wait_for(lambda: len(self._pending) >= self.batch_size, self.flush_interval)
+                batch, self._pending = self._pending, []
+            try:
+                try:
+                    with self._query_lock, self._conn:
+                        self._conn.executemany(insert, [astuple(record) for record in batch])
+                except sqlite3.IntegrityError:
+                    self._write_each(insert, batch)
+            except sqlite3.Error as e:
+                # Callers already have their record ids, so the batch must not be dropped
+                failures += 1
+                delay = backoff(failures, base=0.5, maximum=60)
+                logger.error(
+                    "Failed to write %d financial records (attempt %d), retrying in %.1fs: %s",
+                    len(batch), failures, delay, e,
+                )
+                with self._changed:
+                    self._pending[:0] = batch
+                time.sleep(delay)
+                continue
+            failures = 0
+            with self._changed:
+                self._written += len(batch)
+                self._changed.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every record queued so far is written."""
+        with self._changed:
+            target = self._enqueued
+            return self._changed.wait_for(lambda: self._written >= target, timeout)
+
+    def _query(self, sql: str, params: tuple) -> list:
+        with self._query_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, record_id: str) -> Optional[FinancialRecord]:
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM financial_record WHERE record_id = ?", (record_id,))
+        return FinancialRecord(*rows[0]) if rows else None
+
+    def upcoming_dues(self, user: str, days: int = 30, today: Optional[date] = None) -> List[FinancialRecord]:
+        """Records due from today through the next `days` days, soonest first."""
+        today = today or date.today()
+        rows = self._query(
+            f"""
+            SELECT {', '.join(_COLUMNS)} FROM financial_record
+            WHERE user = ? AND due_date BETWEEN ? AND ?
+            ORDER BY due_date
+            """,
+            (user, today.isoformat(), (today + timedelta(days=days)).isoformat()),
+        )
+        return [FinancialRecord(*row) for row in rows]
+
+    def monthly_totals(self, user: str, month: str) -> List[tuple[str, Optional[str], float, int]]:
+        """(category, currency, total, count) for records due in `month` ("YYYY-MM")."""
+        start = datetime.strptime(month, "%Y-%m").date()
+        end = (start + timedelta(days=32)).replace(day=1)
+        return self._query(
+            """
+            SELECT category, currency, SUM(amount), COUNT(*) FROM financial_record
+            WHERE user = ? AND due_date >= ? AND due_date < ? AND amount IS NOT NULL
+            GROUP BY category, currency
+            ORDER BY category, currency
+            """,
+            (user, start.isoformat(), end.isoformat()),
+        )
+
+
+def benchmark(count: int = 1_000_000, path: str = "state/records_benchmark.db"):
+    """Insert `count` records and time inserts and typical range queries."""
+    import random
+    import statistics
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    store = RecordStore(path)
+    users = [f"user{i}@example.com" for i in range(1000)]
+    senders = [f"billing@vendor{i}.se" for i in range(5000)]
+    categories = ["utilities", "rent", "insurance", "subscriptions", "groceries", "travel", "telecom", "other"]
+    start_day = date(2023, 1, 1)
+
+    add_latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        due = start_day + timedelta(days=random.randrange(3 * 365))
+        t = time.perf_counter()
+        store.add(
+            random.choice(users), random.choice(senders), due.isoformat(),
+            round(random.uniform(10, 20000), 2), "SEK", "", f"Invoice {i}", random.choice(categories),
+        )
+        add_latencies.append(time.perf_counter() - t)
+    enqueued = time.perf_counter() - started
+    store.flush()
+    written = time.perf_counter() - started
+
+    def timed(fn, runs: int = 200) -> tuple[float, float]:
+        latencies = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        return statistics.median(latencies) * 1000, latencies[int(runs * 0.99) - 1] * 1000
+
+    today = date(2024, 6, 1)
+    upcoming = timed(lambda: store.upcoming_dues(random.choice(users), 30, today))
+    totals = timed(lambda: store.monthly_totals(random.choice(users), "2024-06"))
+    by_sender = timed(lambda: store._query(
+        "SELECT COUNT(*) FROM financial_record WHERE sender = ?", (random.choice(senders),)
+    ))
+
+    add_latencies.sort()
+    print(f"📊 {count:,} records in {path}")
+    print(f"   add(): p50 {statistics.median(add_latencies) * 1e6:.1f} µs, p99 {add_latencies[int(count * 0.99) - 1] * 1e6:.1f} µs")
+    print(f"   enqueue all: {enqueued:.1f}s, written to disk: {written:.1f}s ({count / written:,.0f} records/s)")
+    print(f"   upcoming_dues (30 days):  p50 {upcoming[0]:.2f} ms, p99 {upcoming[1]:.2f} ms")
+    print(f"   monthly_totals:           p50 {totals[0]:.2f} ms, p99 {totals[1]:.2f} ms")
+    print(f"   count by sender:          p50 {by_sender[0]:.2f} ms, p99 {by_sender[1]:.2f} ms")
+
+
+record_store = RecordStore()
+atexit.register(record_store.flush, 5)
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.records [record count]
+    benchmark(*(int(v) for v in sys.argv[1:2]))
@@ -0,0 +1,191 @@
+import os
+import time
+import heapq
+import sqlite3
+import asyncio
+import threading
+from dataclasses import dataclass
+from collections import defaultdict
+from typing import List, Optional, Protocol
+
+from logger import setup_logger
+from constants import REMINDER_DB, REMINDER_COALESCE_SECONDS, STORE_POLL_SECONDS
+
+
+logger = setup_logger()
+
+
+@dataclass
+class Reminder:
+    reminder_id: int
+    user: str
+    message: str
+    due: float  # epoch seconds
+
+
+class ReminderSink(Protocol):
+    async def deliver(self, user: str, reminders: List[Reminder]) -> None: ...
+
+
+class LogReminderSink:
+    """Delivers reminders to the log; swap in a calendar/SMS/email sink for real delivery."""
+
+    async def deliver(self, user: str, reminders: List[Reminder]):
+        lines = "; ".join(f"{r.message} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(r.due))})" for r in reminders)
+        logger.info("⏰ Reminder for %s: %s", user, lines)
+
+
+class ReminderStore:
+    """Pending and delivered reminders in SQLite, so they survive restarts."""
+
+    def __init__(self, path: str = REMINDER_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS reminder (
+                reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT NOT NULL,
+                message TEXT NOT NULL,
+                due REAL NOT NULL,
+                delivered REAL
+            );
+            CREATE INDEX IF NOT EXISTS reminder_pending ON reminder (due) WHERE delivered IS NULL;
+            """
+        )
+
+    def add(self, user: str, message: str, due: float) -> Reminder:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO reminder (user, message, due) VALUES (?, ?, ?)", (user, message, due)
+            )
+        return Reminder(cursor.lastrowid, user, message, due)
+
+    def pending(self, after_id: int = 0) -> List[tuple[float, int, str]]:
+        """(due, reminder_id, user) of every undelivered reminder with an id above `after_id`."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT due, reminder_id, user FROM reminder WHERE delivered IS NULL AND reminder_id > ?", (after_id,)
+            ).fetchall()
+
+    def load(self, reminder_ids: List[int]) -> List[Reminder]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT reminder_id, user, message, due FROM reminder WHERE reminder_id IN ({','.join('?' * len(reminder_ids))})",
+                reminder_ids,
+            ).fetchall()
+        return sorted((Reminder(*row) for row in rows), key=lambda r: r.due)
+
+    def mark_delivered(self, reminder_ids: List[int]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE reminder SET delivered = ? WHERE reminder_id = ?",
+                [(time.time(), reminder_id) for reminder_id in reminder_ids],
+            )
+
+
+class ReminderScheduler:
+    """
+    Fires reminders from a heap ordered by due time, on the asyncio loop.
+
+    The heap holds only (due, id, user); messages are read from the store
+    when they fire. The loop sleeps until the earliest reminder is due, or
+    at most `STORE_POLL_SECONDS` to pick up reminders other processes
+    stored, so an idle scheduler costs next to nothing however many
+    reminders are pending.
+    Reminders for the same user that fall due within `coalesce_window`
+    seconds of each other are delivered as one notification.
+    """
+
+    def __init__(
+        self,
+        store: Optional[ReminderStore] = None,
+        sink: Optional[ReminderSink] = None,
+        coalesce_window: float = REMINDER_COALESCE_SECONDS,
+    ):
+        self.store = store or ReminderStore()
+        self.sink = sink or LogReminderSink()
+        self.coalesce_window = coalesce_window
+        self._heap: List[tuple[float, int, str]] = []
+        self._last_id = 0  # highest reminder id already in the heap
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Reload pending reminders and start firing them; overdue ones fire right away."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._heap = self.store.pending()
+        heapq.heapify(self._heap)
+        self._last_id = max((entry[1] for entry in self._heap), default=0)
+        logger.info("Loaded %d pending reminders", len(self._heap))
+        self._task = asyncio.create_task(self._run())
+
+    def add(self, user: str, message: str, due: float) -> Reminder:
+        """Store a reminder and schedule it. Safe to call from any thread or process."""
+        reminder = self.store.add(user, message, due)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return reminder
+
+    async def _load_new(self):
+        """Push reminders stored since the last look, by this process or another one."""
+        for entry in await asyncio.to_thread(self.store.pending, self._last_id):
+            self._last_id = max(self._last_id, entry[1])
+            heapq.heappush(self._heap, entry)
+
+    def _push(self, entry: tuple[float, int, str]):
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wake.set()  # new earliest reminder, recompute the sleep
+
+    def _pop_due(self) -> dict[str, List[int]]:
+        """Pop every reminder that is due, plus those of the same users due within the coalesce window."""
+        now = time.time()
+        due_users = defaultdict(list)
+        held = []
+        while self._heap and self._heap[0][0] <= now + self.coalesce_window:
+            due, reminder_id, user = heapq.heappop(self._heap)
+            if due <= now or user in due_users:
+                due_users[user].append(reminder_id)
+            else:
+                held.append((due, reminder_id, user))
+        for entry in held:
+            if entry[2] in due_users:
+                due_users[entry[2]].append(entry[1])
+            else:
+                heapq.heappush(self._heap, entry)
+        return due_users
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self._load_new()
+            except Exception as e:
+                logger.error("Failed to load new reminders: %s", e)
+            timeout = self._heap[0][0] - time.time() if self._heap else STORE_POLL_SECONDS
+            if timeout > 0:
+                timeout = min(timeout, STORE_POLL_SECONDS)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for user, reminder_ids in self._pop_due().items():
+                reminders = await asyncio.to_thread(self.store.load, reminder_ids)
+                try:
+                    await self.sink.deliver(user, reminders)
+                except Exception as e:
+                    logger.error("Failed to deliver %d reminders to %s: %s; retrying in 60s", len(reminders), user, e)
+                    for reminder in reminders:
+                        self._push((time.time() + 60, reminder.reminder_id, reminder.user))
+                    continue
+                await asyncio.to_thread(self.store.mark_delivered, reminder_ids)
+
+
+reminder_scheduler = ReminderScheduler()
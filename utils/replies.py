@@ -0,0 +1,85 @@
+import time
+import asyncio
+from typing import Optional
+
+from logger import setup_logger
+from constants import REPLY_MAX_ATTEMPTS, STORE_POLL_SECONDS
+from utils.email import send_email
+from utils.idempotency import REPLIED, processed_store
+from utils.outbox import Outbox, outbox as default_outbox
+
+
+logger = setup_logger()
+
+TOPIC = "reply"
+
+
+class ReplySender:
+    """
+    Sends agent replies from the durable outbox in the background.
+
+    The processing path only enqueues a reply, so it never waits on SMTP
+    and a failed send doesn't lose the reply. Sends are retried with
+    backoff; after `max_attempts` the reply is kept as dead in the outbox
+    for inspection. Queued replies survive restarts.
+    """
+
+    def __init__(self, store: Optional[Outbox] = None, max_attempts: int = REPLY_MAX_ATTEMPTS):
+        self.outbox = store or default_outbox
+        self.max_attempts = max_attempts
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def is_queued(self, message_key: str) -> bool:
+        return self.outbox.has_key(TOPIC, message_key)
+
+    def enqueue(self, message_key: str, to_addrs, subject: str, body: str, from_user: Optional[str] = None) -> int:
+        """Queue the reply to the message identified by `message_key`. Safe to call from any thread."""
+        item_id = self.outbox.put(
+            TOPIC, message_key, {"to_addrs": to_addrs, "subject": subject, "body": body, "from_user": from_user}
+        )
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return item_id
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                items = await asyncio.to_thread(self.outbox.lease, TOPIC, 300, 20)
+                for item in items:
+                    try:
+                        await asyncio.to_thread(send_email, **item.payload)
+                    except Exception as e:
+                        dead = await asyncio.to_thread(self.outbox.fail, [item], str(e), self.max_attempts)
+                        if dead:
+                            logger.error("Giving up on reply %s to %s after %d attempts: %s",
+                                         item.item_id, item.payload["to_addrs"], self.max_attempts, e)
+                        else:
+                            logger.warning("Failed to send reply %s: %s; will retry", item.item_id, e)
+                        continue
+                    await asyncio.to_thread(self.outbox.complete, [item.item_id])
+                    processed_store.mark(item.key, REPLIED)
+                if items:
+                    continue
+                await asyncio.to_thread(self.outbox.purge_expired, TOPIC)
+                next_at = await asyncio.to_thread(self.outbox.next_available, TOPIC)
+            except Exception as e:
+                logger.error("Reply sender error: %s", e, exc_info=True)
+                next_at = time.time() + 5
+            # Worker processes queue items without waking this loop, so look again every so often
+            timeout = max(next_at - time.time(), 0.05) if next_at is not None else STORE_POLL_SECONDS
+            timeout = min(timeout, STORE_POLL_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+reply_sender = ReplySender()
@@ -0,0 +1,323 @@
+"""
+Search index over agent runs.
+
+Every run saved to the run log is also indexed here: a full-text index
+(SQLite FTS5) over the input, tool names, tool arguments and final
+output, and a table of every tool argument with its numeric value, so
+questions like "store_tool calls with amount > 1000 in the last 30 days"
+are answered from indexes instead of by reading the logs.
+
+The full-text index is contentless (the text lives only in the run log),
+which keeps it a fraction of the log's size. Runs whose segment has been
+deleted by retention drop out of results; `rebuild` also reclaims their
+space.
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from logger import setup_logger
+from agent.invoice_fields import AMOUNT, parse_amount
+from utils.run_log import RunLog, run_log
+
+
+logger = setup_logger()
+
+WHERE = re.compile(r"^\s*([\w.]+)\s*(>=|<=|!=|>|<|=)\s*(.+?)\s*$")
+
+
+@dataclass
+class RunHit:
+    run_id: str
+    timestamp: float  # epoch seconds
+    tools: str
+    subject: str
+    output: str
+
+
+def _flatten(value, name: str = "") -> Iterator[tuple[str, object]]:
+    """(leaf name, value) of every scalar in nested tool arguments."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _flatten(item, name)
+    elif value is not None:
+        yield name, value
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = AMOUNT.search(str(value))
+    return parse_amount(match.group("number")) if match else None
+
+
+class RunIndex:
+    """
+    Search index kept next to a run log. The run log's index is attached
+    so runs it no longer has are left out of results.
+
+    Runs are keyed by their timestamp in microseconds, so a time range is a
+    key range and the full-text index returns the newest matches first.
+    """
+
+    # Argument conditions matching fewer rows than this drive the search;
+    # broader ones are checked per candidate run instead
+    SELECTIVE_ROWS = 2000
+
+    def __init__(self, log: Optional[RunLog] = None, path: Optional[str] = None):
+        self.log = log or run_log
+        path = path or os.path.join(self.log.directory, "search.db")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._create_tables()
+        self._conn.execute("ATTACH DATABASE ? AS log", (os.path.join(self.log.directory, "index.db"),))
+
+    def _create_tables(self):
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS indexed_run (
+                run INTEGER PRIMARY KEY,  -- timestamp in microseconds, bumped on collision
+                run_id TEXT UNIQUE NOT NULL,
+                tools TEXT,
+                subject TEXT,
+                output TEXT
+            );
+            CREATE TABLE IF NOT EXISTS tool_arg (
+                run INTEGER NOT NULL,
+                tool TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT,
+                number REAL
+            );
+            CREATE INDEX IF NOT EXISTS tool_arg_number ON tool_arg (name, number, tool, run);
+            CREATE INDEX IF NOT EXISTS tool_arg_value ON tool_arg (name, value COLLATE NOCASE, tool, run);
+            CREATE INDEX IF NOT EXISTS tool_arg_run ON tool_arg (run, name);
+            CREATE VIRTUAL TABLE IF NOT EXISTS run_text USING fts5(
+                input, tools, arguments, output, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            """
+        )
+
+    def _insert(self, record: dict):
+        if self._conn.execute("SELECT 1 FROM indexed_run WHERE run_id = ?", (record["run_id"],)).fetchone():
+            return  # already indexed
+        tools_used = record.get("reasoning_summary", {}).get("tools_used", [])
+        tool_names = " ".join(tool.get("tool_name", "") for tool in tools_used)
+        arguments = []
+        for tool in tools_used:
+            args = tool.get("arguments")
+            args = args if isinstance(args, dict) else {"arguments": args}
+            arguments.extend((tool.get("tool_name", ""), name, value) for name, value in _flatten(args))
+            if tool.get("reason"):
+                arguments.append((tool.get("tool_name", ""), "reason", tool["reason"]))
+        text = record.get("input") or ""
+        output = str(record.get("final_output") or "")
+        subject = re.search(r"^Subject: (.*)$", text, re.MULTILINE)
+
+        run = int(datetime.fromisoformat(record["timestamp"]).timestamp() * 1_000_000)
+        while self._conn.execute("SELECT 1 FROM indexed_run WHERE run = ?", (run,)).fetchone():
+            run += 1
+        self._conn.execute(
+            "INSERT INTO indexed_run (run, run_id, tools, subject, output) VALUES (?, ?, ?, ?, ?)",
+            (run, record["run_id"], tool_names, subject.group(1)[:200] if subject else "", output[:200]),
+        )
+        self._conn.execute(
+            "INSERT INTO run_text (rowid, input, tools, arguments, output) VALUES (?, ?, ?, ?, ?)",
+            (run, text, tool_names, "\n".join(f"{name}: {value}" for _, name, value in arguments), output),
+        )
+        self._conn.executemany(
+            "INSERT INTO tool_arg (run, tool, name, value, number) VALUES (?, ?, ?, ?, ?)",
+            [(run, tool, name, str(value)[:200], _number(value)) for tool, name, value in arguments],
+        )
+
+    def add(self, record: dict):
+        """Index one run as stored in the run log; runs already indexed are skipped."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(record)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def rebuild(self) -> int:
+        """Re-index every run in the log from scratch, dropping runs the log no longer has."""
+        with self._lock:
+            self._conn.executescript(
+                "DROP TABLE IF EXISTS run_text; DROP TABLE IF EXISTS tool_arg; DROP TABLE IF EXISTS indexed_run;"
+            )
+            self._create_tables()
+            count = 0
+            self._conn.execute("BEGIN IMMEDIATE")
+            for record in self.log:
+                if "run_id" in record and "timestamp" in record:
+                    self._insert(record)
+                    count += 1
+                    if count % 1000 == 0:
+                        self._conn.execute("COMMIT")
+                        self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("COMMIT")
+        return count
+
+    @staticmethod
+    def _condition(condition: str) -> tuple[str, str, object]:
+        """Parse "amount>1000" into (argument name, SQL test on tool_arg, value)."""
+        match = WHERE.match(condition)
+        if match is None:
+            raise ValueError(f"Can't parse condition {condition!r}; use e.g. amount>1000 or category=utilities")
+        name, op, value = match.groups()
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            return name, f"value {op} ?", value  # ISO dates compare as text
+        number = _number(value) if op != "=" or re.fullmatch(r"[\d.,\s]+", value) else None
+        if number is not None:
+            return name, f"number {op} ?", number
+        if op in ("=", "!="):
+            return name, f"value {op} ? COLLATE NOCASE", value
+        raise ValueError(f"{condition!r} compares with {op} but {value!r} is not a number")
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        tool: Optional[str] = None,
+        where: Optional[List[str]] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 20,
+    ) -> List[RunHit]:
+        """
+        Newest runs matching every given filter: an FTS5 `query` (e.g.
+        "elräkning", "output:paid"), a `tool` that was called, `where`
+        conditions on tool arguments such as "amount>1000" or
+        "category=utilities" (restricted to `tool` if given), and a time
+        range in epoch seconds.
+        """
+        if query:
+            # The full-text index yields matches newest first, so it drives
+            sql = [
+                "SELECT r.run, r.run_id, r.tools, r.subject, r.output FROM run_text AS t",
+                "JOIN indexed_run AS r ON r.run = t.rowid WHERE run_text MATCH ?",
+            ]
+            key, params = "t.rowid", [query]
+        else:
+            sql = ["SELECT r.run, r.run_id, r.tools, r.subject, r.output FROM indexed_run AS r WHERE 1"]
+            key, params = "r.run", []
+        if since is not None:
+            sql.append(f"AND {key} >= ?")
+            params.append(int(since * 1_000_000))
+        if until is not None:
+            sql.append(f"AND {key} < ?")
+            params.append(int(until * 1_000_000))
+
+        conditions = [self._condition(condition) for condition in where or []]
+        if tool and not conditions:
+            sql.append("AND EXISTS (SELECT 1 FROM tool_arg AS a WHERE a.run = r.run AND a.tool = ?)")
+            params.append(tool)
+        with self._lock:
+            for name, test, value in conditions:
+                match_params = [name, value] + ([tool] if tool else [])
+                matches = f"SELECT run FROM tool_arg WHERE name = ? AND {test}" + (" AND tool = ?" if tool else "")
+                selective = self._conn.execute(
+                    f"SELECT COUNT(*) FROM ({matches} LIMIT ?)", match_params + [self.SELECTIVE_ROWS]
+                ).fetchone()[0] < self.SELECTIVE_ROWS
+                if selective:
+                    sql.append(f"AND r.run IN ({matches})")
+                else:
+                    per_run = matches.replace("FROM tool_arg WHERE", "FROM tool_arg INDEXED BY tool_arg_run WHERE run = r.run AND")
+                    sql.append(f"AND EXISTS ({per_run})")
+                params.extend(match_params)
+            sql.append("AND EXISTS (SELECT 1 FROM log.run AS l WHERE l.run_id = r.run_id)")
+            sql.append(f"ORDER BY {key} DESC LIMIT ?")
+            params.append(limit)
+            rows = self._conn.execute("\n".join(sql), params).fetchall()
+        return [RunHit(row[1], row[0] / 1_000_000, *row[2:]) for row in rows]
+
+
+run_index = RunIndex()
+
+
+def benchmark(count: int = 100_000, directory: str = "logs/runs_benchmark"):
+    """Log and index `count` synthetic runs, then time typical searches."""
+    import random
+    import shutil
+    import statistics
+
+    shutil.rmtree(directory, ignore_errors=True)
+    log = RunLog(directory)
+    index = RunIndex(log)
+    senders = [f"billing@vendor{i}.se" for i in range(2000)]
+    categories = ["utilities", "rent", "insurance", "subscriptions", "groceries", "travel", "telecom", "other"]
+    words = "faktura invoice elräkning hyra försäkring payment reminder påminnelse bredband mobil resa".split()
+    now = time.time()
+
+    started = time.perf_counter()
+    for i in range(count):
+        stamp = now - random.uniform(0, 365 * 86400)
+        tools = [{"tool_name": "store_tool", "reason": "Invoice to store", "arguments": {"extracted_content": {
+            "due_date": datetime.fromtimestamp(stamp + 20 * 86400).date().isoformat(),
+            "amount": f"{random.uniform(50, 20000):.2f} SEK",
+            "description": " ".join(random.sample(words, 3)),
+            "category": random.choice(categories),
+        }}}]
+        if random.random() < 0.3:
+            tools.append({"tool_name": "set_reminder_tool", "reason": "Due soon", "arguments": {"reminder": {"message": "Pay"}}})
+        record = {
+            "timestamp": datetime.fromtimestamp(stamp).isoformat(),
+            "agent_name": "EmailAgent",
+            "model": "benchmark",
+            "input": f"From: {random.choice(senders)}\nSubject: {' '.join(random.sample(words, 2))} {i}\n"
+                     f"Email Body:\n{' '.join(random.choices(words, k=200))}",
+            "final_output": f"Subject: Processed\n\nStored invoice {i}.",
+            "reasoning_summary": {"tools_used": tools},
+        }
+        log.append(record)
+        index.add(record)
+    elapsed = time.perf_counter() - started
+
+    def timed(fn, runs: int = 50) -> tuple[float, float, int]:
+        latencies = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            hits = fn()
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        return statistics.median(latencies) * 1000, latencies[int(runs * 0.99) - 1] * 1000, len(hits)
+
+    month_ago = now - 30 * 86400
+    queries = {
+        "store_tool amount>1000, last 30 days": lambda: index.search(tool="store_tool", where=["amount>1000"], since=month_ago, limit=1000),
+        "amount>19900 (any time)": lambda: index.search(where=["amount>19900"], limit=1000),
+        "category=utilities, last 30 days": lambda: index.search(where=["category=utilities"], since=month_ago, limit=1000),
+        "text: elräkning": lambda: index.search("elräkning", limit=20),
+        "text: hyra AND resa, last 30 days": lambda: index.search("hyra AND resa", since=month_ago, limit=1000),
+    }
+    size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+    print(f"📊 {count:,} runs in {directory} ({size / 1024 / 1024:.0f} MB), logged and indexed at {count / elapsed:,.0f} runs/s")
+    for name, fn in queries.items():
+        p50, p99, hits = timed(fn)
+        print(f"   {name:40s} p50 {p50:7.2f} ms, p99 {p99:7.2f} ms ({hits} hits)")
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.run_index rebuild   |   python -m utils.run_index benchmark [run count]
+    if sys.argv[1:2] == ["rebuild"]:
+        print(f"🔎 Indexed {run_index.rebuild()} runs")
+    elif sys.argv[1:2] == ["benchmark"]:
+        benchmark(*(int(v) for v in sys.argv[2:3]))
+    else:
+        print("Usage: python -m utils.run_index rebuild | benchmark [run count]")
@@ -0,0 +1,250 @@
+"""
+Append-only store of agent run logs.
+
+Runs are appended as JSON lines to segment files under `RUN_LOG_DIR`,
+with a SQLite index of where each run starts, so one run can be read
+without parsing the rest. With compression each run is its own gzip
+member, which keeps it individually seekable while the segment stays a
+valid `.jsonl.gz` for zcat. Segments are rotated by size and deleted
+once older than the retention period or over the total size limit.
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from logger import setup_logger
+from constants import (
+    RUN_LOG_DIR,
+    RUN_LOG_COMPRESS,
+    RUN_LOG_SEGMENT_MB,
+    RUN_LOG_RETENTION_DAYS,
+    RUN_LOG_MAX_MB,
+)
+
+
+logger = setup_logger()
+
+
+@dataclass
+class RunEntry:
+    run_id: str
+    timestamp: float
+    agent_name: str
+    model: str
+    segment: str
+    offset: int
+    length: int
+
+
+class RunLog:
+    """
+    Segmented run log shared by every process writing to `directory`.
+
+    Appends are serialized through a write transaction on the index, so
+    worker processes can log to the same store.
+    """
+
+    def __init__(
+        self,
+        directory: str = RUN_LOG_DIR,
+        compress: bool = RUN_LOG_COMPRESS,
+        segment_bytes: int = int(RUN_LOG_SEGMENT_MB * 1024 * 1024),
+        retention_days: float = RUN_LOG_RETENTION_DAYS,
+        max_bytes: int = int(RUN_LOG_MAX_MB * 1024 * 1024),
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compress = compress
+        self.segment_bytes = segment_bytes
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS segment (
+                name TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS run (
+                run_id TEXT PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                agent_name TEXT,
+                model TEXT,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS run_timestamp ON run (timestamp);
+            CREATE INDEX IF NOT EXISTS run_segment ON run (segment);
+            """
+        )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _current_segment(self, incoming: int) -> tuple[str, bool]:
+        """The segment to append `incoming` bytes to, and whether it was just started."""
+        row = self._conn.execute("SELECT name, size FROM segment ORDER BY created DESC, name DESC LIMIT 1").fetchone()
+        # An empty segment takes the run even if it alone is bigger than a segment
+        if row is not None and (row[1] + incoming <= self.segment_bytes or row[1] == 0):
+            return row[0], False
+        name = f"runs-{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}.jsonl" + (".gz" if self.compress else "")
+        self._conn.execute("INSERT INTO segment (name, created) VALUES (?, ?)", (name, time.time()))
+        return name, True
+
+    def append(self, record: dict) -> str:
+        """Append a run and return its id; `record` gets "run_id" added if it has none."""
+        record.setdefault("run_id", f"{time.time_ns():016x}{uuid.uuid4().hex[:8]}")
+        record.setdefault("timestamp", datetime.now().isoformat())
+        timestamp = datetime.fromisoformat(record["timestamp"]).timestamp()
+        model = record.get("model")
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        data = gzip.compress(line) if self.compress else line
+
+        def append():
+            name, rotated = self._current_segment(len(data))
+            with open(os.path.join(self.directory, name), "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            self._conn.execute("UPDATE segment SET size = ? WHERE name = ?", (offset + len(data), name))
+            self._conn.execute(
+                "INSERT INTO run (run_id, timestamp, agent_name, model, segment, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record["run_id"], timestamp, record.get("agent_name"), None if model is None else str(model),
+                 name, offset, len(data)),
+            )
+            return rotated
+
+        if self._transaction(append):
+            self.enforce_retention()
+        return record["run_id"]
+
+    def _read(self, segment: str, offset: int, length: int) -> dict:
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if segment.endswith(".gz"):
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def get(self, run_id: str) -> Optional[dict]:
+        """Read one run, or None if it is unknown or its segment was deleted."""
+        with self._lock:
+            row = self._conn.execute("SELECT segment, offset, length FROM run WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._read(*row)
+        except FileNotFoundError:
+            return None
+
+    def entries(self, limit: Optional[int] = None, since: Optional[float] = None) -> List[RunEntry]:
+        """Index entries, newest first, without reading any segment."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, timestamp, agent_name, model, segment, offset, length FROM run "
+                "WHERE timestamp >= ? ORDER BY timestamp DESC LIMIT ?",
+                (since or 0, limit if limit is not None else -1),
+            ).fetchall()
+        return [RunEntry(*row) for row in rows]
+
+    def latest(self) -> Optional[dict]:
+        entries = self.entries(limit=1)
+        return self.get(entries[0].run_id) if entries else None
+
+    def __iter__(self) -> Iterator[dict]:
+        """Every stored run, oldest first, reading each segment sequentially."""
+        with self._lock:
+            segments = [row[0] for row in self._conn.execute("SELECT name FROM segment ORDER BY created, name")]
+        for name in segments:
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                continue
+            try:
+                with (gzip.open(path, "rb") if name.endswith(".gz") else open(path, "rb")) as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # a run whose write was cut short
+            except (EOFError, gzip.BadGzipFile) as e:
+                logger.warning("Run log segment %s ends in a partial run: %s", name, e)
+
+    def enforce_retention(self, now: Optional[float] = None) -> int:
+        """Delete whole segments older than the retention period or beyond the size limit; returns how many."""
+        now = now or time.time()
+
+        def expired():
+            segments = self._conn.execute("SELECT name, created, size FROM segment ORDER BY created DESC, name DESC").fetchall()
+            doomed, total = [], 0
+            for index, (name, created, size) in enumerate(segments):
+                total += size
+                # The newest segment is the one being written to and always stays
+                if index > 0 and (created < now - self.retention_days * 86400 or total > self.max_bytes):
+                    doomed.append(name)
+            for name in doomed:
+                self._conn.execute("DELETE FROM run WHERE segment = ?", (name,))
+                self._conn.execute("DELETE FROM segment WHERE name = ?", (name,))
+            return doomed
+
+        doomed = self._transaction(expired)
+        for name in doomed:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        if doomed:
+            logger.info("Deleted %d expired run log segments", len(doomed))
+        return len(doomed)
+
+
+run_log = RunLog()
+
+
+def import_json_logs(pattern: str = "logs/reasoning_log_*.json", store: Optional[RunLog] = None) -> int:
+    """Move old one-file-per-run reasoning logs into the run log."""
+    store = store or run_log
+    count = 0
+    for path in sorted(glob.glob(pattern)):
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"❌ Skipping {path}: {e}")
+            continue
+        store.append(record)
+        os.remove(path)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.run_log import [glob]   |   python -m utils.run_log retention
+    if sys.argv[1:2] == ["import"]:
+        print(f"📥 Imported {import_json_logs(*sys.argv[2:3])} reasoning logs")
+    elif sys.argv[1:2] == ["retention"]:
+        print(f"🧹 Deleted {run_log.enforce_retention()} segments")
+    else:
+        print("Usage: python -m utils.run_log import [glob] | retention")
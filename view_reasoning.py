@@ -2,17 +2,34 @@
 Simple utility to view reasoning logs
 """
 
+import os
+import re
 import json
 import sys
+import time
+import sqlite3
+import argparse
 from datetime import datetime
-from pathlib import Path
 
+from utils.run_log import run_log
+from utils.run_index import run_index
 
-def view_reasoning_log(log_file: str):
+
+def load_reasoning_log(run: str) -> dict:
+    """Read a run from the run log by id, or an old reasoning_log_*.json file by path."""
+    if os.path.isfile(run):
+        with open(run, 'r') as f:
+            return json.load(f)
+    data = run_log.get(run)
+    if data is None:
+        raise FileNotFoundError(f"No run {run} in {run_log.directory}")
+    return data
+
+
+def view_reasoning_log(run: str):
     """View a reasoning log in a formatted way."""
     try:
-        with open(log_file, 'r') as f:
-            data = json.load(f)
+        data = load_reasoning_log(run)
         
         print(f"\n📋 REASONING LOG VIEWER")
         print(f"{'='*50}")
@@ -37,32 +54,65 @@ def view_reasoning_log(log_file: str):
         print(f"❌ Error reading log file: {e}")
 
 
-def list_reasoning_logs():
-    """List all available reasoning logs."""
-    logs = list(Path('.').glob('reasoning_log_*.json'))
-    if not logs:
-        print("No reasoning logs found in current directory.")
+def list_reasoning_logs(limit: int = 20):
+    """List the most recent runs from the run log index."""
+    entries = run_log.entries(limit=limit)
+    if not entries:
+        print(f"No reasoning logs found in {run_log.directory}.")
         return
     
-    print(f"\n📚 AVAILABLE REASONING LOGS:")
+    print(f"\n📚 LATEST REASONING LOGS:")
     print(f"{'='*40}")
     
-    for log in sorted(logs, reverse=True):  # Most recent first
-        try:
-            with open(log, 'r') as f:
-                data = json.load(f)
-            timestamp = data.get('timestamp', 'Unknown')
-            agent_name = data.get('agent_name', 'Unknown')
-            print(f"   📄 {log.name}")
-            print(f"      └─ {timestamp} | {agent_name}")
-        except:
-            print(f"   📄 {log.name} (corrupted)")
+    for entry in entries:  # Most recent first
+        timestamp = datetime.fromtimestamp(entry.timestamp).isoformat(timespec='seconds')
+        print(f"   📄 {entry.run_id}")
+        print(f"      └─ {timestamp} | {entry.agent_name or 'Unknown'}")
     
-    print(f"\n💡 Usage: python view_reasoning.py <filename>")
+    print(f"\n💡 Usage: python view_reasoning.py <run id>")
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds from "30d", "12h" (that long ago) or an ISO date/time."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([dh])", value)
+    if match:
+        return time.time() - float(match.group(1)) * (86400 if match.group(2) == "d" else 3600)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def search_reasoning_logs(args: list):
+    """Search the run index, e.g. `search --tool store_tool --where "amount>1000" --since 30d`."""
+    parser = argparse.ArgumentParser(prog="python view_reasoning.py search")
+    parser.add_argument("query", nargs="?", help='full-text query over input, tools, arguments and output, e.g. "elräkning" or "output:paid"')
+    parser.add_argument("--tool", help="only runs that called this tool")
+    parser.add_argument("--where", action="append", default=[], help='tool argument condition, e.g. "amount>1000" (repeatable)')
+    parser.add_argument("--since", type=parse_time, help='"30d", "12h" or an ISO date')
+    parser.add_argument("--until", type=parse_time, help='"30d", "12h" or an ISO date')
+    parser.add_argument("--limit", type=int, default=20)
+    options = parser.parse_args(args)
+
+    started = time.perf_counter()
+    try:
+        hits = run_index.search(options.query, options.tool, options.where, options.since, options.until, options.limit)
+    except (ValueError, sqlite3.OperationalError) as e:
+        print(f"❌ {e}")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+
+    print(f"\n🔎 {len(hits)} RUNS ({elapsed:.1f} ms)")
+    print(f"{'='*40}")
+    for hit in hits:
+        timestamp = datetime.fromtimestamp(hit.timestamp).isoformat(timespec='seconds')
+        print(f"   📄 {hit.run_id}")
+        print(f"      └─ {timestamp} | {hit.subject or '-'} | {hit.tools or 'no tools'}")
+    if len(hits) == options.limit:
+        print(f"\n💡 Showing the newest {options.limit}; use --limit for more")
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         list_reasoning_logs()
+    elif sys.argv[1] == "search":
+        search_reasoning_logs(sys.argv[2:])
     else:
         view_reasoning_log(sys.argv[1])